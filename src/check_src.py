@@ -5,8 +5,9 @@ Consolidate common and custom sources into one source list.
 If a custom file has the same name as a common file, the common one is excluded.
 Exclusions can also be manually set for replacement files with different names.
 
-NOTE:  Unfortunately we may need to implement something that allows flexibility
-as to when a module is compiled and available due to depedency issues
+The module and include dependencies between the consolidated sources can be
+written out as a make fragment (see *fortran_dependencies*) so that builds
+can safely be run in parallel with ``make -j``.
 """
 
 from __future__ import print_function
@@ -15,9 +16,16 @@ from __future__ import absolute_import
 from __future__ import print_function
 import sys
 import os
+import hashlib
 import warnings
 import argparse
 
+# The Fortran scanner is shared with the compiler cache in clawutil
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "python", "clawutil"))
+from build_cache import scan_fortran_src, fortran_includes, \
+                        compiler_version, hash_files
+
 
 def check_duplicate_fortran_src(src_list):
     r"""Check to see if there may be hidden fixed-format Fortran files.
@@ -76,6 +84,107 @@ def consolidate_src_lists(src_files, common_src_files, excluded_src_files):
     return src_list
 
 
+def fortran_dependencies(src_files, module_files):
+    r"""
+    Return a make fragment listing the dependencies between *module_files*
+    and *src_files* as they are compiled by Makefile.common.
+
+    A module source *path/name.f90* is compiled by the rule for the target
+    *path/name.mod*, which also creates *path/name.o*, so every object (or
+    module target) depending on a module depends on that target.  Modules
+    defined in ordinary sources are depended on through their object file.
+    Modules not defined in either list (e.g. intrinsic modules) are ignored.
+    """
+
+    targets = {}
+    scanned = []
+    for (src_list, ext) in [(module_files, ".mod"), (src_files, ".o")]:
+        for src_file in src_list:
+            if not os.path.isfile(src_file):
+                # make will report missing sources itself
+                continue
+            target = os.path.splitext(src_file)[0] + ext
+            defined, used, included = scan_fortran_src(src_file)
+            for name in defined:
+                targets.setdefault(name, target)
+            scanned.append((src_file, target, used, included))
+
+    lines = ["# Fortran dependencies generated by check_src.py -- do not edit"]
+    include_files = []
+    for (src_file, target, used, included) in scanned:
+        deps = [targets[name] for name in used
+                if name in targets and targets[name] != target]
+        deps += included
+        if target.endswith(".mod"):
+            # Object created as a side effect of the module rule, only
+            # remake the module if the object has gone missing
+            lines.append("%s.o: %s ; @test -f $@ || (rm -f $< && "
+                         "$(MAKE) -f $(firstword $(MAKEFILE_LIST)) $<)"
+                         % (os.path.splitext(target)[0], target))
+        if len(deps) > 0:
+            lines.append("%s: %s" % (target, " ".join(deps)))
+        include_files += [path for path in included
+                          if path not in include_files]
+
+    # Empty rules so removing an include file does not break the build
+    for path in include_files:
+        lines.append("%s:" % path)
+
+    return "\n".join(lines) + "\n"
+
+
+def library_dependencies(src_files, include_dirs=()):
+    r"""
+    Return a make fragment making the objects of the common library, compiled
+    by Makefile.common into $(COMMON_LIB_OBJDIR), depend on the files included
+    by their sources *src_files* (see *fortran_includes*).
+    """
+
+    lines = ["# Common library dependencies generated by check_src.py -- "
+             "do not edit"]
+    include_files = []
+    for src_file in src_files:
+        if not os.path.isfile(src_file):
+            continue
+        included = fortran_includes(src_file, include_dirs=include_dirs)
+        if len(included) > 0:
+            name = os.path.splitext(os.path.basename(src_file))[0]
+            lines.append("$(COMMON_LIB_OBJDIR)/%s.o: %s"
+                         % (name, " ".join(included)))
+        include_files += [path for path in included
+                          if path not in include_files]
+
+    # Empty rules so removing an include file does not break the build
+    for path in include_files:
+        lines.append("%s:" % path)
+
+    return "\n".join(lines) + "\n"
+
+
+def library_key(compiler, flags, src_files, include_dirs=()):
+    r"""
+    Return a short hash identifying a library compiled from *src_files* with
+    *compiler* and the list of *flags*.
+
+    The compiler version and the content of every file, and of the files they
+    include (looked for as in *fortran_includes*), are included so that a
+    library is only reused if it would be rebuilt identically.
+    """
+
+    digest = hashlib.sha256()
+    digest.update(compiler_version(compiler).encode())
+    digest.update(" ".join(flags).encode())
+    for src_file in src_files:
+        if os.path.isfile(src_file):
+            hash_files([src_file] + fortran_includes(src_file,
+                                              include_dirs=include_dirs),
+                       digest)
+        else:
+            digest.update(b"\0" + os.path.basename(src_file).encode() + b"\0")
+
+    return digest.hexdigest()[:16]
+
+
 def parse_args(arg_list, delimiter=";"):
     r"""Parses the command line input into lists separated by *delimiter*
     """
@@ -102,6 +211,16 @@ if __name__ == '__main__':
         print("    (2) conflict - Given a list of source files check to see")
         print("        if there might be Fortran 90 source with '.f90' that")
         print("        would hide a fixed-format Fortran source with '.f'.")
+        print("    (3) deps - Given the consolidated source list and module")
+        print("        list separated by ';' print make rules for the module")
+        print("        and include dependencies between them.")
+        print("    (4) libkey - Given the compiler, flags, sources and")
+        print("        include directories separated by ';' print a hash")
+        print("        identifying a library built from them.")
+        print("    (5) libdeps - Given the library sources and include")
+        print("        directories separated by ';' print make rules for the")
+        print("        files included by the library objects.")
+        sys.exit(0)
 
     if sys.argv[1].lower() == "consolidate":
         source_files, common_files, excluded_files = parse_args(sys.argv[2:])
@@ -112,5 +231,18 @@ if __name__ == '__main__':
     elif sys.argv[1].lower() == "conflicts":
         print(check_duplicate_fortran_src(sys.argv[2:]))
 
+    elif sys.argv[1].lower() == "deps":
+        file_lists = parse_args(sys.argv[2:]) + [[]]
+        sys.stdout.write(fortran_dependencies(file_lists[0], file_lists[1]))
+
+    elif sys.argv[1].lower() == "libkey":
+        compiler, flags, src_files, include_dirs = \
+            (parse_args(sys.argv[2:]) + [[], [], []])[:4]
+        print(library_key(" ".join(compiler), flags, src_files, include_dirs))
+
+    elif sys.argv[1].lower() == "libdeps":
+        src_files, include_dirs = (parse_args(sys.argv[2:]) + [[]])[:2]
+        sys.stdout.write(library_dependencies(src_files, include_dirs))
+
     else:
         raise ValueError("ERROR:  Unknown sub-command %s." % sys.argv[1])
@@ -0,0 +1,233 @@
+r"""
+Pack an output directory into a single archive file, and read single frames
+from it without unpacking.
+
+The archive is a zip file whose central directory at the end of the file
+indexes the offset of every member, so that any member can be read directly.
+Members are stored uncompressed by default (frames compressed by
+clawutil.compress are stored as they are), which keeps packing as fast as
+copying.  Being a zip file, the archive can also be listed and unpacked with
+standard tools.
+
+Used by runclaw with pack=True (PACK in the Makefile) after a successful run,
+writing e.g. _output.zip next to _output, or from the command line::
+
+    python archive.py pack _output [--remove]
+    python archive.py list _output.zip
+    python archive.py cat _output.zip fort.q0003
+    python archive.py extract _output.zip _output
+"""
+
+import os
+import io
+import sys
+import shutil
+import zipfile
+
+from clawpack.clawutil import compress
+from clawpack.clawutil.frames import frame_file_re
+
+archive_extension = '.zip'
+
+
+def archive_path(outdir):
+    r"""Default path of the archive of *outdir*."""
+
+    return os.path.abspath(outdir).rstrip(os.sep) + archive_extension
+
+
+def list_outdir(outdir):
+    r"""Return sorted paths of all files in *outdir*, relative to it."""
+
+    names = []
+
+    def walk(path, prefix):
+        for entry in os.scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                walk(entry.path, prefix + entry.name + '/')
+            elif entry.is_file():
+                names.append(prefix + entry.name)
+
+    walk(outdir, '')
+    return sorted(names)
+
+
+def pack_outdir(outdir, path=None, deflate=False, remove=False):
+    r"""
+    Write all files in *outdir* into one archive.
+
+    :Input:
+     - *outdir* (path) - Directory to pack.
+     - *path* (path) - Archive to write, default outdir + '.zip'.
+     - *deflate* (bool) - Compress members with deflate rather than storing
+       them, smaller but slower to write and read.
+     - *remove* (bool) - Remove *outdir* once the archive is complete.
+
+    :Output:
+     - (path) Path of the archive.
+
+    The archive is written under a temporary name and renamed when complete,
+    so an existing archive is replaced only by a complete one.  *outdir* is
+    not removed if it contains the working directory.
+    """
+
+    outdir = os.path.abspath(outdir)
+    cwd = os.path.abspath(os.getcwd())
+    if remove and (cwd == outdir
+                   or cwd.startswith(outdir.rstrip(os.sep) + os.sep)):
+        raise ValueError("Not removing %s, it contains the working directory"
+                         % outdir)
+    if path is None:
+        path = archive_path(outdir)
+    compression = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+
+    names = list_outdir(outdir)
+    tmp_path = path + '.tmp'
+    with zipfile.ZipFile(tmp_path, 'w', compression=compression,
+                         allowZip64=True) as archive:
+        for name in names:
+            member = name
+            if deflate and os.path.splitext(name)[1] in \
+               [extension for (extension, level) in compress.codecs.values()]:
+                # no point deflating compressed frames
+                archive.write(os.path.join(outdir, name), member,
+                              compress_type=zipfile.ZIP_STORED)
+            else:
+                archive.write(os.path.join(outdir, name), member)
+
+    # check the index before replacing anything
+    with zipfile.ZipFile(tmp_path) as archive:
+        sizes = dict((info.filename, info.file_size)
+                     for info in archive.infolist())
+    for name in names:
+        if sizes.get(name) != os.path.getsize(os.path.join(outdir, name)):
+            os.remove(tmp_path)
+            raise IOError("Member %s of %s incomplete" % (name, path))
+    os.replace(tmp_path, path)
+
+    if remove:
+        shutil.rmtree(outdir)
+    return path
+
+
+class OutputArchive(object):
+    r"""
+    Read output from an archive written by *pack_outdir*.
+
+    Members can be opened without unpacking the archive.  A member compressed
+    by clawutil.compress, such as fort.q0003.gz, is also found as fort.q0003
+    and read decompressed.
+
+    :Input:
+     - *path* (path) - The archive.
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.zipfile = zipfile.ZipFile(path)
+        self._names = set(self.zipfile.namelist())
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        self.zipfile.close()
+
+
+    def names(self):
+        r"""Return the sorted names of the members."""
+
+        return sorted(self._names)
+
+
+    def frames(self):
+        r"""
+        Return dictionary mapping frame numbers to dictionaries of member
+        names of each frame, keyed by 't', 'q', 'b' or 'a'.
+        """
+
+        frames = {}
+        for name in self._names:
+            base = name
+            for (extension, level) in compress.codecs.values():
+                if base.endswith(extension):
+                    base = base[:-len(extension)]
+            match = frame_file_re.match(base)
+            if match:
+                frames.setdefault(int(match.group(2)), {})[match.group(1)] = \
+                    base
+        return frames
+
+
+    def open(self, name, mode='rb'):
+        r"""
+        Open member *name* for reading, mode 'rb' or 'r' (text).  Raises
+        KeyError if there is no such member.
+        """
+
+        if name in self._names:
+            f = self.zipfile.open(name)
+        else:
+            for (codec, (extension, level)) in compress.codecs.items():
+                if name + extension in self._names:
+                    f = compress.open_codec(self.zipfile.open(name + extension),
+                                            codec, 'rb')
+                    break
+            else:
+                raise KeyError("No member %s in %s" % (name, self.path))
+        if 'b' not in mode:
+            f = io.TextIOWrapper(f)
+        return f
+
+
+    def read(self, name):
+        r"""Return the contents of member *name* as bytes."""
+
+        with self.open(name) as f:
+            return f.read()
+
+
+    def extract(self, dest):
+        r"""Unpack all members into directory *dest*."""
+
+        self.zipfile.extractall(dest)
+
+
+if __name__ == '__main__':
+    usage = """
+    python archive.py pack OUTDIR [ARCHIVE] [--remove] [--deflate]
+    python archive.py list ARCHIVE
+    python archive.py cat ARCHIVE MEMBER
+    python archive.py extract ARCHIVE DEST
+    """
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if len(args) < 2:
+        print(usage)
+        sys.exit(0)
+    command = args[0]
+    if command == 'pack':
+        path = pack_outdir(args[1], args[2] if len(args) > 2 else None,
+                           deflate='--deflate' in sys.argv,
+                           remove='--remove' in sys.argv)
+        print("Packed %s into %s" % (args[1], path))
+    elif command == 'list':
+        with OutputArchive(args[1]) as archive:
+            for info in archive.zipfile.infolist():
+                print("%12d  %s" % (info.file_size, info.filename))
+    elif command == 'cat' and len(args) > 2:
+        with OutputArchive(args[1]) as archive:
+            with archive.open(args[2]) as f:
+                shutil.copyfileobj(f, sys.stdout.buffer)
+    elif command == 'extract' and len(args) > 2:
+        with OutputArchive(args[1]) as archive:
+            archive.extract(args[2])
+    else:
+        print(usage)
+        sys.exit(1)
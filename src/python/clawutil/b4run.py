@@ -17,7 +17,10 @@ either because they are needed for the run or to archive them along
 with the output.
 
 This sample version copies the Makefile and any Python or Fortran codes.
-Note that *.data files are automatically copied by runclaw.
+Note that *.data files are automatically copied by runclaw.  If b4run accepts
+a stage argument, runclaw passes its staging policy (STAGE in the Makefile,
+e.g. 'hardlink' or 'symlink', see clawutil.snapshot.stage_file) so that files
+can be placed in outdir the same way as the *.data files.
 
 It also creates (or appends to) a runlog.txt file containing information 
 about this run: the rundir and the time/date the run started.
@@ -26,9 +29,10 @@ Adapt this file to your own needs.
 """
 
 
-def b4run(rundir, outdir):
+def b4run(rundir, outdir, stage='copy'):
 
-    import os,sys,glob,shutil,time
+    import os,sys,glob,time
+    from clawpack.clawutil.snapshot import stage_file
 
     # ---------------------------------------------------------------------
     # files to copy to outdir (in addition to *.data files always copied):
@@ -39,7 +43,7 @@ def b4run(rundir, outdir):
             files = glob.glob(pattern)  # files matching pattern
             for file in files:
                 print('Copying %s to %s' % (file, outdir))
-                shutil.copy(file, os.path.join(outdir,file))
+                stage_file(file, os.path.join(outdir,file), stage)
 
     # ---------------------------------------------------------------------
     # also add to outdir/runlog.txt with info about when run was done
@@ -0,0 +1,300 @@
+r"""
+Store of backups of output directories in which identical files are kept
+only once, with a retention policy.
+
+With overwrite=False, runclaw moves an existing outdir aside as a backup
+before a new run.  With backups=True (BACKUPS in the Makefile) the backup is
+moved into a store, by default outdir + '_backups', e.g.::
+
+    _output_backups/
+        _output_2024-05-01-101500/
+        _output_2024-05-01-113000/
+        .objects/
+
+and every file in it is replaced by a hardlink to a content-addressed object
+in .objects, so that files identical across backups, such as the *.data
+files and the early frames of a parameter study, take the space of one copy.
+Hashes recorded by clawutil.manifest for unchanged files are reused rather
+than reading the files again.  Objects no longer linked from any backup are
+removed when backups are pruned.
+
+Backups share data, so the files in them must not be modified in place.
+Identical files also share their modification time.
+
+Retention rules, e.g. keep_backups='last=5,size=20G,age=30d', remove all but
+the 5 newest backups, backups older than 30 days, and the oldest backups
+while the store holds more than 20G.  The newest backup is never removed.
+From the command line::
+
+    python backups.py list _output_backups
+    python backups.py prune _output_backups last=5,size=20G
+"""
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+
+_objects_dir = '.objects'
+
+_age_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def default_store(outdir):
+    r"""Default path of the backup store of *outdir*."""
+
+    return os.path.abspath(outdir).rstrip(os.sep) + '_backups'
+
+
+def parse_retention(spec):
+    r"""
+    Return dictionary of retention rules (keep_last, max_size in bytes,
+    max_age in seconds) from *spec*, e.g. 'last=5,size=20G,age=30d', or a
+    dictionary with these keys.
+    """
+
+    from clawpack.clawutil.build_cache import parse_size
+
+    rules = {'keep_last': None, 'max_size': None, 'max_age': None}
+    if spec in [None, '', 'None']:
+        return rules
+    if isinstance(spec, dict):
+        rules.update(spec)
+        return rules
+    for item in str(spec).split(','):
+        name, _, value = item.strip().partition('=')
+        name = name.strip().lower()
+        value = value.strip()
+        if name == 'last':
+            rules['keep_last'] = int(value)
+        elif name == 'size':
+            rules['max_size'] = parse_size(value)
+        elif name == 'age':
+            if value and value[-1].lower() in _age_units:
+                rules['max_age'] = float(value[:-1]) \
+                                   * _age_units[value[-1].lower()]
+            else:
+                rules['max_age'] = float(value) * _age_units['d']
+        else:
+            raise ValueError("Unknown retention rule %s, use last=N, "
+                             "size=BYTES or age=DAYS" % item)
+    return rules
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024**2), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BackupStore(object):
+    r"""
+    Directory of backups of output directories sharing identical files.
+
+    :Input:
+     - *path* (path) - The store, created when needed.
+    """
+
+    def __init__(self, path):
+
+        self.path = os.path.abspath(path)
+        self.objects = os.path.join(self.path, _objects_dir)
+
+
+    def backups(self):
+        r"""Return list of (time, path) of the backups, newest first."""
+
+        backups = []
+        if not os.path.isdir(self.path):
+            return backups
+        for entry in os.scandir(self.path):
+            if entry.is_dir(follow_symlinks=False) \
+               and not entry.name.startswith('.'):
+                backups.append((entry.stat().st_mtime, entry.path))
+        return sorted(backups, reverse=True)
+
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+
+    def ingest(self, backup, workers=None):
+        r"""
+        Replace the files of directory *backup* in the store by hardlinks to
+        objects, adding objects for contents not yet stored.
+
+        :Input:
+         - *backup* (path) - Directory in the store, e.g. an outdir moved
+           there.
+         - *workers* (int) - Number of threads hashing files, default the
+           number of cores.
+
+        :Output:
+         - (dict) Number of files *linked* to existing objects and *stored*
+           as new objects, and the bytes *saved* by linking.
+        """
+
+        from clawpack.clawutil.manifest import read_manifest
+
+        backup = os.path.abspath(backup)
+        backup_time = os.stat(backup).st_mtime
+        manifest = read_manifest(backup)
+
+        paths = []
+        for (dirpath, dirnames, filenames) in os.walk(backup):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if not os.path.islink(path) and os.path.isfile(path):
+                    paths.append(path)
+
+        def digest(path):
+            # reuse the hash in the manifest if the file is unchanged
+            name = os.path.relpath(path, backup).replace(os.sep, '/')
+            entry = manifest.get(name)
+            if entry is not None:
+                st = os.stat(path)
+                if entry['size'] == st.st_size \
+                   and entry['mtime_ns'] == st.st_mtime_ns:
+                    return entry['sha256']
+            return _hash_file(path)
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+            digests = list(pool.map(digest, paths))
+
+        counts = {'linked': 0, 'stored': 0, 'saved': 0}
+        for (path, file_digest) in zip(paths, digests):
+            obj = self.object_path(file_digest)
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            try:
+                os.link(path, obj)
+                counts['stored'] += 1
+                continue
+            except FileExistsError:
+                pass
+            except OSError:
+                # e.g. no hardlinks on this filesystem, kept as it is
+                continue
+            if os.path.samefile(path, obj):
+                continue
+            # replace the file by a link to the object, atomically:
+            tmp_path = path + '.tmp-backup'
+            try:
+                os.link(obj, tmp_path)
+                size = os.path.getsize(path)
+                os.replace(tmp_path, path)
+            except OSError:
+                if os.path.lexists(tmp_path):
+                    os.remove(tmp_path)
+                continue
+            counts['linked'] += 1
+            counts['saved'] += size
+
+        # the time of the backup, not of its ingestion:
+        os.utime(backup, (backup_time, backup_time))
+        return counts
+
+
+    def size(self, backups=None):
+        r"""
+        Return the bytes used by *backups* (default all), counting files
+        shared between them once.
+        """
+
+        if backups is None:
+            backups = [path for (mtime, path) in self.backups()]
+        inodes = {}
+        for backup in backups:
+            for (dirpath, dirnames, filenames) in os.walk(backup):
+                for name in filenames:
+                    st = os.lstat(os.path.join(dirpath, name))
+                    inodes[(st.st_dev, st.st_ino)] = st.st_size
+        return sum(inodes.values())
+
+
+    def gc(self):
+        r"""Remove objects no longer used by any backup, return bytes freed."""
+
+        freed = 0
+        if not os.path.isdir(self.objects):
+            return freed
+        for prefix in os.scandir(self.objects):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                st = entry.stat(follow_symlinks=False)
+                if st.st_nlink <= 1:
+                    os.remove(entry.path)
+                    freed += st.st_size
+        return freed
+
+
+    def prune(self, keep_last=None, max_size=None, max_age=None,
+              protect=()):
+        r"""
+        Remove backups according to the retention rules (see
+        *parse_retention*), except those in *protect*, and the objects only
+        they used.  Returns the list of backups removed.
+        """
+
+        backups = self.backups()
+        protect = [os.path.abspath(path) for path in protect]
+        removed = []
+
+        def remove(path):
+            shutil.rmtree(path)
+            removed.append(path)
+
+        now = time.time()
+        for (n, (mtime, path)) in enumerate(backups):
+            if path in protect:
+                continue
+            if (keep_last is not None and n >= keep_last) \
+               or (max_age is not None and now - mtime > max_age):
+                remove(path)
+
+        if max_size is not None:
+            remaining = [path for (mtime, path) in backups
+                         if path not in removed]
+            # oldest first:
+            for path in remaining[::-1]:
+                if self.size(remaining) <= max_size:
+                    break
+                if path in protect:
+                    continue
+                remove(path)
+                remaining.remove(path)
+
+        self.gc()
+        return removed
+
+
+if __name__ == '__main__':
+    usage = """
+    python backups.py list STORE
+    python backups.py prune STORE last=N,size=BYTES,age=DAYS
+    """
+    if len(sys.argv) < 3:
+        print(usage)
+        sys.exit(0)
+    command = sys.argv[1]
+    store = BackupStore(sys.argv[2])
+    if command == 'list':
+        for (mtime, path) in store.backups():
+            print("%s  %10.1f MB  %s"
+                  % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime)),
+                     store.size([path]) / 1024**2, os.path.basename(path)))
+        print("Total %.1f MB" % (store.size() / 1024**2))
+    elif command == 'prune' and len(sys.argv) > 3:
+        newest = [path for (mtime, path) in store.backups()[:1]]
+        for path in store.prune(protect=newest,
+                                **parse_retention(sys.argv[3])):
+            print("Removed ", path)
+    else:
+        print(usage)
+        sys.exit(1)
@@ -0,0 +1,696 @@
+r"""
+Content-addressed caches for compiled Clawpack code and its results.
+
+Entries are stored below a cache root directory (by default
+``~/.cache/clawpack``, override with the environment variable
+*CLAW_CACHE_DIR*) and are addressed by a hash of everything that determines
+the result of a build: the content of the sources, the compiler flags and
+the compiler version.  Identical builds in different tests, sessions or
+worktrees can then share a single copy of the result.
+
+Each cache is bounded in size (*CLAW_CACHE_MAX_SIZE*, e.g. ``2G``) and
+evicts the least recently used entries once the bound is exceeded.
+
+:Available Classes:
+
+    CacheStore - Generic size-bounded content-addressed store
+    ExecutableCache - Cache of executables built with Makefile.common
+    ObjectCache - ccache-style cache of compiled Fortran objects and modules
+    ResultCache - Cache of the output of runs of an executable
+    LibraryCache - Cache of libraries of common sources built with
+                   Makefile.common
+
+Command line usage (used by Makefile.common when CLAW_FC_CACHE = True or
+COMMON_LIB = True)::
+
+    python build_cache.py compile gfortran -c -cpp file.f90 ... -o file.o
+    python build_cache.py library libdir key lib.a objects ... -- make ...
+    python build_cache.py stats
+    python build_cache.py clear
+"""
+
+import os
+import sys
+import re
+import json
+import shutil
+import hashlib
+import subprocess
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Default bound on the size of each cache, in bytes
+default_max_size = 2 * 1024**3
+
+_compiler_versions = {}
+
+fortran_extensions = ('.f', '.f90', '.F', '.F90', '.f95', '.for')
+
+# Fortran ``include`` lines and preprocessor ``#include`` directives
+_include_re = re.compile(r"^\s*#?\s*include\s*['\"<]([^'\">]+)['\">]",
+                         re.I | re.M)
+_use_re = re.compile(r"^\s*use\s*(?:,\s*\w+\s*)?(?:::)?\s*(\w+)", re.I | re.M)
+_module_re = re.compile(r"^\s*module\s+(?!procedure\b)(\w+)\s*(?:!.*)?$",
+                        re.I | re.M)
+
+
+def cache_root():
+    r"""Return the root directory used for all Clawpack caches."""
+
+    root = os.environ.get('CLAW_CACHE_DIR', None)
+    if root is None:
+        root = os.path.join(os.path.expanduser('~'), '.cache', 'clawpack')
+    return os.path.abspath(root)
+
+
+def parse_size(size):
+    r"""Convert *size* such as 500M or 2G (or a plain number) to bytes."""
+
+    if size is None:
+        return None
+    if isinstance(size, (int, float)):
+        return int(size)
+    size = size.strip().upper().rstrip('B')
+    factors = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    if size and size[-1] in factors:
+        return int(float(size[:-1]) * factors[size[-1]])
+    return int(float(size))
+
+
+def hash_files(paths, digest=None):
+    r"""Update *digest* (or a new sha256 digest) with content of *paths*.
+
+    The basename of each file is hashed along with its content so that
+    renaming a source file also changes the key.
+    """
+
+    if digest is None:
+        digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        digest.update(b'\0')
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024**2), b''):
+                digest.update(block)
+        digest.update(b'\0')
+    return digest
+
+
+def scan_fortran_src(path, text=None):
+    r"""Return the modules defined, modules used and files included by the
+    Fortran source file *path* (or by its content *text* if given).
+
+    Module names are returned in lower case.  Included files are only listed
+    if they can be found relative to the directory of *path*.
+    """
+
+    if text is None:
+        with open(path, errors='replace') as f:
+            text = f.read()
+
+    defined = []
+    for name in _module_re.findall(text):
+        if name.lower() not in defined:
+            defined.append(name.lower())
+
+    used = []
+    for name in _use_re.findall(text):
+        if name.lower() not in used and name.lower() not in defined:
+            used.append(name.lower())
+
+    included = []
+    for name in _include_re.findall(text):
+        include_path = os.path.join(os.path.dirname(path), name)
+        if os.path.isfile(include_path) and include_path not in included:
+            included.append(include_path)
+
+    return defined, used, included
+
+
+def fortran_includes(path, text=None, include_dirs=()):
+    r"""Return paths of the files included by *path*, directly or through
+    nested includes.
+
+    Both Fortran ``include`` lines and ``#include`` directives are followed.
+    Files are searched for in the directory of *path* and then in
+    *include_dirs*, as the compiler does with ``-I``.  Includes that cannot be
+    found are ignored, the compiler will report them.
+    """
+
+    if text is None:
+        with open(path, errors='replace') as f:
+            text = f.read()
+    search_dirs = [os.path.dirname(path)] + list(include_dirs)
+    found = []
+    for name in _include_re.findall(text):
+        for include_dir in search_dirs:
+            include_path = os.path.join(include_dir, name)
+            if os.path.isfile(include_path):
+                if include_path not in found:
+                    found.append(include_path)
+                    found += [p for p in fortran_includes(include_path,
+                                              include_dirs=include_dirs)
+                              if p not in found]
+                break
+    return found
+
+
+def compiler_version(compiler):
+    r"""Return the first line of ``compiler --version``, cached per process."""
+
+    if compiler not in _compiler_versions:
+        try:
+            output = subprocess.check_output([compiler, '--version'],
+                                             stderr=subprocess.STDOUT)
+            version = output.decode(errors='replace').strip().splitlines()[0]
+        except (OSError, subprocess.CalledProcessError, IndexError):
+            version = compiler
+        _compiler_versions[compiler] = version
+    return _compiler_versions[compiler]
+
+
+def link_or_copy(src, dest, link=True):
+    r"""Hardlink *src* to *dest* if *link* and possible, otherwise copy."""
+
+    if link:
+        try:
+            os.link(src, dest)
+            return
+        except OSError:
+            # e.g. different filesystems or no hardlink support
+            pass
+    shutil.copy2(src, dest)
+
+
+class CacheStore(object):
+    r"""
+    Directory of cache entries, each entry being a directory of files
+    addressed by a hex *key*.
+
+    Entries are published atomically (written to a temporary directory and
+    renamed into place) so that concurrent processes sharing a cache never see
+    a partial entry.  The modification time of an entry directory records its
+    last use and is used for least recently used eviction.
+
+    :Input:
+     - *name* (str) - Subdirectory of :func:`cache_root` holding this cache.
+     - *path* (path) - Explicit location of the cache, overrides *name*.
+     - *max_size* (int or str) - Size bound, defaults to
+       *CLAW_CACHE_MAX_SIZE* or 2G.
+    """
+
+    def __init__(self, name, path=None, max_size=None):
+
+        if path is None:
+            path = os.path.join(cache_root(), name)
+        self.path = os.path.abspath(path)
+        if max_size is None:
+            max_size = os.environ.get('CLAW_CACHE_MAX_SIZE', default_max_size)
+        self.max_size = parse_size(max_size)
+
+
+    def entry_path(self, key):
+        r"""Return path of the entry directory for *key*."""
+        return os.path.join(self.path, key[:2], key[2:])
+
+
+    def lookup(self, key):
+        r"""Return the entry directory for *key* or None if not cached.
+
+        A successful lookup marks the entry as recently used.
+        """
+
+        path = self.entry_path(key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return path
+
+
+    def store(self, key, files, evict=True, link=False):
+        r"""Store *files* as the entry for *key* and return its path.
+
+        :Input:
+         - *key* (str) - Hex key of the entry.
+         - *files* (dict) - Maps name within the entry to the path of the
+           file to copy into the cache.
+         - *evict* (bool) - Enforce the size bound after storing.
+         - *link* (bool) - Hardlink rather than copy files where possible.
+        """
+
+        path = self.entry_path(key)
+        if os.path.isdir(path):
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = tempfile.mkdtemp(prefix='.tmp-', dir=os.path.dirname(path))
+        try:
+            for (name, src) in files.items():
+                link_or_copy(src, os.path.join(temp_path, name), link)
+            os.rename(temp_path, path)
+        except OSError:
+            # Another process may have published the same entry first
+            shutil.rmtree(temp_path, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+
+        if evict:
+            self.evict()
+        return path
+
+
+    def fetch(self, key, name, dest):
+        r"""Copy file *name* of entry *key* to *dest*, returning success."""
+
+        path = self.lookup(key)
+        if path is None or not os.path.exists(os.path.join(path, name)):
+            return False
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, name)
+        shutil.copy2(os.path.join(path, name), dest)
+        return True
+
+
+    def fetch_all(self, key, dest, link=False):
+        r"""Place all files of entry *key* in directory *dest*.
+
+        Returns the list of names restored, or None if *key* is not cached.
+        With *link* the files are hardlinked where possible, so they must not
+        be modified in place afterwards.
+        """
+
+        path = self.lookup(key)
+        if path is None:
+            return None
+        names = sorted(os.listdir(path))
+        for name in names:
+            target = os.path.join(dest, name)
+            if os.path.lexists(target):
+                os.remove(target)
+            link_or_copy(os.path.join(path, name), target, link)
+        return names
+
+
+    def entries(self):
+        r"""Return list of (last_used, size, path) for all entries."""
+
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for prefix in os.scandir(self.path):
+            if not prefix.is_dir() or len(prefix.name) != 2:
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.name.startswith('.tmp-') or not entry.is_dir():
+                    continue
+                size = sum(f.stat().st_size for f in os.scandir(entry.path)
+                           if f.is_file())
+                entries.append((entry.stat().st_mtime, size, entry.path))
+        return entries
+
+
+    def evict(self, max_size=None):
+        r"""Remove least recently used entries until size is below bound."""
+
+        if max_size is None:
+            max_size = self.max_size
+        if max_size is None:
+            return
+
+        entries = sorted(self.entries())
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in entries:
+            if total <= max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+    def clear(self):
+        r"""Remove all entries from the cache."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class ExecutableCache(CacheStore):
+    r"""
+    Cache of executables built by ``make .exe`` with Makefile.common.
+
+    The key of an executable is a hash of the consolidated SOURCES and
+    MODULES content, the compile and link flags and the compiler version, as
+    reported by ``make build_info`` in the application directory.
+    """
+
+    def __init__(self, path=None, max_size=None):
+        super(ExecutableCache, self).__init__('executables', path=path,
+                                              max_size=max_size)
+
+
+    def build_info(self, app_dir):
+        r"""Return dictionary of variables printed by ``make build_info``."""
+
+        output = subprocess.check_output(['make', '-s', 'build_info'],
+                                         cwd=app_dir, stderr=subprocess.DEVNULL)
+        info = {}
+        for line in output.decode(errors='replace').splitlines():
+            if '=' in line:
+                name, value = line.split('=', 1)
+                info[name.strip()] = value.strip()
+        return info
+
+
+    def key(self, app_dir, executable_name='xclaw'):
+        r"""Return the cache key for the executable *executable_name* built
+        in *app_dir*."""
+
+        info = self.build_info(app_dir)
+        digest = hashlib.sha256()
+        digest.update(('EXE=%s\n' % executable_name).encode())
+        for name in ['CLAW_FC', 'ALL_FFLAGS', 'ALL_LFLAGS']:
+            digest.update(('%s=%s\n' % (name, info.get(name, ''))).encode())
+        digest.update(compiler_version(info.get('CLAW_FC', 'gfortran'))
+                                                                    .encode())
+        sources = info.get('MODULES', '').split() \
+                  + info.get('SOURCES', '').split()
+        sources = [os.path.join(app_dir, src) for src in sources]
+        includes = []
+        for src in sources:
+            includes += [p for p in fortran_includes(src) if p not in includes]
+        hash_files(sources + includes, digest)
+        return digest.hexdigest()
+
+
+class ObjectCache(CacheStore):
+    r"""
+    ccache-style cache of objects compiled from a single Fortran source.
+
+    The key of an object is a hash of the preprocessed source (with line
+    markers removed so the location of the source does not matter), any
+    files it pulls in with Fortran ``include`` lines, the ``.mod`` files of
+    the modules it uses, the compiler flags and the compiler version.  Paths
+    given with -I, -J and -o are not part of the key so that all applications
+    on the machine share the objects compiled from common library sources.
+
+    An entry holds the object file and the ``.mod`` files of any modules
+    defined in the source.  Hit and miss counts are kept in ``stats.json`` in
+    the cache directory.
+    """
+
+    # Number of stores between checks of the size bound
+    evict_interval = 50
+
+    def __init__(self, path=None, max_size=None):
+        super(ObjectCache, self).__init__('objects', path=path,
+                                          max_size=max_size)
+
+
+    def update_stats(self, **increments):
+        r"""Add *increments* to the counters in stats.json, return new stats."""
+
+        os.makedirs(self.path, exist_ok=True)
+        stats_path = os.path.join(self.path, 'stats.json')
+        with open(os.path.join(self.path, 'stats.lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(stats_path) as f:
+                    stats = json.load(f)
+            except (OSError, ValueError):
+                stats = {}
+            for (name, value) in increments.items():
+                stats[name] = stats.get(name, 0) + value
+            with open(stats_path + '.tmp', 'w') as f:
+                json.dump(stats, f, indent=1)
+            os.replace(stats_path + '.tmp', stats_path)
+        return stats
+
+
+    def stats(self):
+        r"""Return dictionary of hit/miss statistics and current size."""
+
+        try:
+            with open(os.path.join(self.path, 'stats.json')) as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = {}
+        entries = self.entries()
+        stats['entries'] = len(entries)
+        stats['size'] = sum(size for (_, size, _) in entries)
+        stats['max_size'] = self.max_size
+        return stats
+
+
+    def compile(self, command):
+        r"""Run compile *command* (a list), using cached results if possible.
+
+        Returns the exit status of the compiler (0 on a cache hit).  Commands
+        that do not compile a single Fortran source with ``-c`` and ``-o`` are
+        run unchanged.
+        """
+
+        parsed = parse_compile_command(command)
+        if parsed is None:
+            self.update_stats(uncacheable=1)
+            return subprocess.call(command)
+
+        try:
+            key, module_names = self.key(parsed)
+        except (OSError, subprocess.CalledProcessError):
+            self.update_stats(uncacheable=1)
+            return subprocess.call(command)
+
+        mod_dir = parsed['module_dir']
+        path = self.lookup(key)
+        if path is not None:
+            try:
+                # copied with the current time, so that make finds the
+                # restored files newer than their sources
+                shutil.copy(os.path.join(path, 'object.o'), parsed['output'])
+                for name in module_names:
+                    shutil.copy(os.path.join(path, name),
+                                os.path.join(mod_dir, name))
+                self.update_stats(hits=1)
+                return 0
+            except OSError:
+                pass
+
+        status = subprocess.call(command)
+        if status != 0:
+            return status
+
+        files = {'object.o': parsed['output']}
+        for name in module_names:
+            if os.path.isfile(os.path.join(mod_dir, name)):
+                files[name] = os.path.join(mod_dir, name)
+        stats = self.update_stats(misses=1)
+        try:
+            self.store(key, files,
+                       evict=(stats['misses'] % self.evict_interval == 0))
+        except OSError:
+            pass
+        return 0
+
+
+    def key(self, parsed):
+        r"""Return (key, names of .mod files produced) for a parsed command.
+        """
+
+        compiler = parsed['compiler']
+        preprocessed = subprocess.check_output(
+                        [compiler, '-E', '-cpp'] + parsed['include_flags']
+                        + parsed['flags'] + [parsed['source']],
+                        stderr=subprocess.DEVNULL).decode(errors='replace')
+        lines = [line for line in preprocessed.splitlines()
+                 if not line.startswith('#')]
+        text = "\n".join(lines)
+
+        digest = hashlib.sha256()
+        digest.update(compiler_version(compiler).encode())
+        digest.update(("\0".join(parsed['flags']) + "\n").encode())
+        digest.update(text.encode())
+        include_dirs = parsed['include_dirs']
+        hash_files(fortran_includes(parsed['source'], text, include_dirs),
+                   digest)
+
+        defined, used, _ = scan_fortran_src(parsed['source'], text)
+        for name in used:
+            for mod_dir in [parsed['module_dir']] + include_dirs:
+                mod_path = os.path.join(mod_dir, name + '.mod')
+                if os.path.isfile(mod_path):
+                    hash_files([mod_path], digest)
+                    break
+
+        return digest.hexdigest(), [name + '.mod' for name in defined]
+
+
+class ResultCache(CacheStore):
+    r"""
+    Cache of the output files of runs of a Clawpack executable.
+
+    The key of a run is a hash of the executable and of the input files
+    (the *.data files and any files staged into the output directory by
+    b4run), so an unchanged case can be restored instead of rerun.
+    """
+
+    def __init__(self, path=None, max_size=None):
+        super(ResultCache, self).__init__('results', path=path,
+                                          max_size=max_size)
+
+
+    def key(self, executable, input_files, options=None):
+        r"""Return the cache key for running *executable* on *input_files*.
+
+        *options* (dict) are further settings changing the output stored,
+        e.g. how frames are post-processed.
+        """
+
+        digest = hash_files([executable])
+        hash_files(sorted(input_files, key=os.path.basename), digest)
+        if options:
+            digest.update(json.dumps(options, sort_keys=True).encode())
+        return digest.hexdigest()
+
+
+class LibraryCache(CacheStore):
+    r"""
+    Cache of the static libraries of common sources built by Makefile.common
+    when COMMON_LIB = True.
+
+    The key of a library is computed by ``check_src.py libkey`` from the
+    compiler version, the flags and the content of the sources and of the
+    files they include.  Applications hold a hardlink (or copy) of the
+    library, so evicting an entry never breaks an existing build.
+    """
+
+    def __init__(self, path=None, max_size=None):
+        super(LibraryCache, self).__init__('lib', path=path,
+                                           max_size=max_size)
+
+
+    def build(self, key, lib_file, objects, command):
+        r"""Place the library for *key* at *lib_file*, first building it by
+        running *command* and archiving *objects* if it is not cached.
+
+        Builds of the same library are serialized with a lock, so that
+        concurrent builds compile it only once.  Returns the exit status of
+        *command* (0 if the library was cached).
+        """
+
+        lock_dir = os.path.join(self.path, 'locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        name = os.path.basename(lib_file)
+        with open(os.path.join(lock_dir, key), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            path = self.lookup(key)
+            if path is None or not os.path.isfile(os.path.join(path, name)):
+                returncode = subprocess.call(command)
+                if returncode != 0:
+                    return returncode
+                archive = '%s.%s.a' % (lib_file, os.getpid())
+                subprocess.check_call(['ar', 'rcs', archive] + objects)
+                try:
+                    path = self.store(key, {name: archive}, link=True)
+                finally:
+                    os.remove(archive)
+
+            # publish under a temporary name so no build sees a partial file
+            temp_file = '%s.%s' % (lib_file, os.getpid())
+            link_or_copy(os.path.join(path, name), temp_file)
+            os.replace(temp_file, lib_file)
+        return 0
+
+
+def parse_compile_command(command):
+    r"""Split a Fortran compile command into the parts relevant for caching.
+
+    Returns None unless *command* compiles exactly one Fortran source with
+    ``-c`` into an object given by ``-o``.  Otherwise returns a dictionary
+    with keys *compiler*, *source*, *output*, *module_dir*, *include_dirs*,
+    *include_flags* and *flags* (the remaining, location independent flags).
+    """
+
+    compiler = command[0]
+    args = list(command[1:])
+    sources = []
+    output = None
+    module_dir = None
+    include_dirs = []
+    include_flags = []
+    flags = []
+    compile_only = False
+
+    while args:
+        arg = args.pop(0)
+        if arg == '-c':
+            compile_only = True
+        elif arg == '-o' and args:
+            output = args.pop(0)
+        elif arg in ('-J', '-module') and args:
+            module_dir = args.pop(0)
+        elif arg.startswith('-J'):
+            module_dir = arg[2:]
+        elif arg == '-I' and args:
+            include_dirs.append(args.pop(0))
+            include_flags += ['-I', include_dirs[-1]]
+        elif arg.startswith('-I'):
+            include_dirs.append(arg[2:])
+            include_flags.append(arg)
+        elif arg.startswith('-L'):
+            continue
+        elif os.path.splitext(arg)[1] in fortran_extensions \
+                and not arg.startswith('-'):
+            sources.append(arg)
+        else:
+            flags.append(arg)
+
+    if not compile_only or output is None or len(sources) != 1:
+        return None
+    if module_dir is None or module_dir == '':
+        module_dir = '.'
+
+    return {'compiler': compiler, 'source': sources[0], 'output': output,
+            'module_dir': module_dir, 'include_dirs': include_dirs,
+            'include_flags': include_flags, 'flags': flags}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Manage the Clawpack object cache.")
+        print("  Usage:  python build_cache.py [compile|library|stats|clear]"
+              " ...")
+        print("    compile - run the compile command that follows, using")
+        print("              cached objects and modules where possible")
+        print("    library - given the library cache directory, key, library")
+        print("              file and objects, then -- and the command making")
+        print("              the objects, place the cached library or build")
+        print("              and cache it")
+        print("    stats   - print hit/miss statistics and cache size")
+        print("    clear   - remove all cached objects")
+        sys.exit(0)
+
+    object_cache = ObjectCache()
+    if sys.argv[1].lower() == 'compile':
+        sys.exit(object_cache.compile(sys.argv[2:]))
+    elif sys.argv[1].lower() == 'library':
+        split = sys.argv.index('--')
+        (path, key, lib_file) = sys.argv[2:5]
+        library_cache = LibraryCache(path=path)
+        sys.exit(library_cache.build(key, lib_file, sys.argv[5:split],
+                                     sys.argv[split+1:]))
+    elif sys.argv[1].lower() == 'stats':
+        stats = object_cache.stats()
+        print("Object cache in %s" % object_cache.path)
+        for name in ['hits', 'misses', 'uncacheable', 'entries', 'size',
+                     'max_size']:
+            print("  %s = %s" % (name.ljust(12), stats.get(name, 0)))
+    elif sys.argv[1].lower() == 'clear':
+        object_cache.clear()
+    else:
+        raise ValueError("ERROR:  Unknown sub-command %s." % sys.argv[1])
@@ -0,0 +1,344 @@
+r"""
+Recommend how often a run should write checkpoints, from the timings of a
+short calibration run and the expected failure rate of the machine.
+
+Writing a checkpoint costs time *delta*, while a failure loses the work done
+since the last checkpoint.  With a mean time between failures *M*, the
+interval between checkpoints minimizing the expected run time is given by
+Daly's approximation (J.T. Daly, A higher order estimate of the optimum
+checkpoint interval for restart dumps, FGCS 22, 2006) of about
+sqrt(2 delta M) - delta.
+
+From the output of the calibration run this estimates:
+
+ - the wall time per unit of simulated time, from the modification times of
+   the fort.t files against the times they record (or run_metrics.json),
+ - the wall time per level 1 time step, from the output of the code if a
+   log file is given (or run_status.json written with MONITOR=True),
+ - the cost of a checkpoint, from the size of the fort.chk files (estimated
+   from the frames if there are none) and the rate at which the output
+   directory takes writes, measured by writing a sample file.
+
+The interval is converted to checkpt_interval (level 1 steps, checkpt_style
+3) if the step cost is known, and otherwise to a list of checkpt_times
+(checkpt_style 2).  From the command line::
+
+    python checkpoint_interval.py _output 24h [--log run.log]
+        [--write claw.data]
+
+where 24h is the mean time between failures (s, m, h, d or w), prints the
+recommendation with the lines to put in setrun.py, and with --write also
+rewrites the checkpoint parameters in claw.data.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import math
+import tempfile
+
+from clawpack.clawutil.frames import list_frames
+
+_duration_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+_checkpoint_re = re.compile(r"^fort\.chk(\d+|aaaa|bbbb)$")
+
+
+def parse_duration(spec):
+    r"""Convert *spec* such as 30m, 24h or 7d (or seconds) to seconds."""
+
+    if isinstance(spec, (int, float)):
+        return float(spec)
+    spec = spec.strip().lower()
+    if spec and spec[-1] in _duration_units:
+        return float(spec[:-1]) * _duration_units[spec[-1]]
+    return float(spec)
+
+
+def optimal_interval(checkpoint_cost, mtbf):
+    r"""
+    Return the wall time between checkpoints minimizing the expected run
+    time, for checkpoints costing *checkpoint_cost* seconds and a mean time
+    between failures of *mtbf* seconds (Daly's higher order estimate).
+    """
+
+    delta = float(checkpoint_cost)
+    if delta >= 2 * mtbf:
+        return float(mtbf)
+    x = delta / (2 * mtbf)
+    return math.sqrt(2 * delta * mtbf) * (1 + math.sqrt(x) / 3 + x / 9) \
+           - delta
+
+
+def measure_write_rate(path, nbytes=64 * 1024**2):
+    r"""
+    Return the rate in bytes per second at which directory *path* takes
+    writes, by writing and syncing a file of *nbytes*.
+    """
+
+    block = os.urandom(min(nbytes, 1024**2))
+    fd, sample = tempfile.mkstemp(prefix='.write-rate-', dir=path)
+    try:
+        start = time.time()
+        written = 0
+        with os.fdopen(fd, 'wb') as f:
+            while written < nbytes:
+                f.write(block)
+                written += len(block)
+            f.flush()
+            os.fsync(f.fileno())
+        elapsed = time.time() - start
+    finally:
+        os.remove(sample)
+    return written / max(elapsed, 1e-6)
+
+
+def _frame_timings(outdir):
+    # (simulated time, modification time) of each frame
+    timings = []
+    for (frameno, files) in sorted(list_frames(outdir).items()):
+        if 't' not in files:
+            continue
+        try:
+            with open(files['t']) as f:
+                t = float(f.readline().split()[0].replace('D', 'E')
+                                                 .replace('d', 'e'))
+            timings.append((t, os.path.getmtime(files['t'])))
+        except (OSError, ValueError, IndexError):
+            pass
+    return timings
+
+
+def calibrate(outdir, log_file=None):
+    r"""
+    Measure the costs of the calibration run in *outdir*.
+
+    :Input:
+     - *outdir* (path) - Output directory of the calibration run.
+     - *log_file* (path) - Output of the code, to count time steps.
+
+    :Output:
+     - (dict) with *wall_per_time* (wall seconds per unit of simulated
+       time), *wall_per_step* (wall seconds per level 1 step, None if not
+       known), *checkpoint_size* (bytes), *checkpoint_size_estimated*
+       (True if estimated from the frames), and *t0* and *tfinal* of the
+       run as set in claw.data.
+    """
+
+    from clawpack.clawutil.monitor import read_run_times, is_level1_step
+
+    calibration = {'wall_per_time': None, 'wall_per_step': None}
+    try:
+        calibration['t0'], calibration['tfinal'], num_frames = \
+            read_run_times(outdir)
+    except Exception:
+        calibration['t0'], calibration['tfinal'] = None, None
+
+    metrics = {}
+    try:
+        with open(os.path.join(outdir, 'run_metrics.json')) as f:
+            metrics = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    # least squares slope of wall time against simulated time:
+    timings = _frame_timings(outdir)
+    if len(timings) >= 2 and timings[-1][0] > timings[0][0]:
+        n = len(timings)
+        t_mean = sum(t for (t, mtime) in timings) / n
+        mtime_mean = sum(mtime for (t, mtime) in timings) / n
+        covariance = sum((t - t_mean) * (mtime - mtime_mean)
+                         for (t, mtime) in timings)
+        variance = sum((t - t_mean)**2 for (t, mtime) in timings)
+        calibration['wall_per_time'] = max(covariance / variance, 0.)
+    elif metrics.get('wall_time') and timings and timings[-1][0] > 0:
+        calibration['wall_per_time'] = metrics['wall_time'] \
+                                       / (timings[-1][0]
+                                          - (calibration['t0'] or 0.))
+
+    # steps on level 1 only, the unit of checkpt_interval
+    steps = None
+    if log_file is not None:
+        with open(log_file, errors='replace') as f:
+            steps = sum(1 for line in f if is_level1_step(line))
+    else:
+        try:
+            with open(os.path.join(outdir, 'run_status.json')) as f:
+                # counted by the monitor on level 1
+                steps = json.load(f).get('steps')
+        except (OSError, ValueError):
+            pass
+    if steps and metrics.get('wall_time'):
+        calibration['wall_per_step'] = metrics['wall_time'] / steps
+
+    sizes = [entry.stat().st_size for entry in os.scandir(outdir)
+             if _checkpoint_re.match(entry.name) and entry.is_file()]
+    calibration['checkpoint_size_estimated'] = not sizes
+    if sizes:
+        calibration['checkpoint_size'] = max(sizes)
+    else:
+        # the solution in binary, from the last frame: binary output as it
+        # is, ascii output at about 25 characters per 8 byte value
+        frames = list_frames(outdir)
+        files = frames[max(frames)] if frames else {}
+        if 'b' in files:
+            size = os.path.getsize(files['b'])
+        elif 'q' in files:
+            size = os.path.getsize(files['q']) * 8 // 25
+        else:
+            size = 0
+        if 'a' in files:
+            size += os.path.getsize(files['a'])
+        calibration['checkpoint_size'] = size
+    return calibration
+
+
+def recommend(outdir, mtbf, log_file=None, checkpoint_cost=None,
+              write_rate=None):
+    r"""
+    Recommend checkpoint settings from the calibration run in *outdir*.
+
+    :Input:
+     - *outdir* (path) - Output directory of the calibration run.
+     - *mtbf* - Mean time between failures, in seconds or e.g. '24h'.
+     - *log_file* (path) - Output of the code, to count time steps.
+     - *checkpoint_cost* - Seconds to write a checkpoint, measured from the
+       checkpoint size and write rate if None.
+     - *write_rate* (float) - Bytes per second written to outdir, measured
+       if None.
+
+    :Output:
+     - (dict) with the *calibration* (see *calibrate*), *checkpoint_cost*
+       and *interval* (wall seconds between checkpoints), the settings
+       *checkpt_style* and *checkpt_interval* or *checkpt_times* (with the
+       equivalent *checkpt_time_interval*), and the expected *overhead* of
+       checkpoints and of work lost to failures as a fraction of the run.
+    """
+
+    mtbf = parse_duration(mtbf)
+    calibration = calibrate(outdir, log_file)
+    if checkpoint_cost is None:
+        if write_rate is None:
+            write_rate = measure_write_rate(outdir,
+                             min(max(calibration['checkpoint_size'], 1024**2),
+                                 256 * 1024**2))
+        checkpoint_cost = calibration['checkpoint_size'] / write_rate
+    checkpoint_cost = float(checkpoint_cost)
+    interval = optimal_interval(checkpoint_cost, mtbf)
+
+    settings = {'calibration': calibration,
+                'mtbf': mtbf,
+                'checkpoint_cost': checkpoint_cost,
+                'interval': interval,
+                'overhead': checkpoint_cost / interval
+                            + (interval + checkpoint_cost) / (2 * mtbf)}
+
+    wall_per_time = calibration['wall_per_time']
+    t0 = calibration['t0'] or 0.
+    tfinal = calibration['tfinal']
+    if wall_per_time and tfinal is not None \
+       and wall_per_time * (tfinal - t0) <= interval:
+        # the whole run is shorter than the interval
+        settings['checkpt_style'] = 1
+        return settings
+    if calibration['wall_per_step']:
+        settings['checkpt_style'] = 3
+        settings['checkpt_interval'] = max(1, int(round(
+                                 interval / calibration['wall_per_step'])))
+    if wall_per_time:
+        time_interval = interval / wall_per_time
+        settings['checkpt_time_interval'] = time_interval
+        if 'checkpt_style' not in settings and tfinal is not None:
+            settings['checkpt_style'] = 2
+            count = int((tfinal - t0) / time_interval)
+            settings['checkpt_times'] = [t0 + n * time_interval
+                                         for n in range(1, count + 1)]
+    if 'checkpt_style' not in settings:
+        raise ValueError("Cannot time the calibration run in %s, it needs at"
+                         " least two frames or a log file" % outdir)
+    return settings
+
+
+def setrun_lines(settings):
+    r"""Return the lines setting *settings* in setrun.py."""
+
+    lines = ["clawdata.checkpt_style = %s" % settings['checkpt_style']]
+    if settings['checkpt_style'] == 3:
+        lines.append("clawdata.checkpt_interval = %s"
+                     % settings['checkpt_interval'])
+    elif settings['checkpt_style'] == 2:
+        lines.append("clawdata.checkpt_times = [%s]"
+                     % ', '.join('%.6g' % t for t in settings['checkpt_times']))
+    return lines
+
+
+def write_checkpoint_data(path, settings):
+    r"""
+    Rewrite the checkpoint parameters in claw.data *path* (or the claw.data
+    in directory *path*) according to *settings* from *recommend*.
+    """
+
+    if os.path.isdir(path):
+        path = os.path.join(path, 'claw.data')
+    style = settings['checkpt_style']
+    values = [('checkpt_style', str(style))]
+    if style == 3:
+        values.append(('checkpt_interval', str(settings['checkpt_interval'])))
+    elif style == 2:
+        values.append(('num_checkpt_times',
+                       str(len(settings['checkpt_times']))))
+        values.append(('checkpt_times', ' '.join(repr(float(t)) for t in
+                                                  settings['checkpt_times'])))
+    new_lines = ['%s =: %s\n' % (value.ljust(20), name.ljust(20))
+                 for (name, value) in values]
+
+    with open(path) as f:
+        lines = f.readlines()
+    names = [line.partition('=:')[2].split()[0] if '=:' in line
+             and line.partition('=:')[2].split() else None
+             for line in lines]
+    if 'checkpt_style' not in names:
+        raise ValueError("No checkpt_style in %s" % path)
+    n = names.index('checkpt_style')
+    # replace checkpt_style and the parameters of the old style after it:
+    end = n + 1
+    while end < len(lines) and names[end] in ['checkpt_interval',
+                                              'num_checkpt_times',
+                                              'checkpt_times']:
+        end += 1
+    lines[n:end] = new_lines
+    with open(path + '.tmp', 'w') as f:
+        f.writelines(lines)
+    os.replace(path + '.tmp', path)
+
+
+if __name__ == '__main__':
+    args = []
+    options = {}
+    argv = sys.argv[1:]
+    while argv:
+        arg = argv.pop(0)
+        if arg in ['--log', '--write'] and argv:
+            options[arg] = argv.pop(0)
+        else:
+            args.append(arg)
+    if len(args) < 2:
+        print("python checkpoint_interval.py OUTDIR MTBF [--log LOG]"
+              " [--write CLAW_DATA]")
+        sys.exit(0)
+    settings = recommend(args[0], args[1], log_file=options.get('--log'))
+    calibration = settings['calibration']
+    print("Checkpoint size %.1f MB%s, written in %.3g s"
+          % (calibration['checkpoint_size'] / 1024**2,
+             ' (estimated)' if calibration['checkpoint_size_estimated']
+             else '', settings['checkpoint_cost']))
+    print("Optimal interval between checkpoints %.3g s, expected overhead"
+          " %.1f%%" % (settings['interval'], 100 * settings['overhead']))
+    print("In setrun.py:")
+    for line in setrun_lines(settings):
+        print("    " + line)
+    if '--write' in options:
+        write_checkpoint_data(options['--write'], settings)
+        print("Wrote checkpoint settings to ", options['--write'])
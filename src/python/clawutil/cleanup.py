@@ -0,0 +1,113 @@
+r"""
+Remove the output of an earlier run from an output directory without making
+a new run wait for it.
+
+Rather than deleting stale files one by one before the code starts, they
+are renamed into a trash directory and deleted by a background thread while
+the new run proceeds.  A rename only changes the directory, so this takes a
+fraction of the time of deleting large files.  Only files matching the
+output patterns are moved, so the trash never holds anything else.  Trash
+left behind, e.g. if the process is killed before the deletion finished, is
+deleted at the start of the next run.
+"""
+
+import os
+import shutil
+import fnmatch
+import tempfile
+import threading
+
+
+def _trash_prefix(outdir):
+    return '.%s.trash-' % os.path.basename(outdir)
+
+
+def list_trash(outdir):
+    r"""Return trash directories left behind for *outdir*."""
+
+    outdir = os.path.abspath(outdir)
+    parent = os.path.dirname(outdir)
+    trash = []
+    for (path, prefix) in [(parent, _trash_prefix(outdir)),
+                           (outdir, '.trash-')]:
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        trash += [entry.path for entry in entries
+                  if entry.name.startswith(prefix)
+                  and entry.is_dir(follow_symlinks=False)]
+    return trash
+
+
+def delete_in_background(paths):
+    r"""
+    Delete the directory trees *paths* in a thread, which is returned.  The
+    interpreter waits for the thread before exiting, so that a short run
+    leaves no trash.
+    """
+
+    def delete():
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
+
+    thread = threading.Thread(target=delete)
+    thread.start()
+    return thread
+
+
+def _matches(name, patterns):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def _move_to_trash(outdir, names, trash_dir):
+    for name in names:
+        try:
+            os.rename(os.path.join(outdir, name), os.path.join(trash_dir, name))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # e.g. the trash is on another filesystem
+            try:
+                os.remove(os.path.join(outdir, name))
+            except FileNotFoundError:
+                pass
+
+
+def clear_output(outdir, patterns, batch_size=1024):
+    r"""
+    Remove the files in *outdir* whose names match one of *patterns*, by
+    moving them to a trash directory deleted in the background, together
+    with any trash left by earlier runs.  Other files and directories are
+    never moved.  Returns the thread doing the deletion.
+    """
+
+    outdir = os.path.abspath(outdir)
+    trash = list_trash(outdir)
+
+    # trash next to outdir, on the same filesystem unless outdir is a link
+    # or a mount point, otherwise in outdir:
+    trash_dir = None
+    if not (os.path.islink(outdir) or os.path.ismount(outdir)):
+        try:
+            trash_dir = tempfile.mkdtemp(prefix=_trash_prefix(outdir),
+                                         dir=os.path.dirname(outdir))
+        except OSError:
+            pass
+    if trash_dir is None:
+        trash_dir = tempfile.mkdtemp(prefix='.trash-', dir=outdir)
+
+    # moved in batches while the directory is read, so that the names of
+    # a large outdir are never all held at once:
+    batch = []
+    with os.scandir(outdir) as entries:
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False) \
+               and _matches(entry.name, patterns):
+                batch.append(entry.name)
+                if len(batch) >= batch_size:
+                    _move_to_trash(outdir, batch, trash_dir)
+                    batch = []
+    _move_to_trash(outdir, batch, trash_dir)
+
+    return delete_in_background(trash + [trash_dir])
@@ -0,0 +1,281 @@
+r"""
+Compress output frames in the background while the code keeps running, and
+read them back transparently.
+
+The fort.q, fort.b and fort.a files of each completed frame are compressed
+by a pool of worker threads (the codecs release the GIL) and the originals
+removed.  The small fort.t files are left as they are so that the frames
+can still be listed.  An index of the compressed files, with their sizes
+and codec, is kept in compression_index.json in the output directory.
+
+Codecs are 'gzip' (default, level 1), 'bz2', 'xz' and, if the zstandard
+module is installed, 'zstd' (level 3).  Used by runclaw with compress=True
+or compress='codec:level' (COMPRESS in the Makefile).
+
+Tools reading the output can use *open_output*, which opens a file or its
+compressed version as a decompressed stream, or restore the original files
+with::
+
+    python compress.py decompress _output
+"""
+
+import os
+import io
+import sys
+import json
+import gzip
+import bz2
+import lzma
+import shutil
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from clawpack.clawutil.frames import list_frames
+
+index_file = 'compression_index.json'
+
+# codec: (file extension, default level)
+codecs = {'gzip': ('.gz', 1),
+          'bz2': ('.bz2', 9),
+          'xz': ('.xz', 1),
+          'zstd': ('.zst', 3)}
+
+
+def parse_codec(spec):
+    r"""
+    Return (codec, level) from *spec*, e.g. True, 'gzip', 'zstd:5' or
+    'gzip:6'.
+    """
+
+    if spec in [True, None, '', 'True', 'true', 'T', 't']:
+        spec = 'gzip'
+    codec, _, level = str(spec).partition(':')
+    codec = codec.lower()
+    if codec not in codecs:
+        raise ValueError("Unknown compression codec %s, use one of %s"
+                         % (codec, ', '.join(codecs)))
+    if codec == 'zstd' and zstandard is None:
+        raise ImportError("The zstandard module is needed for codec zstd")
+    if level:
+        level = int(level)
+    else:
+        level = codecs[codec][1]
+    return codec, level
+
+
+def open_codec(path, codec, mode, level=None):
+    r"""
+    Open compressed file *path*, or a file object, in binary *mode* ('rb'
+    or 'wb').
+    """
+
+    if codec == 'gzip':
+        if mode == 'wb':
+            return gzip.open(path, mode, compresslevel=level)
+        return gzip.open(path, mode)
+    elif codec == 'bz2':
+        if mode == 'wb':
+            return bz2.open(path, mode, compresslevel=level)
+        return bz2.open(path, mode)
+    elif codec == 'xz':
+        if mode == 'wb':
+            return lzma.open(path, mode, preset=level)
+        return lzma.open(path, mode)
+    elif codec == 'zstd':
+        if mode == 'wb':
+            return zstandard.open(path, mode,
+                                  cctx=zstandard.ZstdCompressor(level=level))
+        return zstandard.open(path, mode)
+    raise ValueError("Unknown compression codec %s" % codec)
+
+
+def compress_file(path, codec='gzip', level=1):
+    r"""
+    Compress *path* into path + extension of *codec* and remove *path*.
+    Returns (compressed path, original size, compressed size).
+    """
+
+    compressed_path = path + codecs[codec][0]
+    tmp_path = compressed_path + '.tmp'
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f_in:
+        with open_codec(tmp_path, codec, 'wb', level) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024**2)
+    os.replace(tmp_path, compressed_path)
+    os.remove(path)
+    return compressed_path, size, os.path.getsize(compressed_path)
+
+
+def find_output(path):
+    r"""
+    Return (path, codec) of output file *path* or of its compressed version,
+    codec None if it is not compressed.  Raises IOError if neither exists.
+    """
+
+    if os.path.isfile(path):
+        return path, None
+    for (codec, (extension, level)) in codecs.items():
+        if os.path.isfile(path + extension):
+            return path + extension, codec
+    raise IOError("No output file %s or compressed version of it" % path)
+
+
+def open_output(path, mode='rb'):
+    r"""
+    Open output file *path*, or its compressed version if the file itself is
+    not found, for reading as a decompressed stream.  *mode* is 'rb' or 'r'
+    (text).
+    """
+
+    found_path, codec = find_output(path)
+    if codec is None:
+        return open(found_path, mode)
+    f = open_codec(found_path, codec, 'rb')
+    if 'b' not in mode:
+        f = io.TextIOWrapper(f)
+    return f
+
+
+def read_index(outdir):
+    r"""Return the compression index of *outdir* (empty if none)."""
+
+    try:
+        with open(os.path.join(outdir, index_file)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class FrameCompressor(object):
+    r"""
+    Compress the files of completed frames in worker threads, to be used as
+    a *clawutil.frames.FrameWatcher* callback.
+
+    :Input:
+     - *outdir* (path) - Output directory, where the index is written.
+     - *codec* (str) - Compression codec and optionally level, see
+       *parse_codec*.
+     - *workers* (int) - Number of worker threads, default 2.
+    """
+
+    def __init__(self, outdir, codec='gzip', workers=2):
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.outdir = os.path.abspath(outdir)
+        self.codec, self.level = parse_codec(codec)
+        self.index = read_index(self.outdir)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(workers)))
+        self._futures = []
+
+
+    def __call__(self, frameno, outdir, files, wait_for=()):
+        r"""
+        Queue the files of frame *frameno* for compression, once the
+        futures in *wait_for* (e.g. post-processing of the frame) are done.
+        """
+
+        for kind in ['q', 'b', 'a']:
+            if kind in files:
+                self._futures.append(self._executor.submit(
+                            self._compress, files[kind], wait_for))
+
+
+    def _compress(self, path, wait_for):
+
+        if wait_for:
+            from concurrent.futures import wait
+            wait(wait_for)
+        compressed_path, size, compressed_size = compress_file(path,
+                                                     self.codec, self.level)
+        with self._lock:
+            self.index[os.path.basename(path)] = {
+                'file': os.path.basename(compressed_path),
+                'codec': self.codec,
+                'level': self.level,
+                'size': size,
+                'compressed_size': compressed_size}
+            self._write_index()
+
+
+    def _write_index(self):
+        path = os.path.join(self.outdir, index_file)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+
+    def close(self):
+        r"""
+        Wait for all files to be compressed and return (original size,
+        compressed size) in bytes of all files in the index.
+        """
+
+        for future in self._futures:
+            try:
+                future.result()
+            except Exception as error:
+                print("==> compress: Could not compress file: %s" % error)
+        self._executor.shutdown()
+        size = sum(entry['size'] for entry in self.index.values())
+        compressed_size = sum(entry['compressed_size']
+                              for entry in self.index.values())
+        return size, compressed_size
+
+
+def compress_outdir(outdir, codec='gzip', workers=2):
+    r"""Compress all frames in *outdir* after a run."""
+
+    compressor = FrameCompressor(outdir, codec, workers)
+    for (frameno, files) in sorted(list_frames(outdir).items()):
+        compressor(frameno, outdir, files)
+    return compressor.close()
+
+
+def decompress_outdir(outdir):
+    r"""Restore the original files of all compressed files in *outdir*."""
+
+    outdir = os.path.abspath(outdir)
+    index = read_index(outdir)
+    for (name, entry) in list(index.items()):
+        path = os.path.join(outdir, name)
+        compressed_path = os.path.join(outdir, entry['file'])
+        if os.path.isfile(compressed_path):
+            with open_codec(compressed_path, entry['codec'], 'rb') as f_in:
+                with open(path + '.tmp', 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out, 1024**2)
+            os.replace(path + '.tmp', path)
+            os.remove(compressed_path)
+        del index[name]
+    if os.path.isfile(os.path.join(outdir, index_file)):
+        os.remove(os.path.join(outdir, index_file))
+
+
+if __name__ == '__main__':
+    usage = """
+    python compress.py compress OUTDIR [CODEC[:LEVEL]]
+    python compress.py decompress OUTDIR
+    python compress.py cat FILE
+    """
+    if len(sys.argv) < 3:
+        print(usage)
+        sys.exit(0)
+    command = sys.argv[1]
+    if command == 'compress':
+        codec = sys.argv[3] if len(sys.argv) > 3 else 'gzip'
+        size, compressed_size = compress_outdir(sys.argv[2], codec)
+        print("Compressed %.1f MB to %.1f MB" % (size / 1024**2,
+                                                 compressed_size / 1024**2))
+    elif command == 'decompress':
+        decompress_outdir(sys.argv[2])
+    elif command == 'cat':
+        with open_output(sys.argv[2]) as f:
+            shutil.copyfileobj(f, sys.stdout.buffer)
+    else:
+        print(usage)
+        sys.exit(1)
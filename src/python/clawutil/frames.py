@@ -0,0 +1,269 @@
+r"""
+Detect output frames as the Fortran code completes them and pass them on
+for post-processing while the run continues.
+
+A frame *n* consists of the files fort.tNNNN, fort.qNNNN and, for binary
+output, fort.bNNNN (plus fort.aNNNN if aux arrays are output).  A frame is
+complete once the code reports "Frame n output files done" on its output,
+once files of a later frame appear (frames are written in order), or once
+the run has ended.
+
+*FrameWatcher* calls a list of functions with each completed frame, in
+frame order.  *FrameHooks* is such a function that runs user post-processing
+for each frame in a pool of worker processes, so e.g. plots can be made while
+the simulation keeps running.  It is used by runclaw with frame_hooks=...
+(FRAME_HOOKS in the Makefile), which takes a Python file defining::
+
+    def frame_done(frameno, outdir, files):
+        # files maps 't', 'q', 'b', 'a' to the paths of the frame's files
+        ...
+
+    def run_done(outdir, framenos):
+        # optional, called once all frames have been processed
+        ...
+
+For example frame_done might plot the frame with visclaw's
+frametools.plotframe.
+"""
+
+import os
+import re
+import sys
+import threading
+import runpy
+
+# fort.t0003, fort.q0003, fort.b0003, fort.a0003:
+frame_file_re = re.compile(r"^fort\.([tqba])(\d{4,})$")
+
+# e.g. "AMRCLAW: Frame    3 output files done at time t =  0.3000E+00"
+frame_done_re = re.compile(r"Frame\s+(\d+)\s+output files done")
+
+
+def list_frames(outdir):
+    r"""
+    Return dictionary mapping frame numbers to dictionaries of the files of
+    each frame in *outdir*, keyed by 't', 'q', 'b' or 'a'.
+    """
+
+    frames = {}
+    try:
+        entries = list(os.scandir(outdir))
+    except OSError:
+        return frames
+    for entry in entries:
+        match = frame_file_re.match(entry.name)
+        # regular files only, not e.g. named pipes of a streamed run
+        if match and entry.is_file():
+            frames.setdefault(int(match.group(2)), {})[match.group(1)] = \
+                entry.path
+    return frames
+
+
+class FrameWatcher(object):
+    r"""
+    Watch *outdir* for completed frames and call each function in
+    *callbacks* as ``func(frameno, outdir, files)`` for every new frame, in
+    frame order, from a background thread.
+
+    Frames present when the watcher is created are not reported again unless
+    they are rewritten (e.g. on restart).
+
+    :Input:
+     - *outdir* (path) - Output directory of the run.
+     - *callbacks* (list) - Functions called for each completed frame.
+     - *interval* (float) - Seconds between scans of outdir.
+    """
+
+    def __init__(self, outdir, callbacks=None, interval=1.):
+
+        self.outdir = os.path.abspath(outdir)
+        self.callbacks = list(callbacks or [])
+        self.interval = float(interval)
+        self.completed = []
+        self._announced = set()
+        self._baseline = {}
+        for (frameno, files) in list_frames(self.outdir).items():
+            if 't' in files:
+                try:
+                    self._baseline[frameno] = os.path.getmtime(files['t'])
+                except OSError:
+                    pass
+        self._dispatched = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def feed_line(self, line, stream='stdout'):
+        r"""Note frames reported done on an output line of the code."""
+
+        match = frame_done_re.search(line)
+        if match:
+            self._announced.add(int(match.group(1)))
+            self._wake.set()
+
+
+    def _is_new(self, frameno, files):
+        if frameno not in self._baseline:
+            return True
+        try:
+            return os.path.getmtime(files['t']) != self._baseline[frameno]
+        except (KeyError, OSError):
+            return False
+
+
+    def scan(self, final=False):
+        r"""
+        Call the callbacks for frames completed since the last scan, or for
+        all remaining frames if *final*.  Returns the new frame numbers.
+        """
+
+        with self._lock:
+            frames = list_frames(self.outdir)
+            new = sorted(frameno for (frameno, files) in frames.items()
+                         if frameno not in self._dispatched
+                         and self._is_new(frameno, files))
+            done = []
+            for frameno in new:
+                if final or frameno in self._announced \
+                   or frameno < new[-1]:
+                    done.append(frameno)
+                else:
+                    break
+            for frameno in done:
+                self._dispatched.add(frameno)
+                self.completed.append(frameno)
+                for func in self.callbacks:
+                    func(frameno, self.outdir, frames[frameno])
+            return done
+
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self._stop.is_set():
+                self.scan()
+
+
+    def start(self):
+        r"""Start scanning outdir in a background thread."""
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    def finish(self):
+        r"""Stop watching and report all remaining frames as complete."""
+
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.scan(final=True)
+
+
+def _run_frame_hook(hook_file, frameno, outdir, files):
+    r"""Call frame_done from *hook_file* in a worker process."""
+
+    hooks = _loaded_hooks.get(hook_file)
+    if hooks is None:
+        hooks = runpy.run_path(hook_file)
+        _loaded_hooks[hook_file] = hooks
+    hooks['frame_done'](frameno, outdir, files)
+    return frameno
+
+_loaded_hooks = {}
+
+
+class FrameHooks(object):
+    r"""
+    Run post-processing for each completed frame in a pool of workers, to
+    be used as a *FrameWatcher* callback.
+
+    :Input:
+     - *hooks* - Path of a Python file defining ``frame_done(frameno,
+       outdir, files)`` and optionally ``run_done(outdir, framenos)``, run
+       in worker processes, or a function (or list of functions) called as
+       ``func(frameno, outdir, files)`` in worker threads.
+     - *workers* (int) - Size of the pool, default is the number of cores
+       available, at most 4.
+    """
+
+    def __init__(self, hooks, workers=None):
+
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+        if workers is None:
+            if hasattr(os, 'sched_getaffinity'):
+                workers = len(os.sched_getaffinity(0))
+            else:
+                workers = os.cpu_count() or 1
+            workers = min(4, workers)
+        workers = max(1, int(workers))
+
+        self.hook_file = None
+        self.functions = []
+        self.run_done = None
+        if isinstance(hooks, str):
+            self.hook_file = os.path.abspath(hooks)
+            if not os.path.isfile(self.hook_file):
+                raise IOError("Frame hooks file not found: %s" % hooks)
+            hook_globals = runpy.run_path(self.hook_file)
+            if 'frame_done' not in hook_globals:
+                raise ValueError("No function frame_done in %s" % hooks)
+            self.run_done = hook_globals.get('run_done', None)
+            # spawned rather than forked workers, since the parent has
+            # threads reading the output of the code
+            import multiprocessing
+            self._executor = ProcessPoolExecutor(max_workers=workers,
+                                mp_context=multiprocessing.get_context('spawn'))
+        else:
+            if callable(hooks):
+                hooks = [hooks]
+            self.functions = list(hooks)
+            self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._futures = []
+
+
+    def __call__(self, frameno, outdir, files):
+        r"""Queue frame *frameno* for processing, returns the futures."""
+
+        futures = []
+        if self.hook_file is not None:
+            futures.append(self._executor.submit(_run_frame_hook,
+                           self.hook_file, frameno, outdir, dict(files)))
+        for func in self.functions:
+            futures.append(self._executor.submit(func, frameno, outdir,
+                                                 dict(files)))
+        self._futures += [(frameno, future) for future in futures]
+        return futures
+
+
+    def close(self, outdir=None):
+        r"""
+        Wait for all frames to be processed, report failures and call
+        run_done.  Returns the list of frame numbers processed without error.
+        """
+
+        failed = set()
+        framenos = []
+        for (frameno, future) in self._futures:
+            try:
+                future.result()
+            except Exception as error:
+                failed.add(frameno)
+                print("==> frames: Post-processing frame %s failed: %s"
+                      % (frameno, error))
+            if frameno not in framenos:
+                framenos.append(frameno)
+        self._executor.shutdown()
+        processed = [frameno for frameno in framenos if frameno not in failed]
+        if self.run_done is not None and outdir is not None:
+            try:
+                self.run_done(outdir, processed)
+            except Exception as error:
+                print("==> frames: run_done failed: %s" % error)
+        sys.stdout.flush()
+        return processed
@@ -0,0 +1,295 @@
+r"""
+Consolidate the gaugeNNNNN.txt files written by a run into a single binary
+file that is fast to load.
+
+The gauge files are parsed in parallel and written to gauge_store.bin, which
+holds a JSON header followed by one float64 array stored by column: all the
+levels recorded by all gauges, then all the times, then each component of q.
+For each gauge the header gives its row offset and number of rows and
+columns (level, time, q, ...), its location, the first and last time
+recorded and a time index, the time of every *chunk_rows*-th row.
+*GaugeStore* memory maps the array, so all gauges are loaded by a single
+mapping, each gauge is a view into it and each of its variables is
+contiguous.  The time index locates the rows of a time window without
+reading the whole time series.
+
+Used by runclaw with gauge_store=True (GAUGE_STORE in the Makefile) after a
+successful run, or from the command line::
+
+    python gauge_store.py _output
+"""
+
+import os
+import re
+import sys
+import json
+import glob
+import bisect
+
+import numpy
+
+store_file = 'gauge_store.bin'
+_magic = b'CLAWGAUGESTORE2\n'
+_alignment = 64
+
+# Rows between the entries of the time index of each gauge
+chunk_rows = 4096
+
+_id_re = re.compile(r"gauge_id=\s*(\d+)")
+_location_re = re.compile(r"location=\(\s*([^)]*)\)")
+_num_var_re = re.compile(r"num_(?:var|eqn)=\s*(\d+)")
+_format_re = re.compile(r"file format\s+(\w+)")
+
+
+def read_gauge_file(path):
+    r"""
+    Parse gauge file *path*, returning (gauge_id, location, data) where data
+    is an array with a row per time recorded.  Reads the time series from
+    the accompanying .bin file for binary gauge output.
+    """
+
+    with open(path, 'rb') as f:
+        text = f.read()
+
+    header = []
+    start = 0
+    while text.startswith(b'#', start):
+        end = text.find(b'\n', start)
+        if end < 0:
+            end = len(text)
+        header.append(text[start:end].decode(errors='replace'))
+        start = end + 1
+    header = '\n'.join(header)
+
+    match = _id_re.search(header)
+    if match:
+        gauge_id = int(match.group(1))
+    else:
+        gauge_id = int(re.findall(r"\d+", os.path.basename(path))[0])
+    match = _location_re.search(header)
+    location = [float(x) for x in match.group(1).split()] if match else []
+
+    file_format = _format_re.search(header)
+    file_format = file_format.group(1) if file_format else 'ascii'
+    if file_format.startswith('binary'):
+        num_var = int(_num_var_re.search(header).group(1))
+        dtype = numpy.float32 if file_format == 'binary32' else numpy.float64
+        data = numpy.fromfile(os.path.splitext(path)[0] + '.bin',
+                              dtype=dtype).astype(numpy.float64)
+        data = data.reshape(-1, num_var + 2)
+    else:
+        body = text[start:]
+        first_line = body[:body.find(b'\n')] if b'\n' in body else body
+        num_columns = len(first_line.split())
+        data = numpy.array(body.replace(b'D', b'E').split(),
+                           dtype=numpy.float64)
+        if num_columns > 0:
+            data = data.reshape(-1, num_columns)
+        else:
+            data = data.reshape(0, 0)
+    return gauge_id, location, data
+
+
+def write_gauge_store(outdir, path=None, workers=None, remove=False):
+    r"""
+    Parse all gauge*.txt files in *outdir* with *workers* processes and
+    write them to one gauge store.
+
+    :Input:
+     - *outdir* (path) - Output directory of the run.
+     - *path* (path) - Store to write, default gauge_store.bin in outdir.
+     - *workers* (int) - Number of processes parsing gauge files, default
+       the number of cores.
+     - *remove* (bool) - Remove the gauge files once the store is written.
+
+    :Output:
+     - (path) Path of the store, None if there are no gauge files.
+    """
+
+    if path is None:
+        path = os.path.join(outdir, store_file)
+    gauge_files = sorted(glob.glob(os.path.join(outdir, 'gauge*.txt')))
+    if len(gauge_files) == 0:
+        return None
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(gauge_files) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(workers,
+                                                 len(gauge_files))) as pool:
+            gauges = list(pool.map(read_gauge_file, gauge_files,
+                                   chunksize=max(1, len(gauge_files)
+                                                    // (4 * workers))))
+    else:
+        gauges = [read_gauge_file(f) for f in gauge_files]
+
+    gauges.sort(key=lambda gauge: gauge[0])
+    num_columns = max(data.shape[1] for (gauge_id, location, data) in gauges)
+    index = []
+    offset = 0
+    for (gauge_id, location, data) in gauges:
+        (rows, columns) = data.shape
+        times = data[::chunk_rows, 1] if columns > 1 else []
+        index.append({'gauge_id': gauge_id,
+                      'location': location,
+                      'offset': offset,
+                      'rows': rows,
+                      'columns': columns,
+                      't_start': float(data[0, 1]) if rows > 0 else None,
+                      't_end': float(data[-1, 1]) if rows > 0 else None,
+                      'time_index': [float(t) for t in times]})
+        offset += rows
+
+    header = json.dumps({'shape': [num_columns, offset],
+                         'dtype': '<f8',
+                         'chunk_rows': chunk_rows,
+                         'gauges': index}).encode()
+    data_offset = len(_magic) + 8 + len(header)
+    padding = (-data_offset) % _alignment
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(_magic)
+        f.write(numpy.array([len(header) + padding], dtype='<u8').tobytes())
+        f.write(header + b' ' * padding)
+        for column in range(num_columns):
+            for (gauge_id, location, data) in gauges:
+                if column < data.shape[1]:
+                    values = numpy.ascontiguousarray(data[:, column],
+                                                     dtype='<f8')
+                else:
+                    values = numpy.full(data.shape[0], numpy.nan, dtype='<f8')
+                f.write(values.tobytes())
+    os.replace(path + '.tmp', path)
+
+    if remove:
+        for gauge_file in gauge_files:
+            os.remove(gauge_file)
+            if os.path.isfile(os.path.splitext(gauge_file)[0] + '.bin'):
+                os.remove(os.path.splitext(gauge_file)[0] + '.bin')
+    return path
+
+
+class StoredGauge(object):
+    r"""
+    One gauge of a *GaugeStore*, with attributes named as in
+    clawpack.pyclaw.gauges.GaugeSolution.
+
+    :Attributes:
+     - *id* (int) - Gauge number.
+     - *location* (list) - Coordinates of the gauge.
+     - *level* (array) - AMR level of each time recorded.
+     - *t* (array) - Times recorded.
+     - *q* (array) - Values recorded, q[m, :] is the m-th variable.
+     - *data* (array) - All values, data[n, :] is the n-th row recorded
+       (level, time, q).
+    """
+
+    def __init__(self, gauge_id, location, data, time_index=None,
+                 chunk_rows=chunk_rows):
+        if data.shape[1] < 2:
+            # no rows recorded in an ascii gauge file, so no columns either
+            data = numpy.zeros((data.shape[0], 2))
+        self.id = gauge_id
+        self.location = location
+        self.data = data
+        self.level = data[:, 0]
+        self.t = data[:, 1]
+        self.q = data[:, 2:].T
+        self._time_index = time_index or []
+        self._chunk_rows = chunk_rows
+
+
+    def _row_at(self, t, side):
+        r"""Return numpy.searchsorted(self.t, t, side), using the time index
+        to only search the chunk of rows that can contain *t*."""
+
+        start = 0
+        end = len(self.t)
+        if len(self._time_index) > 1:
+            k = bisect.bisect(self._time_index, t) if side == 'right' \
+                else bisect.bisect_left(self._time_index, t)
+            start = max(k - 1, 0) * self._chunk_rows
+            end = min(k * self._chunk_rows + 1, end) if k > 0 else 0
+        return start + numpy.searchsorted(self.t[start:end], t, side=side)
+
+
+    def at_time(self, t):
+        r"""Return the row recorded last at or before time *t*."""
+
+        n = self._row_at(t, 'right') - 1
+        return self.data[max(n, 0)]
+
+
+    def between(self, t_start, t_end):
+        r"""Return a *StoredGauge* with the rows recorded from time *t_start*
+        to *t_end* (included)."""
+
+        data = self.data[self._row_at(t_start, 'left'):
+                         self._row_at(t_end, 'right')]
+        return StoredGauge(self.id, self.location, data)
+
+
+class GaugeStore(object):
+    r"""
+    Gauges of a run read from a gauge store written by *write_gauge_store*.
+
+    :Input:
+     - *path* (path) - The store, or an output directory containing it.
+    """
+
+    def __init__(self, path):
+
+        if os.path.isdir(path):
+            path = os.path.join(path, store_file)
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(_magic)) != _magic:
+                raise IOError("%s is not a gauge store" % path)
+            header_size = int(numpy.frombuffer(f.read(8), dtype='<u8')[0])
+            header = json.loads(f.read(header_size).decode())
+        self.index = dict((entry['gauge_id'], entry)
+                          for entry in header['gauges'])
+        self.chunk_rows = header['chunk_rows']
+        shape = tuple(header['shape'])
+        if numpy.prod(shape) == 0:
+            # nothing recorded, which cannot be memory mapped
+            self.data = numpy.zeros(shape, dtype=header['dtype'])
+        else:
+            self.data = numpy.memmap(path, dtype=header['dtype'], mode='r',
+                                     offset=len(_magic) + 8 + header_size,
+                                     shape=shape)
+
+
+    def ids(self):
+        r"""Return the sorted gauge numbers."""
+
+        return sorted(self.index)
+
+
+    def __contains__(self, gauge_id):
+        return gauge_id in self.index
+
+
+    def __getitem__(self, gauge_id):
+        entry = self.index[gauge_id]
+        columns = self.data[:entry['columns'],
+                            entry['offset']:entry['offset'] + entry['rows']]
+        return StoredGauge(gauge_id, entry['location'], columns.T,
+                           entry['time_index'], self.chunk_rows)
+
+
+    def gauges(self):
+        r"""Return list of all gauges."""
+
+        return [self[gauge_id] for gauge_id in self.ids()]
+
+
+if __name__ == '__main__':
+    outdir = sys.argv[1] if len(sys.argv) > 1 else '_output'
+    path = write_gauge_store(outdir, remove='--remove' in sys.argv)
+    if path is None:
+        print("No gauge files in %s" % outdir)
+    else:
+        store = GaugeStore(path)
+        print("Wrote %s gauges to %s" % (len(store.ids()), path))
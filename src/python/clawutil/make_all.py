@@ -15,111 +15,447 @@ except:
     raise Exception("Need to set CLAW environment variable")
 
 
+def skip_directory(name):
+    r"""
+    Return True for directories that never contain examples, such as output
+    and plot directories, so that they are not searched.
+    """
+    return name.startswith('.') or ('_output' in name) or ('_plots' in name)
+
+
 def list_examples(examples_dir):
     """
     Searches all subdirectories of examples_dir for examples and prints out a list.
     """
-    import os
-
-    current_dir = os.getcwd()
-    os.chdir(examples_dir)
-    
-    dirlist = []
-    applist = []
 
-    # Traverse directories depth-first (topdown=False) to insure e.g. that code in
+    # Traverse directories depth-first to insure e.g. that code in
     #    amrclaw/examples/acoustics_2d_radial/1drad 
     # is run before code in
     #    amrclaw/examples/acoustics_2d_radial
+    # Output and plot directories are pruned rather than traversed.
+
+    def walk(path, dirlist):
+        files = []
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not skip_directory(entry.name):
+                    walk(entry.path, dirlist)
+            else:
+                files.append(entry.name)
+        # By convention we assume that a setrun.py file indicates this is an
+        # example directory.
+        if 'setrun.py' in files:
+            dirlist.append(path)
 
-    for (dirpath, subdirs, files) in os.walk('.',topdown=False):
+    dirlist = []
+    walk(os.path.abspath(examples_dir), dirlist)
 
-        if '_output' not in dirpath:
-            # By convention we assume that a setrun.py file indicates this is an
-            # example directory.
-            files = os.listdir(os.path.abspath(dirpath))
-            if 'setrun.py' in files:
-                dirlist.append(os.path.abspath(dirpath))
+    return dirlist
 
-    os.chdir(current_dir)
 
-    return dirlist
-        
+class ExampleCatalog(object):
+    r"""
+    Persistent catalog of the examples below *examples_dir*.
 
-def make_all(examples_dir = '.',make_clean_first=False, env=None):
-    import os,sys
+    For each example the catalog records some metadata from its Makefile and
+    setrun.py (package, num_dim, EXE and number of listed sources) and the
+    wall times of previous runs, and is saved as JSON in *catalog_file*
+    (default .example_catalog.json in examples_dir).
 
-    if env is None:
-        my_env = os.environ
-    else:
-        my_env = env
+    The predicted cost of each example can be used to start the longest
+    examples first, see *by_predicted_cost*.
+    """
 
-    examples_dir = os.path.abspath(examples_dir)
-    if not os.path.isdir(examples_dir):
-        raise Exception("Directory not found: %s" % examples_dir)
+    # Number of previous timings kept per example
+    max_timings = 5
+
+    # Number of similar examples an untimed example is estimated from
+    num_similar = 3
+
+    def __init__(self, examples_dir='.', catalog_file=None):
+
+        import json
+
+        self.examples_dir = os.path.abspath(examples_dir)
+        if catalog_file is None:
+            catalog_file = os.path.join(self.examples_dir,
+                                        '.example_catalog.json')
+        self.catalog_file = os.path.abspath(catalog_file)
+        self.examples = {}
+        if os.path.isfile(self.catalog_file):
+            try:
+                with open(self.catalog_file) as f:
+                    self.examples = json.load(f).get('examples', {})
+            except ValueError:
+                self.examples = {}
+
+
+    def save(self):
+        r"""Write the catalog to *catalog_file*."""
+
+        import json
+        with open(self.catalog_file + '.tmp', 'w') as f:
+            json.dump({'examples_dir': self.examples_dir,
+                       'examples': self.examples}, f, indent=1, sort_keys=True)
+        os.replace(self.catalog_file + '.tmp', self.catalog_file)
+
+
+    def refresh(self):
+        r"""
+        Search examples_dir for examples, updating the metadata of examples
+        whose Makefile or setrun.py changed and dropping examples that no
+        longer exist.  Returns the list of examples in depth-first order.
+        """
+
+        dir_list = list_examples(self.examples_dir)
+        examples = {}
+        for directory in dir_list:
+            entry = self.examples.get(directory, {})
+            mtime = max([os.path.getmtime(os.path.join(directory, f))
+                         for f in ['Makefile', 'setrun.py']
+                         if os.path.isfile(os.path.join(directory, f))])
+            if entry.get('mtime') != mtime:
+                entry.update(example_metadata(directory))
+                entry['mtime'] = mtime
+            entry.setdefault('timings', [])
+            examples[directory] = entry
+        self.examples = examples
+        return dir_list
+
+
+    def record_timing(self, directory, wall_time):
+        r"""Add *wall_time* (in seconds) of a successful run of *directory*."""
+
+        entry = self.examples.setdefault(directory, {'timings': []})
+        entry['timings'] = (entry.get('timings', []) + [wall_time]) \
+                                                    [-self.max_timings:]
+
+
+    def predicted_cost(self, directory):
+        r"""
+        Return predicted wall time of *directory*: the mean of its recorded
+        timings, otherwise the median of the (at most *num_similar*) examples
+        with the same package and num_dim listing the numbers of sources
+        closest to its own, otherwise the median over all examples (or 0).
+        """
+
+        entry = self.examples.get(directory, {})
+        if entry.get('timings'):
+            return sum(entry['timings']) / len(entry['timings'])
+
+        def median(values):
+            values = sorted(values)
+            if len(values) == 0:
+                return None
+            return values[len(values)//2]
+
+        def mean_time(e):
+            return sum(e['timings']) / len(e['timings'])
+
+        def source_distance(e):
+            if e.get('num_sources') is None \
+               or entry.get('num_sources') is None:
+                return 0
+            return abs(e['num_sources'] - entry['num_sources'])
+
+        timed = [e for e in self.examples.values() if e.get('timings')]
+        similar = [e for e in timed
+                   if e.get('package') == entry.get('package')
+                   and e.get('num_dim') == entry.get('num_dim')]
+        similar = sorted(similar, key=source_distance)[:self.num_similar]
+        cost = median([mean_time(e) for e in similar])
+        if cost is None:
+            cost = median([mean_time(e) for e in timed])
+        return cost if cost is not None else 0.
+
+
+    def by_predicted_cost(self, dir_list=None):
+        r"""Return *dir_list* (default all examples) longest first."""
+
+        if dir_list is None:
+            dir_list = list(self.examples)
+        return sorted(dir_list, key=self.predicted_cost, reverse=True)
+
+
+def example_metadata(directory):
+    r"""
+    Return dictionary with the package, num_dim, EXE and the number of
+    Fortran sources listed in the Makefile of the example in *directory*.
+    Values that cannot be determined are None.
+    """
 
-    current_dir = os.getcwd()
+    import re
+
+    metadata = {'package': None, 'num_dim': None, 'exe': None,
+                'num_sources': None}
+
+    makefile = os.path.join(directory, 'Makefile')
+    if os.path.isfile(makefile):
+        with open(makefile, errors='replace') as f:
+            text = f.read()
+        # leave out comments, e.g. sources commented out
+        text = re.sub(r'(?<!\\)#.*', '', text)
+        match = re.search(r'^\s*CLAW_PKG\s*[:?]?=\s*(\w+)', text, re.M)
+        if match:
+            metadata['package'] = match.group(1)
+        match = re.search(r'^\s*EXE\s*[:?]?=\s*(\S+)', text, re.M)
+        if match:
+            metadata['exe'] = match.group(1)
+        metadata['num_sources'] = len(re.findall(r'\S+\.[fF](?:90)?\b',
+                                                 text))
+
+    setrun = os.path.join(directory, 'setrun.py')
+    if os.path.isfile(setrun):
+        with open(setrun, errors='replace') as f:
+            match = re.search(r'num_dim\s*=\s*(\d)', f.read())
+        if match:
+            metadata['num_dim'] = int(match.group(1))
+
+    return metadata
+
+
+def example_dependencies(dir_list):
+    r"""
+    Return a dictionary mapping each directory in *dir_list* to the set of
+    directories in the list nested below it.
+
+    A directory such as amrclaw/examples/acoustics_2d_radial may use results
+    from acoustics_2d_radial/1drad, so it must not start before all examples
+    nested inside it have finished.
+    """
 
-    dir_list = list_examples(examples_dir)
-    print("Found the following example subdirectories:")
+    deps = {}
     for d in dir_list:
-        print("    ", d)
- 
-    print("Will run code and make plots in the above subdirectories of ")
-    print("    ", examples_dir)
-    ans = input("Ok? ")
-    if ans.lower() not in ['y','yes']:
-        print("Aborting.")
-        sys.exit()
-    
-    fname_output = 'make_all_output.txt'
-    fout = open(fname_output, 'w')
-    fout.write("ALL OUTPUT FROM RUNNING EXAMPLES\n\n")
+        prefix = d.rstrip(os.sep) + os.sep
+        deps[d] = set(d2 for d2 in dir_list if d2.startswith(prefix))
+    return deps
 
-    fname_errors = 'make_all_errors.txt'
-    ferr = open(fname_errors, 'w')
-    ferr.write("ALL ERRORS FROM RUNNING EXAMPLES\n\n")
 
-    os.chdir(examples_dir)
+def log_name(directory, examples_dir):
+    r"""Return a file name based on the path of *directory* in examples_dir"""
 
-    goodlist_run = []
-    badlist_run = []
-    
-    import subprocess
-    for directory in dir_list:
+    name = os.path.relpath(directory, examples_dir)
+    if name == '.':
+        name = os.path.basename(examples_dir)
+    return name.replace(os.sep, '__')
+
+
+def run_example(directory, make_clean_first=False, env=None,
+                output_file=None, error_file=None, target='all',
+                append=False):
+    r"""
+    Run 'make clean' (if *make_clean_first*) and 'make *target*' in
+    *directory*, sending output and errors to the files with the given paths
+    (appended to if *append*).
+
+    Returns the return code of 'make *target*' and the wall time in seconds.
+    """
+
+    import subprocess, time
 
+    t_start = time.time()
+    mode = 'a' if append else 'w'
+    with open(output_file, mode) as fout, open(error_file, mode) as ferr:
         fout.write("\n=============================================\n")
         fout.write(directory)
         fout.write("\n=============================================\n")
         ferr.write("\n=============================================\n")
         ferr.write(directory)
         ferr.write("\n=============================================\n")
-
-        os.chdir(directory)
-        print(directory)
-
-        # flush I/O buffers:
         fout.flush()
         ferr.flush()
 
         if make_clean_first:
             # Run 'make clean':
-            job = subprocess.Popen(['make','clean'], \
-                      stdout=fout,stderr=ferr)
+            job = subprocess.Popen(['make','clean'], cwd=directory,
+                      stdout=fout,stderr=ferr,env=env)
             return_code = job.wait()
-                
+
         # Run 'make all':
-        job = subprocess.Popen(['make','all'], \
-                  stdout=fout,stderr=ferr,env=my_env)
+        job = subprocess.Popen(['make',target], cwd=directory,
+                  stdout=fout,stderr=ferr,env=env)
         return_code = job.wait()
-                
-        if return_code == 0:
-            print("Successful run\n")
-            goodlist_run.append(directory)
-        else:
-            print("*** Run errors encountered: see %s\n" % fname_errors)
-            badlist_run.append(directory)
 
+    return return_code, time.time() - t_start
+
+
+def make_all(examples_dir = '.',make_clean_first=False, env=None,
+             num_jobs=1, omp_threads=None, ask_user=True,
+             log_dir='make_all_logs', use_catalog=False):
+    r"""
+    Run 'make all' in every example directory found below *examples_dir*.
+
+    :Input:
+     - *make_clean_first* (bool) - Run 'make clean' before 'make all'.
+     - *env* (dict) - Environment for the make commands, defaults to
+       os.environ.
+     - *num_jobs* (int) - Number of examples run concurrently.  Examples nested
+       inside another example directory always finish before it starts.
+       With more than one job, all examples are first built one at a time
+       with 'make .exe', since they compile the same common sources into
+       the same objects and .mod files in $CLAW, and only then run
+       concurrently.
+     - *omp_threads* (int) - If set, OMP_NUM_THREADS for each example, so that
+       num_jobs*omp_threads gives the number of cores used.
+     - *ask_user* (bool) - If False, do not ask for confirmation before
+       running, e.g. when running unattended in batch mode.
+     - *log_dir* (path) - Directory for the output and errors of each example.
+     - *use_catalog* (bool) - Use the *ExampleCatalog* of examples_dir to
+       start the examples with the longest predicted run time first, and
+       record the new timings in it.
+
+    Output and errors of all examples are also collected, in the order of
+    the examples, in make_all_output.txt and make_all_errors.txt, and the
+    wall time of each example is listed in make_all_summary.txt.
+
+    Returns the lists of directories that ran successfully and with errors.
+    """
+
+    import os,sys,time
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    # convert strings passed in from the command line:
+    if type(make_clean_first) is str:
+        make_clean_first = (make_clean_first.lower() in ['true','t'])
+    if type(ask_user) is str:
+        ask_user = (ask_user.lower() in ['true','t'])
+    if type(use_catalog) is str:
+        use_catalog = (use_catalog.lower() in ['true','t'])
+    if type(omp_threads) is str:
+        omp_threads = None if omp_threads.lower() in ['none', ''] \
+                      else int(omp_threads)
+    num_jobs = max(1, int(num_jobs))
+
+    if env is None:
+        my_env = os.environ
+    else:
+        my_env = env
+
+    if omp_threads is not None:
+        my_env = dict(my_env)
+        my_env['OMP_NUM_THREADS'] = str(omp_threads)
+
+    examples_dir = os.path.abspath(examples_dir)
+    if not os.path.isdir(examples_dir):
+        raise Exception("Directory not found: %s" % examples_dir)
+
+    if use_catalog:
+        catalog = ExampleCatalog(examples_dir)
+        dir_list = catalog.refresh()
+    else:
+        dir_list = list_examples(examples_dir)
+    print("Found the following example subdirectories:")
+    for d in dir_list:
+        print("    ", d)
+ 
+    print("Will run code and make plots in the above subdirectories of ")
+    print("    ", examples_dir)
+    if ask_user:
+        ans = input("Ok? ")
+        if ans.lower() not in ['y','yes']:
+            print("Aborting.")
+            sys.exit()
+
+    fname_output = 'make_all_output.txt'
+    fname_errors = 'make_all_errors.txt'
+    fname_summary = 'make_all_summary.txt'
+    log_dir = os.path.abspath(log_dir)
+    os.makedirs(log_dir, exist_ok=True)
+
+    logs = {}
+    for directory in dir_list:
+        name = log_name(directory, examples_dir)
+        logs[directory] = (os.path.join(log_dir, name + '_output.txt'),
+                           os.path.join(log_dir, name + '_errors.txt'))
+
+    deps = example_dependencies(dir_list)
+    if use_catalog:
+        pending = catalog.by_predicted_cost(dir_list)
+    else:
+        pending = list(dir_list)
+    running = {}
+    results = {}
+    build_times = {}
+    t_start = time.time()
+
+    if num_jobs > 1:
+        # build serially, the common objects are shared by all examples:
+        for directory in list(pending):
+            print("Building ", directory)
+            return_code, wall_time = run_example(directory, make_clean_first,
+                                                 my_env, *logs[directory],
+                                                 target='.exe')
+            build_times[directory] = wall_time
+            if return_code != 0:
+                pending.remove(directory)
+                results[directory] = (return_code, wall_time)
+                print("*** Build errors encountered (%.1f s): see %s\n" \
+                      % (wall_time, logs[directory][1]))
+        make_clean_first = False
+
+    with ThreadPoolExecutor(max_workers=num_jobs) as executor:
+        while pending or running:
+            # start examples, in order, whose nested examples are all done:
+            for directory in list(pending):
+                if len(running) >= num_jobs:
+                    break
+                if deps[directory].issubset(results):
+                    pending.remove(directory)
+                    print("Starting ", directory)
+                    future = executor.submit(run_example, directory,
+                                             make_clean_first, my_env,
+                                             *logs[directory],
+                                             append=(directory in build_times))
+                    running[future] = directory
+
+            done, not_done = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                directory = running.pop(future)
+                return_code, wall_time = future.result()
+                wall_time += build_times.get(directory, 0.)
+                results[directory] = (return_code, wall_time)
+                if return_code == 0:
+                    print("Successful run (%.1f s): %s\n" \
+                          % (wall_time, directory))
+                else:
+                    print("*** Run errors encountered (%.1f s): see %s\n" \
+                          % (wall_time, logs[directory][1]))
+
+    total_time = time.time() - t_start
+
+    if use_catalog:
+        for directory in dir_list:
+            if results[directory][0] == 0:
+                catalog.record_timing(directory, results[directory][1])
+        catalog.save()
+
+    goodlist_run = [d for d in dir_list if results[d][0] == 0]
+    badlist_run = [d for d in dir_list if results[d][0] != 0]
+
+    # Collect logs in the order of dir_list:
+    with open(fname_output, 'w') as fout, open(fname_errors, 'w') as ferr:
+        fout.write("ALL OUTPUT FROM RUNNING EXAMPLES\n\n")
+        ferr.write("ALL ERRORS FROM RUNNING EXAMPLES\n\n")
+        for directory in dir_list:
+            with open(logs[directory][0]) as f:
+                fout.write(f.read())
+            with open(logs[directory][1]) as f:
+                ferr.write(f.read())
+
+    with open(fname_summary, 'w') as fsum:
+        fsum.write("%s  %s  %s\n" % ("wall time (s)".rjust(14),
+                                      "status".ljust(6), "example"))
+        for directory in dir_list:
+            return_code, wall_time = results[directory]
+            status = 'ok' if return_code == 0 else 'FAILED'
+            fsum.write("%14.1f  %s  %s\n" % (wall_time, status.ljust(6),
+                                              directory))
+        fsum.write("\n%14.1f  total wall time with %s job slot(s)\n" \
+                   % (total_time, num_jobs))
 
     print('------------------------------------------------------------- ')
     print(' ')
@@ -139,12 +475,13 @@ def make_all(examples_dir = '.',make_clean_first=False, env=None):
             print('   ',d)
     print(' ')
     
-    fout.close()
-    ferr.close()
+    print('Total wall time: %.1f s' % total_time)
     print('For all output see ', fname_output)
     print('For all errors see ', fname_errors)
+    print('For wall time per example see ', fname_summary)
+    print('For the logs of each example see ', log_dir)
 
-    os.chdir(current_dir)
+    return goodlist_run, badlist_run
 
 
 def make_notebook_htmls(examples_dir = '.',make_clean_first=False, env=None):
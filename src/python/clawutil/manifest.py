@@ -0,0 +1,239 @@
+r"""
+Manifest of the files in an output directory, with the size, modification
+time and sha256 hash of each, so that output can be compared, synced or
+cached without reading it all again.
+
+The manifest is written to output_manifest.json in the output directory.
+Files are hashed in a pool of worker threads (hashlib releases the GIL), and
+when used by runclaw with manifest=True (MANIFEST in the Makefile) each
+frame is hashed as soon as it is completed, while the code keeps running.
+Files whose size and modification time match an existing manifest are not
+read again, so updating the manifest only costs hashing the files that
+changed.  From the command line::
+
+    python manifest.py write _output
+    python manifest.py diff _output other_output
+"""
+
+import os
+import sys
+import json
+import hashlib
+import threading
+
+manifest_file = 'output_manifest.json'
+
+
+def file_hash(path):
+    r"""Return the sha256 hex digest of the content of *path*."""
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024**2), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_entry(path):
+    r"""Return the manifest entry (size, mtime, sha256) of *path*."""
+
+    # stat before hashing, so that a file changed meanwhile is found to
+    # have changed on the next update
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+            'sha256': file_hash(path)}
+
+
+def list_files(outdir):
+    r"""
+    Return sorted paths of the regular files in *outdir* and its
+    subdirectories, relative to it, other than the manifest itself.
+    """
+
+    names = []
+
+    def walk(path, prefix):
+        for entry in os.scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                walk(entry.path, prefix + entry.name + '/')
+            elif entry.is_file() and prefix + entry.name != manifest_file \
+                 and not entry.name.endswith('.tmp'):
+                names.append(prefix + entry.name)
+
+    walk(outdir, '')
+    return sorted(names)
+
+
+def read_manifest(path):
+    r"""
+    Return the manifest in *path*, a manifest file or an output directory
+    containing one, as a dictionary mapping file names to entries (empty if
+    there is none).
+    """
+
+    if os.path.isdir(path):
+        path = os.path.join(path, manifest_file)
+    try:
+        with open(path) as f:
+            return json.load(f)['files']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def diff_manifests(old, new):
+    r"""
+    Compare manifests *old* and *new* (dictionaries, or paths as for
+    *read_manifest*), returning sorted lists (added, removed, changed) of
+    file names.
+    """
+
+    if not isinstance(old, dict):
+        old = read_manifest(old)
+    if not isinstance(new, dict):
+        new = read_manifest(new)
+    added = sorted(set(new) - set(old))
+    removed = sorted(set(old) - set(new))
+    changed = sorted(name for name in set(old) & set(new)
+                     if old[name]['sha256'] != new[name]['sha256'])
+    return added, removed, changed
+
+
+class OutputManifest(object):
+    r"""
+    Build the manifest of *outdir*, hashing files in worker threads as they
+    are added.  Can be used as a *clawutil.frames.FrameWatcher* callback to
+    hash each frame once completed.
+
+    :Input:
+     - *outdir* (path) - Output directory.
+     - *workers* (int) - Number of worker threads, default 2.
+    """
+
+    def __init__(self, outdir, workers=2):
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.outdir = os.path.abspath(outdir)
+        self.entries = read_manifest(self.outdir)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(workers)))
+        self._futures = {}
+
+
+    def add(self, path):
+        r"""Queue file *path* in outdir for hashing, unless unchanged."""
+
+        name = os.path.relpath(os.path.abspath(path),
+                               self.outdir).replace(os.sep, '/')
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        entry = self.entries.get(name)
+        if entry is not None and entry['size'] == st.st_size \
+           and entry['mtime_ns'] == st.st_mtime_ns:
+            return
+        pending = self._futures.get(name)
+        if pending is not None and not pending.done():
+            return
+        self._futures[name] = self._executor.submit(self._hash, name, path)
+
+
+    def _hash(self, name, path):
+        entry = file_entry(path)
+        with self._lock:
+            self.entries[name] = entry
+
+
+    def __call__(self, frameno, outdir, files):
+        r"""Queue the files of frame *frameno* for hashing."""
+
+        for path in files.values():
+            self.add(path)
+
+
+    def update(self):
+        r"""
+        Queue all files in outdir that are new or changed since hashed, and
+        forget files no longer there.
+        """
+
+        names = list_files(self.outdir)
+        for name in names:
+            self.add(os.path.join(self.outdir, name))
+        with self._lock:
+            for name in set(self.entries) - set(names):
+                del self.entries[name]
+
+
+    def write(self):
+        r"""
+        Update the manifest for all files in outdir, wait for the hashing and
+        write it.  Returns the path of the manifest.
+        """
+
+        self.update()
+        for (name, future) in list(self._futures.items()):
+            try:
+                future.result()
+            except OSError:
+                # removed meanwhile, e.g. compressed
+                with self._lock:
+                    self.entries.pop(name, None)
+        self._futures = {}
+        # files replaced since hashed, e.g. by compression, hashed again:
+        self.update()
+        for future in self._futures.values():
+            future.result()
+
+        path = os.path.join(self.outdir, manifest_file)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'algorithm': 'sha256',
+                       'files': dict(sorted(self.entries.items()))},
+                      f, indent=1)
+        os.replace(path + '.tmp', path)
+        return path
+
+
+    def close(self):
+        self._executor.shutdown()
+
+
+def write_manifest(outdir, workers=None):
+    r"""
+    Write the manifest of *outdir*, hashing only files that changed since
+    the manifest was last written, with *workers* threads (default the
+    number of cores).  Returns the path of the manifest.
+    """
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    manifest = OutputManifest(outdir, workers=workers)
+    try:
+        return manifest.write()
+    finally:
+        manifest.close()
+
+
+if __name__ == '__main__':
+    usage = """
+    python manifest.py write OUTDIR
+    python manifest.py diff OUTDIR|MANIFEST OUTDIR|MANIFEST
+    """
+    if len(sys.argv) < 3:
+        print(usage)
+        sys.exit(0)
+    command = sys.argv[1]
+    if command == 'write':
+        path = write_manifest(sys.argv[2])
+        print("Wrote manifest of %s files to %s"
+              % (len(read_manifest(path)), path))
+    elif command == 'diff' and len(sys.argv) > 3:
+        added, removed, changed = diff_manifests(sys.argv[2], sys.argv[3])
+        for (flag, names) in [('+', added), ('-', removed), ('M', changed)]:
+            for name in names:
+                print("%s %s" % (flag, name))
+        sys.exit(1 if added or removed or changed else 0)
+    else:
+        print(usage)
+        sys.exit(1)
@@ -0,0 +1,284 @@
+r"""
+Live progress monitor for a running Clawpack simulation.
+
+The monitor follows the output of the executable (lines passed in with
+*RunMonitor.feed_line*, or a log file such as nohup.out that it tails) and
+watches the output directory for new fort.t*/fort.q* frames.  From these it
+reports the simulated time reached, frames written, time steps on level 1
+per second, output bytes per second and an estimate of the time remaining
+until tfinal as read from claw.data.
+
+The status is printed to the terminal and written as JSON to
+run_status.json in the output directory so that other tools can poll it.
+
+Used by runclaw when called with monitor=True (MONITOR = True in the
+Makefile), or from the command line to follow a run started e.g. in nohup
+mode::
+
+    python monitor.py _output
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import threading
+
+from clawpack.clawutil.data import ClawData
+from clawpack.clawutil.frames import frame_file_re
+
+# Simulated time reported by the Fortran code, e.g.
+#   AMRCLAW: level  1  CFL = .899  dt =  0.1093E-01  final t =  0.6010E-01
+#   CLAW1EZ: Frame    1 output files done at time t =  0.5000D+00
+_time_re = re.compile(r"\bt\s*=\s*([-+]?[0-9]*\.?[0-9]+(?:[eEdD][-+]?[0-9]+)?)")
+# A time step reported as above, counted on level 1 only (codes without AMR
+# report no level):
+_step_re = re.compile(r"CFL\s*=")
+_level_re = re.compile(r"\blevel\s+(\d+)", re.I)
+
+
+def is_level1_step(line):
+    r"""True if output *line* of the code reports a time step on level 1."""
+
+    if not _step_re.search(line):
+        return False
+    level = _level_re.search(line)
+    return level is None or int(level.group(1)) == 1
+
+
+def read_run_times(outdir):
+    r"""
+    Return (t0, tfinal, num_frames) from claw.data in *outdir*, where
+    num_frames is the number of output frames expected (None if unknown).
+    """
+
+    clawdata = ClawData()
+    clawdata.read(os.path.join(outdir, 'claw.data'), force=True)
+    t0 = getattr(clawdata, 't0', 0.) or 0.
+    output_style = getattr(clawdata, 'output_style', 1)
+    tfinal = None
+    num_frames = None
+    if output_style == 1:
+        tfinal = clawdata.tfinal
+        num_frames = clawdata.num_output_times
+    elif output_style == 2:
+        output_times = clawdata.output_times
+        if not isinstance(output_times, list):
+            output_times = [output_times]
+        tfinal = output_times[-1]
+        num_frames = len(output_times)
+    elif output_style == 3:
+        total_steps = getattr(clawdata, 'total_steps', None)
+        interval = getattr(clawdata, 'output_step_interval', None)
+        if total_steps and interval:
+            num_frames = int(total_steps / interval)
+    return t0, tfinal, num_frames
+
+
+def format_seconds(seconds):
+    r"""Format *seconds* as h:mm:ss."""
+
+    if seconds is None:
+        return '--:--:--'
+    seconds = int(round(seconds))
+    return '%d:%s:%s' % (seconds // 3600, str(seconds % 3600 // 60).zfill(2),
+                         str(seconds % 60).zfill(2))
+
+
+class RunMonitor(object):
+    r"""
+    Monitor the progress of a run writing to *outdir*.
+
+    :Input:
+     - *outdir* (path) - Output directory of the run, containing claw.data.
+     - *log_file* (path) - File with the output of the executable to tail,
+       if its lines are not passed to *feed_line*.
+     - *interval* (float) - Seconds between status updates.
+     - *terminal* (bool) - Print a status line at every update.
+     - *status_file* (str) - Name of the JSON status file in outdir.
+    """
+
+    def __init__(self, outdir, log_file=None, interval=5., terminal=True,
+                 status_file='run_status.json'):
+
+        self.outdir = os.path.abspath(outdir)
+        self.log_file = log_file
+        self.interval = float(interval)
+        self.terminal = terminal
+        self.status_path = os.path.join(self.outdir, status_file)
+
+        try:
+            self.t0, self.tfinal, self.num_frames = read_run_times(self.outdir)
+        except (OSError, AttributeError, ValueError):
+            self.t0, self.tfinal, self.num_frames = 0., None, None
+
+        self.t = self.t0
+        self.steps = 0
+        self.frames = 0
+        self.output_bytes = 0
+        self.state = 'running'
+        self._start_time = time.time()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._log_position = 0
+
+
+    def feed_line(self, line, stream='stdout'):
+        r"""Update the step count and simulated time from an output line."""
+
+        with self._lock:
+            if is_level1_step(line):
+                self.steps += 1
+            times = _time_re.findall(line)
+            if times:
+                try:
+                    self.t = max(self.t, float(times[-1].replace('D', 'E')
+                                                        .replace('d', 'e')))
+                except ValueError:
+                    pass
+
+
+    def _tail_log(self):
+        r"""Feed lines appended to *log_file* since the last call."""
+
+        if self.log_file is None or not os.path.isfile(self.log_file):
+            return
+        with open(self.log_file, errors='replace') as f:
+            f.seek(self._log_position)
+            for line in f:
+                if not line.endswith('\n'):
+                    # incomplete line, read again next time
+                    break
+                self._log_position += len(line.encode())
+                self.feed_line(line)
+
+
+    def _scan_outdir(self):
+        r"""Count frames and output bytes written so far."""
+
+        frames = 0
+        output_bytes = 0
+        try:
+            entries = list(os.scandir(self.outdir))
+        except OSError:
+            entries = []
+        for entry in entries:
+            name = entry.name
+            if name.startswith('fort.') or (name.startswith('gauge')
+                                            and name.endswith('.txt')):
+                try:
+                    output_bytes += entry.stat().st_size
+                except OSError:
+                    continue
+                match = frame_file_re.match(name)
+                if match and match.group(1) == 't':
+                    frames += 1
+        self.frames = frames
+        self.output_bytes = output_bytes
+
+
+    def status(self):
+        r"""Return dictionary with the current status of the run."""
+
+        elapsed = time.time() - self._start_time
+        with self._lock:
+            t = self.t
+            steps = self.steps
+        progress = None
+        if self.tfinal is not None and self.tfinal > self.t0:
+            progress = min(1., (t - self.t0) / (self.tfinal - self.t0))
+        elif self.num_frames:
+            progress = min(1., max(self.frames - 1, 0) / self.num_frames)
+        eta = None
+        if progress is not None and progress > 0 and self.state == 'running':
+            eta = elapsed * (1. - progress) / progress
+        return {'state': self.state,
+                'outdir': self.outdir,
+                'time': t,
+                't0': self.t0,
+                'tfinal': self.tfinal,
+                'progress': progress,
+                'frames': self.frames,
+                'expected_frames': None if self.num_frames is None
+                                   else self.num_frames + 1,
+                'steps': steps,
+                'steps_per_second': steps / max(elapsed, 1e-9),
+                'output_bytes': self.output_bytes,
+                'output_bytes_per_second': self.output_bytes
+                                           / max(elapsed, 1e-9),
+                'elapsed': elapsed,
+                'eta': eta,
+                'updated': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+    def update(self):
+        r"""Refresh the status, write the status file and print it."""
+
+        self._tail_log()
+        self._scan_outdir()
+        status = self.status()
+
+        try:
+            with open(self.status_path + '.tmp', 'w') as f:
+                json.dump(status, f, indent=1)
+            os.replace(self.status_path + '.tmp', self.status_path)
+        except OSError:
+            pass
+
+        if self.terminal:
+            if status['progress'] is None:
+                progress = '?'
+            else:
+                progress = '%.0f%%' % (100 * status['progress'])
+            print("==> monitor: t = %g (%s), %s frames, %.1f steps/s, "
+                  "%.2f MB/s, ETA %s" % (status['time'], progress,
+                   status['frames'], status['steps_per_second'],
+                   status['output_bytes_per_second'] / 1024**2,
+                   format_seconds(status['eta'])))
+            sys.stdout.flush()
+        return status
+
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.update()
+
+
+    def start(self):
+        r"""Start updating the status every *interval* seconds."""
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    def stop(self, returncode=0):
+        r"""Stop monitoring and write the final status."""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.state = 'done' if returncode == 0 else 'failed'
+        return self.update()
+
+
+if __name__ == '__main__':
+    # Follow a run writing to the output directory given (default _output),
+    # e.g. one started in nohup mode, until interrupted, tfinal is reached or
+    # all expected frames have been written.
+    outdir = sys.argv[1] if len(sys.argv) > 1 else '_output'
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 5.
+    monitor = RunMonitor(outdir, log_file=os.path.join(outdir, 'nohup.out'),
+                         interval=interval)
+    try:
+        while True:
+            status = monitor.update()
+            if status['progress'] is not None and status['progress'] >= 1:
+                break
+            if status['expected_frames'] is not None and \
+               status['frames'] >= status['expected_frames']:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,285 @@
+r"""
+Coarsened quick-look copies of output frames.
+
+For each frame, every patch is coarsened by averaging blocks of 2, 4 and 8
+(by default) cells in each direction, and all coarsened patches are written
+in single precision to one file fort.pNNNN next to the frame, holding a
+JSON header (time, number of equations and dimensions, and for each factor
+the level, lower corner, cell size, shape and offset of each patch) followed
+by the data.  *read_pyramid* memory maps a frame so that only the bytes of
+the factor used are read, a small fraction of the frame for a preview.
+
+Frames are read from ascii or binary output, also when compressed by
+clawutil.compress.  Used by runclaw with pyramid=True (PYRAMID in the
+Makefile) as each frame is completed, or from the command line::
+
+    python pyramid.py _output [2,4,8]
+"""
+
+import os
+import sys
+import json
+
+import numpy
+
+from clawpack.clawutil import compress
+from clawpack.clawutil.frames import list_frames
+
+default_factors = [2, 4, 8]
+_magic = b'CLAWPYRAMID1\n'
+_alignment = 64
+
+
+def pyramid_file(outdir, frameno):
+    r"""Path of the pyramid of frame *frameno* in *outdir*."""
+
+    return os.path.join(outdir, 'fort.p%s' % str(frameno).zfill(4))
+
+
+def parse_factors(spec):
+    r"""Return list of factors from *spec*, e.g. True, '2,4,8' or [2, 4]."""
+
+    if spec in [True, None, '', 'True', 'true', 'T', 't']:
+        return list(default_factors)
+    if isinstance(spec, str):
+        spec = spec.split(',')
+    return sorted(set(int(factor) for factor in spec))
+
+
+def read_frame_info(path):
+    r"""
+    Return dictionary with the *time*, *meqn*, *ngrids*, *naux*, *ndim*,
+    *nghost* and *dtype* of the data of a frame from its fort.t file *path*.
+    """
+
+    with compress.open_output(path, 'r') as f:
+        values = [line.split()[0] for line in f if line.strip()]
+    info = {'time': float(values[0].replace('D', 'E').replace('d', 'e'))}
+    info['meqn'], info['ngrids'], info['naux'], info['ndim'] = \
+        [int(value) for value in values[1:5]]
+    info['nghost'] = int(values[5]) if len(values) > 5 else 2
+    output_format = values[6].strip("'") if len(values) > 6 else '1'
+    if output_format in ['2', 'binary32']:
+        info['dtype'] = numpy.float32
+    else:
+        info['dtype'] = numpy.float64
+    return info
+
+
+def _read_t(outdir, frameno):
+    r"""Return (time, meqn, ngrids, ndim, nghost, dtype) from fort.t."""
+
+    info = read_frame_info(os.path.join(outdir,
+                                        'fort.t%s' % str(frameno).zfill(4)))
+    return (info['time'], info['meqn'], info['ngrids'], info['ndim'],
+            info['nghost'], info['dtype'])
+
+
+def parse_patches(text, ndim, meqn, binary=None, dtype=numpy.float64,
+                  nghost=2):
+    r"""
+    Parse the patches of a frame from the contents *text* of its fort.q file
+    (and *binary*, the contents of fort.b, for binary output), returning a
+    list of dictionaries with the level, lower corner, cell size *delta* and
+    *q* of shape (meqn, mx[, my[, mz]]) of each patch.
+    """
+
+    tokens = text.replace(b'D', b'E').replace(b'd', b'e').split()
+    patches = []
+    position = 0
+    binary_position = 0
+    header_size = 2 * (2 + 3 * ndim)
+    while position + header_size <= len(tokens):
+        header = tokens[position:position + header_size:2]
+        position += header_size
+        level = int(header[1])
+        shape = [int(m) for m in header[2:2 + ndim]]
+        lower = [float(x) for x in header[2 + ndim:2 + 2 * ndim]]
+        delta = [float(d) for d in header[2 + 2 * ndim:2 + 3 * ndim]]
+        if binary is None:
+            count = meqn * int(numpy.prod(shape))
+            values = numpy.array(tokens[position:position + count],
+                                 dtype=numpy.float64)
+            position += count
+            # ascii values run over i fastest, then j, k with all
+            # equations of a cell on one line
+            q = values.reshape(shape[::-1] + [meqn])
+        else:
+            ghost_shape = [m + 2 * nghost for m in shape]
+            count = meqn * int(numpy.prod(ghost_shape))
+            values = numpy.frombuffer(binary, dtype=dtype, count=count,
+                                      offset=binary_position)
+            binary_position += count * numpy.dtype(dtype).itemsize
+            q = values.reshape(ghost_shape[::-1] + [meqn])
+            q = q[tuple([slice(nghost, nghost + m) for m in shape[::-1]])]
+        q = q.transpose(list(range(ndim, -1, -1)))
+        patches.append({'level': level, 'lower': lower, 'delta': delta,
+                        'q': q})
+    return patches
+
+
+def read_frame(outdir, frameno):
+    r"""
+    Read frame *frameno* from *outdir*, returning (time, ndim, patches)
+    where each patch is a dictionary with the level, lower corner, cell size
+    *delta* and *q* of shape (meqn, mx[, my[, mz]]).
+    """
+
+    time, meqn, ngrids, ndim, nghost, dtype = _read_t(outdir, frameno)
+    name = 'fort.q%s' % str(frameno).zfill(4)
+    with compress.open_output(os.path.join(outdir, name)) as f:
+        text = f.read()
+
+    binary = None
+    binary_name = os.path.join(outdir, 'fort.b%s' % str(frameno).zfill(4))
+    try:
+        with compress.open_output(binary_name) as f:
+            binary = f.read()
+    except IOError:
+        pass
+
+    patches = parse_patches(text, ndim, meqn, binary, dtype, nghost)
+    return time, ndim, patches
+
+
+def coarsen(q, factor):
+    r"""
+    Average blocks of *factor* cells in each direction of *q*, of shape
+    (meqn, mx, ...).  Blocks at the upper edges may be smaller.
+    """
+
+    for axis in range(1, q.ndim):
+        n = q.shape[axis]
+        starts = numpy.arange(0, n, factor)
+        counts = numpy.diff(numpy.append(starts, n))
+        shape = [1] * q.ndim
+        shape[axis] = len(starts)
+        q = numpy.add.reduceat(q, starts, axis=axis) / counts.reshape(shape)
+    return q
+
+
+def write_pyramid(outdir, frameno, factors=default_factors):
+    r"""
+    Write the coarsened copies of frame *frameno* in *outdir* by each of
+    *factors* to fort.pNNNN.  Returns the path written.
+    """
+
+    time, ndim, patches = read_frame(outdir, frameno)
+    index = {}
+    arrays = []
+    offset = 0
+    for factor in factors:
+        entries = []
+        for patch in patches:
+            q = coarsen(patch['q'], factor).astype('<f4')
+            entries.append({'level': patch['level'],
+                            'lower': patch['lower'],
+                            'delta': [d * factor for d in patch['delta']],
+                            'shape': list(q.shape),
+                            'offset': offset})
+            arrays.append(q)
+            offset += q.size
+        index[str(factor)] = entries
+    meqn = patches[0]['q'].shape[0] if patches else 0
+    header = json.dumps({'time': time, 'ndim': ndim, 'meqn': meqn,
+                         'dtype': '<f4', 'size': offset,
+                         'factors': index}).encode()
+    data_offset = len(_magic) + 8 + len(header)
+    padding = (-data_offset) % _alignment
+
+    path = pyramid_file(outdir, frameno)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(_magic)
+        f.write(numpy.array([len(header) + padding], dtype='<u8').tobytes())
+        f.write(header + b' ' * padding)
+        for q in arrays:
+            f.write(numpy.ascontiguousarray(q).tobytes())
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def read_pyramid(outdir, frameno, factor=None):
+    r"""
+    Read the coarsened copy of frame *frameno* in *outdir* by *factor*
+    (default the largest available), returning (time, patches) where each
+    patch is a dictionary with the level, lower corner, cell size *delta*
+    and a memory mapped *q* of shape (meqn, mx[, my[, mz]]).
+    """
+
+    path = pyramid_file(outdir, frameno)
+    with open(path, 'rb') as f:
+        if f.read(len(_magic)) != _magic:
+            raise IOError("%s is not a frame pyramid" % path)
+        header_size = int(numpy.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(header_size).decode())
+    if factor is None:
+        factor = max(int(key) for key in header['factors'])
+    if str(factor) not in header['factors']:
+        raise ValueError("No factor %s in %s, only %s" % (factor, path,
+                         ', '.join(sorted(header['factors'], key=int))))
+    data = numpy.memmap(path, dtype=header['dtype'], mode='r',
+                        offset=len(_magic) + 8 + header_size,
+                        shape=(header['size'],))
+    patches = []
+    for entry in header['factors'][str(factor)]:
+        size = int(numpy.prod(entry['shape']))
+        q = data[entry['offset']:entry['offset'] + size]
+        patches.append({'level': entry['level'], 'lower': entry['lower'],
+                        'delta': entry['delta'],
+                        'q': q.reshape(entry['shape'])})
+    return header['time'], patches
+
+
+class PyramidBuilder(object):
+    r"""
+    Write the pyramid of each completed frame in worker processes, to be
+    used as a *clawutil.frames.FrameWatcher* callback.
+
+    :Input:
+     - *factors* (list) - Coarsening factors, see *parse_factors*.
+     - *workers* (int) - Number of worker processes, default 2.
+    """
+
+    def __init__(self, factors=None, workers=2):
+
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.factors = parse_factors(factors)
+        # spawned rather than forked, the parent has threads running
+        self._executor = ProcessPoolExecutor(max_workers=max(1, int(workers)),
+                             mp_context=multiprocessing.get_context('spawn'))
+        self._futures = []
+
+
+    def __call__(self, frameno, outdir, files):
+        r"""Queue frame *frameno* for coarsening, returns the futures."""
+
+        future = self._executor.submit(write_pyramid, outdir, frameno,
+                                       self.factors)
+        self._futures.append((frameno, future))
+        return [future]
+
+
+    def close(self):
+        r"""Wait for all frames and return the number of pyramids written."""
+
+        written = 0
+        for (frameno, future) in self._futures:
+            try:
+                future.result()
+                written += 1
+            except Exception as error:
+                print("==> pyramid: Could not coarsen frame %s: %s"
+                      % (frameno, error))
+        self._executor.shutdown()
+        return written
+
+
+if __name__ == '__main__':
+    outdir = sys.argv[1] if len(sys.argv) > 1 else '_output'
+    factors = parse_factors(sys.argv[2] if len(sys.argv) > 2 else None)
+    builder = PyramidBuilder(factors, workers=os.cpu_count() or 1)
+    for (frameno, files) in sorted(list_frames(outdir).items()):
+        builder(frameno, outdir, files)
+    print("Wrote %s frame pyramids in %s" % (builder.close(), outdir))
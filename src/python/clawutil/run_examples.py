@@ -21,7 +21,16 @@ env = os.environ
 #env['FFLAGS'] = '-O2 -fopenmp'
 #env['OMP_NUM_THREADS'] = '6'
 
-make_all.make_all(make_clean_first=True, env=env)
+# Number of examples to run at once and OMP_NUM_THREADS for each of them,
+# e.g. num_jobs=8, omp_threads=4 to keep 32 cores busy:
+num_jobs = 1
+omp_threads = None
+
+# Start the examples that took longest in previous runs first?
+use_catalog = False
+
+make_all.make_all(make_clean_first=True, env=env, num_jobs=num_jobs,
+                  omp_threads=omp_threads, use_catalog=use_catalog)
 
 run_notebooks = True  # run any *.ipynb files and create html versions?
 
@@ -11,15 +11,32 @@ from a directory that contains a claw.data file and a Clawpack executable.
 import os
 import sys
 import glob
+import fnmatch
+import json
 import shutil
 import shlex
 import subprocess
 import time
 import warnings
 import runpy
+import threading
+import queue
 
 from clawpack.clawutil.data import ClawData
 from clawpack.clawutil.claw_git_status import make_git_status_file
+from clawpack.clawutil import build_cache
+from clawpack.clawutil import snapshot
+from clawpack.clawutil import cleanup
+
+# Output files produced by the Fortran code, removed before a new run and
+# saved in the result cache:
+output_patterns = ['fort.*', 'gauge*.txt', 'compression_index.json',
+                   'gauge_store.bin', 'output_manifest.json']
+
+# Files in outdir not considered as input when computing the key of the
+# result cache, since they change with every run:
+cache_ignore_patterns = output_patterns + ['runlog.txt', 'claw_git_*.txt',
+                                           'nohup.out', 'run_metrics.json']
 
 # define an execution error class that returns a
 # message as well as the rest of the subprocess exceptions
@@ -34,11 +51,18 @@ class ClawExeError(subprocess.CalledProcessError):
 def runclaw(xclawcmd=None, outdir=None, overwrite=True, restart=None, 
             rundir=None, print_git_status=False, nohup=False, nice=None,
             runexe=None,
-            xclawout=None, xclawerr=None, verbose=True):
+            xclawout=None, xclawerr=None, verbose=True, max_restarts=0,
+            **options):
     """
     Run the Fortran version of Clawpack using executable xclawcmd, which is
     typically set to 'xclaw', 'xamr', etc.
 
+    The further keyword arguments (*options*) are passed on to
+    *start_runclaw*, and select the optional features described below:
+    backups, keep_backups, restart_file, stage, scratch, manifest, pack,
+    use_cache, monitor, frame_hooks, hook_workers, compress, pyramid,
+    reducer and gauge_store.
+
     If it is not set by the call, get it from the environment variable
     CLAW_EXE.  Default to 'xclaw' if that's not set.
 
@@ -46,8 +70,24 @@ def runclaw(xclawcmd=None, outdir=None, overwrite=True, restart=None,
     If overwrite is False, move the outdir (or copy in the case of a restart)
     to a backup directory with a unique name based on time executed.
 
+    If backups is True, or the path of a directory, the backup of outdir
+    made with overwrite=False is moved into a backup store (outdir +
+    '_backups' if True) in which files identical across backups are
+    hardlinks to a single copy, and keep_backups, e.g. 'last=5,size=20G,
+    age=30d', sets the rules for removing old backups from it after each
+    backup (see clawutil.backups).  If None, the environment variables
+    CLAW_BACKUPS and CLAW_KEEP_BACKUPS are used if set.
+
     If restart is None, determine whether this is a restart from claw.data
     (as set in setrun.py).  Can remove setting RESTART in Makefiles.
+
+    If restart_file is set, e.g. to 'fort.chk00006', the run restarts from
+    this checkpoint in outdir: claw.data in outdir is rewritten to restart
+    from it, without changing the claw.data in rundir.
+
+    If max_restarts is larger than 0, the run is restarted from the latest
+    valid checkpoint in outdir each time the code fails, at most
+    max_restarts times (see clawutil.supervisor).
     
     If rundir is None, all *.data is copied from current directory, if a path 
     is given, data files are copied from there instead.
@@ -69,6 +109,137 @@ def runclaw(xclawcmd=None, outdir=None, overwrite=True, restart=None,
     to the same file, specify ``xclawout`` as the filepath and 
     ``xclawerr=subprocess.STDOUT``.
 
+    stage is the policy for placing the *.data files (and files copied by a
+    b4run function accepting a stage argument) into outdir: 'copy' (the
+    default), 'hardlink', 'symlink' or 'reflink', each falling back to a
+    copy where not possible (see clawutil.snapshot.stage_file).  If None, the
+    environment variable CLAW_STAGE is used.
+
+    If scratch is True, or the path of a directory, the code runs in a new
+    directory on node-local scratch space (under CLAW_SCRATCH, or the system
+    temporary directory, if True) instead of in outdir.  Completed frames
+    are moved to outdir while the code runs and all remaining output once it
+    ends, even if it fails, after which the scratch directory is removed
+    (see clawutil.scratch.ScratchRun).  If None, the environment variable
+    CLAW_SCRATCH is used if set.
+
+    If pyramid is True, or a list of factors such as '2,4,8' (the default),
+    a copy of each frame coarsened by averaging over blocks of cells is
+    written to fort.pNNNN as the frame is completed, for quick previews
+    (see clawutil.pyramid).
+
+    reducer is the path of a Python file defining a function
+    reduce_frame(frameno, data, info, outdir), called with the contents of
+    each frame as the code writes it, and its time and dimensions.  The
+    fort.q files are then named pipes read in memory rather than files
+    written to disk, and are not kept in outdir (see clawutil.streaming).
+    Frames that cannot be streamed, e.g. binary output, are written to
+    files and passed to the reducer from there.
+
+    If gauge_store is True, all gauge*.txt files are consolidated after a
+    successful run into the single binary file gauge_store.bin in outdir,
+    that is loaded quickly with clawutil.gauge_store.GaugeStore.  With
+    gauge_store='remove', the gauge files are removed once consolidated.
+
+    If manifest is True, the size, modification time and sha256 hash of
+    every file in outdir are written to output_manifest.json after a
+    successful run (before packing), hashing each frame in the background
+    as soon as it is completed, so that output can later be compared or
+    synced from the manifest alone (see clawutil.manifest).
+
+    If pack is True, outdir is packed into a single archive outdir + '.zip'
+    after a successful run, from which single frames can be read without
+    unpacking (see clawutil.archive).  With pack='remove', outdir is removed
+    once packed.  Output written to rundir (or a directory containing it) is
+    never packed.
+
+    If use_cache is True, the fort.* and gauge*.txt output of a run is saved
+    in a result cache (see clawutil.build_cache.ResultCache) keyed by the
+    executable, the *.data files and any files copied into outdir by b4run,
+    and the compress and pyramid settings, since the frames are saved as
+    left by them.  Rerunning an unchanged case then restores the output into
+    outdir (via hardlinks where possible) instead of running the code, and
+    the metrics of the run are {'returncode': 0, 'cached': True}.  If
+    use_cache is None, the environment variable CLAW_RUN_CACHE is used
+    (default False).  Restarts and runs with frame_hooks or a reducer are
+    never cached.
+
+    If monitor is True, report progress while the code runs (simulated time
+    reached, frames written, steps and output bytes per second and an
+    estimate of the time remaining) every 5 seconds, or every *monitor*
+    seconds if it is a number, and keep the status in run_status.json in
+    outdir (see clawutil.monitor.RunMonitor).
+
+    frame_hooks is the path of a Python file defining a function
+    frame_done(frameno, outdir, files), or a list of such functions, called
+    for each output frame as soon as the code has finished writing it, in a
+    pool of hook_workers worker processes (threads for functions) while the
+    code keeps running, e.g. to plot the frame (see clawutil.frames).  The
+    run returns once all frames have been processed.
+
+    If compress is True, or a codec with optional level such as 'gzip:1' or
+    'zstd:3', the fort.q/b/a files of each frame are compressed in the
+    background once complete (after any frame_hooks), and an index kept in
+    compression_index.json.  Read them with clawutil.compress.open_output.
+
+    Returns a dictionary with the resources used by the run (see
+    *RunclawJob.metrics*), which is also written to run_metrics.json in
+    outdir.  Returns None if the run could not be set up.
+
+    """
+
+    options.update(overwrite=overwrite, restart=restart, rundir=rundir,
+                   print_git_status=print_git_status, nohup=nohup, nice=nice,
+                   runexe=runexe, xclawout=xclawout, xclawerr=xclawerr,
+                   verbose=verbose)
+
+    if max_restarts in [None, 'None', '']:
+        max_restarts = 0
+    if int(max_restarts) > 0:
+        from clawpack.clawutil.supervisor import supervise
+        return supervise(xclawcmd=xclawcmd, outdir=outdir,
+                         max_restarts=max_restarts, **options)
+
+    job = start_runclaw(xclawcmd=xclawcmd, outdir=outdir, new_session=False,
+                        **options)
+    if job is None:
+        return None
+
+    job.wait()
+    return job.metrics
+
+
+def start_runclaw(xclawcmd=None, outdir=None, overwrite=True, restart=None, 
+                  rundir=None, print_git_status=False, nohup=False, nice=None,
+                  runexe=None,
+                  xclawout=None, xclawerr=None, verbose=True, use_cache=None,
+                  monitor=False, frame_hooks=None, hook_workers=None,
+                  compress=False, stage=None, scratch=None, pack=False,
+                  gauge_store=False, pyramid=False, reducer=None,
+                  manifest=False, backups=None, keep_backups=None,
+                  restart_file=None, stream=False, timeout=None,
+                  new_session=True, env=None, cpus=None):
+    r"""
+    Start the Fortran version of Clawpack without waiting for it to finish.
+
+    The output directory is prepared, data files copied and b4run executed
+    exactly as in *runclaw* (see there for the arguments shared with it),
+    then the executable is started and a *RunclawJob* handle is returned
+    that can be polled, waited on (also with ``await``), streamed and
+    cancelled.  Returns None if the run could not be set up.
+
+    :Input:
+     - *stream* (bool) - Capture stdout and stderr of the executable line by
+       line so they can be read with *RunclawJob.iter_output*.  Lines are
+       still written to xclawout and xclawerr if these are files.
+     - *timeout* (float) - Wall clock time in seconds after which the run is
+       cancelled.
+     - *new_session* (bool) - Start the executable in its own process group so
+       that cancelling also stops any processes it started (e.g. under
+       RUNEXE), and a Ctrl-C in the terminal is not passed on to it.
+     - *env* (dict) - Environment of the executable, default os.environ.
+     - *cpus* (list) - Core numbers the executable is pinned to, where the
+       operating system supports it.
     """
     
     if nice is not None:
@@ -89,6 +260,78 @@ def runclaw(xclawcmd=None, outdir=None, overwrite=True, restart=None,
         print_git_status = (print_git_status.lower() in ['true','t'])
     if type(nohup) is str:
         nohup = (nohup.lower() in ['true','t'])
+    if restart_file in ['None', '']:
+        restart_file = None
+    if restart_file is not None:
+        restart = True
+    if type(monitor) is str:
+        if monitor.lower() in ['true','t']:
+            monitor = True
+        else:
+            try:
+                monitor = float(monitor)
+            except ValueError:
+                monitor = False
+    if frame_hooks in ['None', 'False', '']:
+        frame_hooks = None
+    if reducer in ['None', 'False', '']:
+        reducer = None
+    if hook_workers in ['None', '']:
+        hook_workers = None
+    if type(compress) is str and compress.lower() in ['false', 'f', 'none',
+                                                      '']:
+        compress = False
+    if stage in [None, 'None']:
+        stage = os.environ.get('CLAW_STAGE', 'copy')
+    if stage not in snapshot.staging_policies:
+        print("==> runclaw: Error: unknown staging policy %s, use one of %s"
+              % (stage, ', '.join(snapshot.staging_policies)))
+        return None
+    if scratch in [None, 'None']:
+        scratch = os.environ.get('CLAW_SCRATCH', None)
+    if type(scratch) is str:
+        if scratch.lower() in ['true','t']:
+            scratch = True
+        elif scratch.lower() in ['false','f','']:
+            scratch = None
+    if scratch is False:
+        scratch = None
+    if type(pyramid) is str and pyramid.lower() in ['false', 'f', 'none',
+                                                    '']:
+        pyramid = False
+    if type(gauge_store) is str:
+        if gauge_store.lower() in ['true','t']:
+            gauge_store = True
+        elif gauge_store.lower() != 'remove':
+            gauge_store = False
+    if backups in [None, 'None']:
+        backups = os.environ.get('CLAW_BACKUPS', None)
+    if type(backups) is str:
+        if backups.lower() in ['true','t']:
+            backups = True
+        elif backups.lower() in ['false','f','']:
+            backups = None
+    if backups is False:
+        backups = None
+    if keep_backups in [None, 'None']:
+        keep_backups = os.environ.get('CLAW_KEEP_BACKUPS', None)
+    try:
+        from clawpack.clawutil.backups import parse_retention
+        retention = parse_retention(keep_backups)
+    except ValueError as error:
+        print("==> runclaw: Error: %s" % error)
+        return None
+    if type(manifest) is str:
+        manifest = (manifest.lower() in ['true','t'])
+    if type(pack) is str:
+        if pack.lower() in ['true','t']:
+            pack = True
+        elif pack.lower() != 'remove':
+            pack = False
+    if use_cache in [None, 'None']:
+        use_cache = os.environ.get('CLAW_RUN_CACHE', 'False')
+    if type(use_cache) is str:
+        use_cache = (use_cache.lower() in ['true','t'])
     
 
     if xclawcmd is None:
@@ -108,18 +351,35 @@ def runclaw(xclawcmd=None, outdir=None, overwrite=True, restart=None,
     # directory for fort.* files:
     outdir = os.path.abspath(outdir)
     print('==> runclaw: Will write output to ',outdir)
+
+    if pack and (outdir == rundir
+                 or rundir.startswith(outdir.rstrip(os.sep) + os.sep)):
+        # the archive would take in (or remove) the application itself
+        print("==> runclaw: Not packing output written to the run directory")
+        pack = False
     
     if restart is None:
         # Added option to determine restart from claw.data (i.e. setrun.py)
         clawdata = ClawData()
         clawdata.read(os.path.join(rundir,'claw.data'), force=True) 
         restart = clawdata.restart
+
+    set_restart_file = restart_file
+    if restart and restart_file is None:
+        # checkpoint file the run restarts from, output written before it
+        # is not written again and can be shared with a backup:
+        try:
+            clawdata = ClawData()
+            clawdata.read(os.path.join(rundir,'claw.data'), force=True)
+            restart_file = str(clawdata.restart_file).strip("'\"")
+        except Exception:
+            pass
         
     xclawcmd = os.path.abspath(xclawcmd)
 
     if os.path.isfile(outdir):
         print("==> runclaw: Error: outdir specified is a file")
-        return
+        return None
 
     if (os.path.isdir(outdir) & (not overwrite)):
         # copy the old outdir before possibly overwriting
@@ -130,20 +390,63 @@ def runclaw(xclawcmd=None, outdir=None, overwrite=True, restart=None,
         hour = str(tm[3]).zfill(2)
         minute = str(tm[4]).zfill(2)
         second = str(tm[5]).zfill(2)
-        outdir_backup = outdir + '_%s-%s-%s-%s%s%s' \
+        backup_store = None
+        backup_base = outdir
+        if backups is not None:
+            # into a store sharing the files identical across backups
+            from clawpack.clawutil.backups import BackupStore, default_store
+            backup_store = BackupStore(default_store(outdir)
+                                       if backups is True else backups)
+            os.makedirs(backup_store.path, exist_ok=True)
+            backup_base = os.path.join(backup_store.path,
+                                       os.path.basename(outdir))
+        outdir_backup = backup_base + '_%s-%s-%s-%s%s%s' \
               % (year,month,day,hour,minute,second)
+        n = 1
+        while os.path.exists(outdir_backup):
+            # several backups made in the same second
+            outdir_backup = backup_base + '_%s-%s-%s-%s%s%s_%s' \
+                  % (year,month,day,hour,minute,second,n)
+            n += 1
         if verbose:
             print("==> runclaw: Directory already exists: ",os.path.split(outdir)[1])
             if restart:
                 print("==> runclaw: Copying directory to:      ",os.path.split(outdir_backup)[1])
             else:
                 print("==> runclaw: Moving directory to:      ",os.path.split(outdir_backup)[1])
-            time.sleep(1)
 
         try:
             shutil.move(outdir,outdir_backup)
             if restart:
-                shutil.copytree(outdir_backup,outdir)
+                # determined before deduplication may change mtimes:
+                shared = snapshot.restart_safe_files(outdir_backup,
+                                                     restart_file)
+            if backup_store is not None:
+                try:
+                    counts = backup_store.ingest(outdir_backup)
+                    removed = backup_store.prune(protect=[outdir_backup],
+                                                 **retention)
+                except Exception as error:
+                    print("==> runclaw: Could not add backup to store: %s"
+                          % error)
+                else:
+                    if verbose:
+                        print("==> runclaw: Backup shares %s files (%.1f MB)"
+                              " with earlier backups" % (counts['linked'],
+                              counts['saved'] / 1024**2))
+                    if verbose and removed:
+                        print("==> runclaw: Removed %s old backups: %s"
+                              % (len(removed), ', '.join(
+                                 os.path.basename(path) for path in removed)))
+            if restart:
+                # snapshot rather than copy: output the restarted code will
+                # not write is shared via reflinks or hardlinks
+                counts = snapshot.snapshot_tree(outdir_backup, outdir,
+                                                shared=shared)
+                if verbose:
+                    print("==> runclaw: Files reflinked: %(reflinked)s, "
+                          "hardlinked: %(hardlinked)s, copied: %(copied)s"
+                          % counts)
         except:
             print("==> runclaw: Could not move directory... copy already exists?")
 
@@ -154,38 +457,61 @@ def runclaw(xclawcmd=None, outdir=None, overwrite=True, restart=None,
         # outdir:
         make_git_status_file(outdir=outdir)
 
-    # old fort.* files to be removed for new run?
-    fortfiles = glob.glob(os.path.join(outdir,'fort.*'))
-    # also need to remove gauge*.txt output files now that the gauge
-    # output is no longer in fort.gauge  (but don't remove new gauges.data)
-    gaugefiles = glob.glob(os.path.join(outdir,'gauge*.txt'))
-
     if (overwrite and (not restart)):
-        # remove any old versions:
+        # remove any old versions of fort.* and gauge*.txt files (but don't
+        # remove new gauges.data), deleted in the background from a trash
+        # directory so the run can start right away:
         if verbose:
             print("==> runclaw: Removing all old fort/gauge files in ", outdir)
-        for file in fortfiles + gaugefiles:
-            os.remove(file)
+        cleanup.clear_output(outdir, output_patterns)
     elif restart:
         if verbose:
             print("==> runclaw: Restart: leaving original fort/gauge files in ", outdir)
+        outfiles = [f for pattern in output_patterns
+                    for f in glob.glob(os.path.join(outdir, pattern))]
+        # files restored from the result cache may be hardlinks, replace
+        # them by copies if the restarted code may write to them:
+        shared = snapshot.restart_safe_files(outdir, restart_file)
+        break_hardlinks([f for f in outfiles
+                         if os.path.basename(f) not in shared])
     else:
         # this should never be reached: 
         # if overwrite==False then outdir has already been moved
-        if len(fortfiles+gaugefiles) > 1:
+        outfiles = [f for pattern in output_patterns
+                    for f in glob.glob(os.path.join(outdir, pattern))]
+        if len(outfiles) > 1:
             print("==> runclaw: *** Remove fort.* and gauge*.txt")
             print("  from output directory %s and try again," % outdir)
             print("  or use overwrite=True in call to runclaw")
             print("  e.g., by setting OVERWRITE = True in Makefile")
-            return
+            return None
 
     datafiles = glob.glob(os.path.join(rundir,'*.data'))
     if datafiles == ():
         print("==> runclaw: Warning: no data files found in directory ",rundir)
     else:
-        if rundir != outdir:
+        if os.path.realpath(rundir) != os.path.realpath(outdir):
             for file in datafiles:
-                shutil.copy(file, os.path.join(outdir,os.path.basename(file)))
+                snapshot.stage_file(file,
+                                    os.path.join(outdir,os.path.basename(file)),
+                                    stage)
+
+    if set_restart_file is not None:
+        from clawpack.clawutil.supervisor import set_restart_data
+        try:
+            set_restart_data(outdir, set_restart_file)
+        except (OSError, ValueError) as error:
+            print("==> runclaw: Error: cannot restart from %s: %s"
+                  % (set_restart_file, error))
+            return None
+        if verbose:
+            print("==> runclaw: Restarting from ", set_restart_file)
+
+    if use_cache and not restart:
+        # files present before b4run, to find the files it stages:
+        files_before_b4run = dict((f, os.path.getmtime(f)) for f in
+                                  glob.glob(os.path.join(outdir, '*'))
+                                  if os.path.isfile(f))
 
     b4run = None
     if os.path.isfile('b4run.py'):
@@ -204,12 +530,178 @@ def runclaw(xclawcmd=None, outdir=None, overwrite=True, restart=None,
         
     if b4run is not None:
         try:
-            b4run(rundir, outdir)
+            import inspect
+            if 'stage' in inspect.signature(b4run).parameters:
+                b4run(rundir, outdir, stage=stage)
+            else:
+                b4run(rundir, outdir)
             print('Executed b4run function from %s' % b4run_file)
         except:
             w = r"*** WARNING: problem executing b4run from %s" % b4run_file
             warnings.warn(w, UserWarning)
 
+    # post-processing and compression of frames while the code runs:
+    frame_watcher = None
+    hooks = None
+    compressor = None
+    pyramid_builder = None
+    if frame_hooks is not None:
+        from clawpack.clawutil.frames import FrameHooks
+        hooks = FrameHooks(frame_hooks, workers=hook_workers)
+    stream_reducer = None
+    if reducer is not None:
+        from clawpack.clawutil.streaming import StreamReducer, expected_frames
+        framenos, kinds, info = expected_frames(outdir)
+        if not kinds:
+            print("==> runclaw: Binary output is not streamed, frames are"
+                  " passed to the reducer from files")
+        stream_reducer = StreamReducer(outdir, outdir, reducer,
+                                       framenos=framenos, kinds=kinds,
+                                       info=info)
+        if pyramid or compress:
+            print("==> runclaw: Streamed frames are not kept, no pyramids"
+                  " or compression")
+            pyramid = False
+            compress = False
+    output_manifest = None
+    if manifest:
+        from clawpack.clawutil.manifest import OutputManifest
+        output_manifest = OutputManifest(outdir)
+    if pyramid:
+        from clawpack.clawutil.pyramid import PyramidBuilder
+        pyramid_builder = PyramidBuilder(pyramid)
+    if compress:
+        from clawpack.clawutil.compress import FrameCompressor
+        compressor = FrameCompressor(outdir, compress)
+    scratch_run = None
+    if hooks is not None or pyramid_builder is not None \
+       or compressor is not None or scratch is not None \
+       or stream_reducer is not None or output_manifest is not None:
+        from clawpack.clawutil.frames import FrameWatcher
+
+        def process_frame(frameno, path, files):
+            if scratch_run is not None:
+                # move the frame from scratch to outdir first:
+                files = scratch_run.sync_frame(frameno, path, files)
+            if stream_reducer is not None:
+                stream_reducer.frame_done(frameno, outdir, files)
+            futures = []
+            if hooks is not None:
+                futures += hooks(frameno, outdir, files)
+            if pyramid_builder is not None:
+                futures += pyramid_builder(frameno, outdir, files)
+            if compressor is not None:
+                # compress once the hooks and pyramid are done with the files:
+                compressor(frameno, outdir, files, wait_for=futures)
+            elif output_manifest is not None:
+                # compressed files are hashed once the run is done
+                output_manifest(frameno, outdir, files)
+
+        frame_watcher = FrameWatcher(outdir, [process_frame])
+
+        def finish_frames(job=None):
+            frame_watcher.finish()
+            if stream_reducer is not None:
+                streamed = stream_reducer.finish()
+            if scratch_run is not None:
+                scratch_run.finish()
+                print("==> runclaw: Moved %s files from scratch to %s"
+                      % (len(scratch_run.synced), outdir))
+            if stream_reducer is not None:
+                print("==> runclaw: Reduced %s frames streamed and %s from"
+                      " files" % (streamed, len(stream_reducer.from_files)))
+            if hooks is not None:
+                processed = hooks.close(outdir)
+                print("==> runclaw: Post-processed %s frames"
+                      % len(processed))
+            if pyramid_builder is not None:
+                print("==> runclaw: Wrote %s frame pyramids"
+                      % pyramid_builder.close())
+            if compressor is not None:
+                size, compressed_size = compressor.close()
+                print("==> runclaw: Compressed output from %.1f MB to %.1f MB"
+                      " (%.1fx)" % (size / 1024**2, compressed_size / 1024**2,
+                                    size / max(compressed_size, 1)))
+
+    def consolidate_gauges(job):
+        from clawpack.clawutil.gauge_store import write_gauge_store
+        try:
+            path = write_gauge_store(outdir, remove=(gauge_store == 'remove'))
+        except Exception as error:
+            print("==> runclaw: Could not consolidate gauges: %s" % error)
+            return
+        if path is not None:
+            print("==> runclaw: Consolidated gauges into ", path)
+
+    def write_manifest(job):
+        try:
+            path = output_manifest.write()
+        except Exception as error:
+            print("==> runclaw: Could not write manifest: %s" % error)
+            return
+        finally:
+            output_manifest.close()
+        print("==> runclaw: Wrote manifest of output files to ", path)
+
+    def pack_output(job):
+        from clawpack.clawutil.archive import pack_outdir
+        try:
+            path = pack_outdir(outdir, remove=(pack == 'remove'))
+        except Exception as error:
+            print("==> runclaw: Could not pack output: %s" % error)
+            return
+        print("==> runclaw: Packed output into ", path)
+
+    result_cache = None
+    if use_cache and stream_reducer is not None:
+        print("==> runclaw: Not caching results of a run with a reducer")
+    elif use_cache and hooks is not None:
+        print("==> runclaw: Not caching results of a run with frame hooks")
+    elif use_cache and not restart:
+        if os.path.isfile(xclawcmd):
+            input_files = [f for f in glob.glob(os.path.join(outdir, '*'))
+                           if os.path.isfile(f)
+                           and not matches_any(f, cache_ignore_patterns)
+                           and (f.endswith('.data')
+                                or files_before_b4run.get(f)
+                                   != os.path.getmtime(f))]
+            # the frames stored are those left by the post-processing:
+            options = {}
+            if compressor is not None:
+                options['compress'] = [compressor.codec, compressor.level]
+            if pyramid_builder is not None:
+                options['pyramid'] = pyramid_builder.factors
+            result_cache = build_cache.ResultCache()
+            result_key = result_cache.key(xclawcmd, input_files, options)
+            restored = result_cache.fetch_all(result_key, outdir, link=True)
+            if restored is not None:
+                print("==> runclaw: Restored %s output files from result cache"
+                      % len(restored))
+                print("             (use --no-cache to force a new run)")
+                print('==> runclaw: Output is in ', outdir)
+                if frame_watcher is not None:
+                    finish_frames()
+                job = RunclawJob(None, outdir, xclawcmd)
+                if gauge_store:
+                    consolidate_gauges(job)
+                if output_manifest is not None:
+                    write_manifest(job)
+                if pack:
+                    pack_output(job)
+                return job
+        elif verbose:
+            print("==> runclaw: Not caching results, executable not found: ",
+                  xclawcmd)
+
+    if scratch is not None:
+        # run in scratch, the frames appearing there are moved to outdir:
+        from clawpack.clawutil.scratch import ScratchRun
+        scratch_run = ScratchRun(outdir, scratch)
+        frame_watcher = FrameWatcher(scratch_run.path, [process_frame])
+        print("==> runclaw: Running in scratch directory ", scratch_run.path)
+        if stream_reducer is not None:
+            stream_reducer.path = scratch_run.path
+
     # execute command to run fortran program:
 
     if runexe is not None:
@@ -219,6 +711,9 @@ def runclaw(xclawcmd=None, outdir=None, overwrite=True, restart=None,
         # run in nohup mode:
         print("\n==> Running in nohup mode, output will be sent to:")
         print("      %s/nohup.out" % outdir)
+        if scratch_run is not None:
+            print("      (once the run ends, until then in %s)"
+                  % scratch_run.path)
         if type(nice) is int:
             cmd = "nohup time nice -n %s %s " % (nice,xclawcmd)
         else:
@@ -232,29 +727,554 @@ def runclaw(xclawcmd=None, outdir=None, overwrite=True, restart=None,
         print("\n==> Running with command:\n   ", cmd)
 
     cmd_split = shlex.split(cmd)
-    if isinstance(xclawout, str):
-        xclawout = open(xclawout,'w', encoding='utf-8',
-                        buffering=1)
-    if isinstance(xclawerr, str):
-        xclawerr = open(xclawerr,'w', encoding='utf-8',
-                        buffering=1)
+
+    # with monitor or frame hooks, lines written by the code are passed to
+    # them and then on to xclawout/xclawerr or the terminal:
+    capture = ((monitor is not False) and (monitor is not None)
+               or frame_watcher is not None) and not nohup
     try:
-        proc = subprocess.check_call(cmd_split,
-                                     cwd=outdir,
-                                     stdout=xclawout,
-                                     stderr=xclawerr)
-
-    except subprocess.CalledProcessError as cpe:
-        exe_error_str = "\n\n*** FORTRAN EXE FAILED ***\n"
-        raise ClawExeError(exe_error_str, cpe.returncode, cpe.cmd,
-                           output=cpe.output, 
-                           stderr=cpe.stderr)
-    
-    print('==> runclaw: Done executing %s via clawutil.runclaw.py' %\
-                xclawcmd)
-    print('==> runclaw: Output is in ', outdir)
+        if stream_reducer is not None:
+            # the pipes must exist before the code starts
+            stream_reducer.start()
+        job = RunclawJob(cmd_split, outdir, xclawcmd, xclawout=xclawout,
+                         xclawerr=xclawerr, stream=stream, timeout=timeout,
+                         new_session=new_session, env=env, cpus=cpus,
+                         capture=capture, echo=capture,
+                         cwd=None if scratch_run is None else scratch_run.path)
+    except Exception:
+        if stream_reducer is not None:
+            stream_reducer.finish()
+        if scratch_run is not None:
+            scratch_run.cleanup()
+        raise
+
+    if (monitor is not False) and (monitor is not None):
+        from clawpack.clawutil.monitor import RunMonitor
+        interval = 5. if monitor is True else float(monitor)
+        log_file = None
+        if nohup:
+            log_file = os.path.join(outdir if scratch_run is None
+                                    else scratch_run.path, 'nohup.out')
+        run_monitor = RunMonitor(outdir, log_file=log_file, interval=interval)
+        job.on_line.append(run_monitor.feed_line)
+        job.on_finish.append(lambda job: run_monitor.stop(job.returncode))
+        run_monitor.start()
+
+    if frame_watcher is not None:
+        job.on_line.append(frame_watcher.feed_line)
+        # before the monitor's final update, to include all output
+        job.on_finish.insert(0, finish_frames)
+        frame_watcher.start()
+
+    if result_cache is not None:
+        def store_results(job):
+            output_files = [f for pattern in output_patterns
+                            for f in glob.glob(os.path.join(outdir, pattern))
+                            if os.path.isfile(f)]
+            # the outputs are removed, not rewritten, before the next run, so
+            # they can be shared with the cache:
+            result_cache.store(result_key, dict((os.path.basename(f), f)
+                                                for f in output_files),
+                               link=True)
+        job.on_success.append(store_results)
+
+    if gauge_store:
+        job.on_success.append(consolidate_gauges)
+    if output_manifest is not None:
+        job.on_success.append(write_manifest)
+    if pack:
+        job.on_success.append(pack_output)
+
+    return job
+
+
+class RunclawJob(object):
+    r"""
+    Handle on a Clawpack executable started by *start_runclaw*.
+
+    :Attributes:
+     - *outdir* (path) - Output directory of the run.
+     - *returncode* (int) - Exit status, None while running.
+     - *cancelled* (bool) - True if the run was cancelled (or timed out).
+     - *on_success* (list) - Functions called with the job as argument
+       once the executable has finished successfully.
+     - *on_finish* (list) - Functions called with the job as argument once
+       the executable has finished, successfully or not.
+     - *on_line* (list) - Functions called with each line (and 'stdout' or
+       'stderr') written by the executable, if its output is captured.
+       Errors raised by them are reported and do not stop the output.
+     - *metrics* (dict) - Resources used by the finished run: wall_time,
+       user_time and system_time (seconds of CPU time), max_rss (peak
+       resident set size in bytes), voluntary and involuntary context
+       switches, as reported by the operating system for the executable
+       and any processes it waited for.  Also written to run_metrics.json
+       in outdir.
+
+    The *on_finish* and *on_success* functions are all called on the thread
+    waiting for the executable, once the job is first polled, waited for or
+    cancelled (or times out) after the executable exits.
+
+    A job can be awaited in a coroutine, ``returncode = await job``, which
+    raises *ClawExeError* if the executable failed.
+    """
+
+    def __init__(self, cmd, outdir, xclawcmd, xclawout=None, xclawerr=None,
+                 stream=False, timeout=None, new_session=True, env=None,
+                 cpus=None, capture=False, echo=False, cwd=None):
+
+        self.cmd = cmd
+        self.outdir = outdir
+        self.xclawcmd = xclawcmd
+        self.returncode = None
+        self.cancelled = False
+        self.timed_out = False
+        self.on_success = []
+        self.on_finish = []
+        self.on_line = []
+        self.proc = None
+        self._finished = False
+        self._lock = threading.Lock()
+        self._lines = queue.Queue()
+        self._readers = []
+        self._timer = None
+        self._new_session = new_session
+        self._stream = stream
+        self._echo = echo
+        self._opened = []
+        self._reaped = threading.Event()
+        self._finish_requested = threading.Event()
+        self._done = threading.Event()
+        self._error = None
+        self._rusage = None
+        self.metrics = None
+
+        if cmd is None:
+            # nothing to run, e.g. output restored from the result cache
+            self.returncode = 0
+            self._finished = True
+            self._done.set()
+            self.metrics = {'returncode': 0, 'cached': True}
+            self._write_metrics()
+            return
+
+        # files opened here are closed when the job finishes
+        if isinstance(xclawout, str):
+            xclawout = open(xclawout,'w', encoding='utf-8',
+                            buffering=1)
+            self._opened.append(xclawout)
+        if isinstance(xclawerr, str):
+            xclawerr = open(xclawerr,'w', encoding='utf-8',
+                            buffering=1)
+            self._opened.append(xclawerr)
+
+        if stream or capture:
+            stdout = subprocess.PIPE
+            if xclawerr == subprocess.STDOUT:
+                stderr = subprocess.STDOUT
+            else:
+                stderr = subprocess.PIPE
+        else:
+            stdout = xclawout
+            stderr = xclawerr
+
+        # pin the child before it execs, so that the executable (and the
+        # threads it starts) never run on other cores:
+        preexec_fn = None
+        if cpus is not None and hasattr(os, 'sched_setaffinity'):
+            def preexec_fn():
+                try:
+                    os.sched_setaffinity(0, cpus)
+                except OSError:
+                    pass
+
+        self._start_time = time.time()
+        self._omp_num_threads = (env or os.environ).get('OMP_NUM_THREADS')
+        self.proc = subprocess.Popen(cmd, cwd=cwd or outdir, stdout=stdout,
+                                     stderr=stderr, env=env,
+                                     start_new_session=new_session,
+                                     preexec_fn=preexec_fn)
 
-    return proc
+        # all waiting for the process is done by this thread, which collects
+        # its resource usage:
+        reaper = threading.Thread(target=self._reap, daemon=True)
+        reaper.start()
+
+        if stream or capture:
+            pipes = [('stdout', self.proc.stdout, xclawout)]
+            if self.proc.stderr is not None:
+                pipes.append(('stderr', self.proc.stderr, xclawerr))
+            for (name, pipe, tee) in pipes:
+                reader = threading.Thread(target=self._read_pipe,
+                                          args=(name, pipe, tee), daemon=True)
+                reader.start()
+                self._readers.append(reader)
+
+        if timeout is not None:
+            self._timer = threading.Timer(float(timeout), self._time_out)
+            self._timer.daemon = True
+            self._timer.start()
+
+
+    def _read_pipe(self, name, pipe, tee):
+        r"""Pass lines from *pipe* to the line queue, the *on_line* functions
+        and *tee* (or the terminal, if echoing)."""
+
+        if tee is None and self._echo:
+            tee = sys.stdout if name == 'stdout' else sys.stderr
+        for line in iter(pipe.readline, b''):
+            line = line.decode(errors='replace')
+            if self._stream:
+                self._lines.put((name, line))
+            for func in self.on_line:
+                try:
+                    func(line, name)
+                except Exception as error:
+                    print("==> runclaw: Output line handler %s failed: %s"
+                          % (getattr(func, '__name__', func), error))
+            if tee is not None and hasattr(tee, 'write'):
+                tee.write(line)
+        pipe.close()
+        self._lines.put((name, None))
+
+
+    def _reap(self):
+        r"""Wait for the process and record its exit status and rusage."""
+
+        try:
+            (pid, status, self._rusage) = os.wait4(self.proc.pid, 0)
+            self.proc.returncode = os.waitstatus_to_exitcode(status)
+        except (AttributeError, ChildProcessError):
+            # no wait4 on this platform
+            self.proc.wait()
+        self._end_time = time.time()
+        self._reaped.set()
+
+        # finish here once asked to, so that all the on_finish and on_success
+        # functions (added after the job is created) run on this thread:
+        self._finish_requested.wait()
+        try:
+            self._finish(self.proc.returncode)
+        except BaseException as error:
+            self._error = error
+        finally:
+            self._done.set()
+
+
+    def _await_finish(self, timeout=None):
+        r"""Have the job finished and wait up to *timeout* seconds for it,
+        raising any error from the on_finish or on_success functions."""
+
+        self._finish_requested.set()
+        if self._done.wait(timeout) and self._error is not None:
+            (error, self._error) = (self._error, None)
+            raise error
+
+
+    def _time_out(self):
+        if not self._reaped.is_set():
+            print("==> runclaw: Run exceeded time limit, cancelling")
+            self.timed_out = True
+            self.cancel()
+
+
+    def poll(self):
+        r"""Return the exit status, or None if still running (or if the
+        on_finish and on_success functions are still running)."""
+
+        if self.proc is not None and self._reaped.is_set():
+            self._await_finish(0)
+        return self.returncode if self._done.is_set() else None
+
+
+    def wait(self, timeout=None, check=True):
+        r"""Wait for the executable to finish and return its exit status.
+
+        Raises *subprocess.TimeoutExpired* if *timeout* seconds pass first
+        (the run continues) and, if *check*, *ClawExeError* if it failed.
+        If interrupted (e.g. by Ctrl-C), the run is cancelled.
+        """
+
+        if self.proc is not None and not self._done.is_set():
+            try:
+                finished = self._reaped.wait(timeout)
+            except BaseException:
+                self.cancel()
+                raise
+            if not finished:
+                raise subprocess.TimeoutExpired(self.cmd, timeout)
+            self._await_finish()
+
+        if check and self.returncode != 0:
+            exe_error_str = "\n\n*** FORTRAN EXE FAILED ***\n"
+            if self.timed_out:
+                exe_error_str += "*** (time limit exceeded) ***\n"
+            raise ClawExeError(exe_error_str, self.returncode, self.cmd)
+
+        return self.returncode
+
+
+    async def wait_async(self, check=True):
+        r"""Coroutine version of *wait*."""
+
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None,
+                                          lambda: self.wait(check=check))
+
+
+    def __await__(self):
+        return self.wait_async().__await__()
+
+
+    def iter_output(self, timeout=None):
+        r"""
+        Generator of (stream, line) pairs as the executable writes them,
+        where stream is 'stdout' or 'stderr'.  Requires ``stream=True``.
+        Ends when both streams are closed, or raises *queue.Empty* if no line
+        arrives within *timeout* seconds.
+        """
+
+        open_streams = len(self._readers)
+        while open_streams > 0:
+            (name, line) = self._lines.get(timeout=timeout)
+            if line is None:
+                open_streams -= 1
+            else:
+                yield (name, line)
+
+
+    def cancel(self, grace=5.0):
+        r"""
+        Stop the executable with SIGTERM, or SIGKILL if it has not exited
+        after *grace* seconds, and clean up.  Output already written to
+        outdir is left in place.
+        """
+
+        import signal
+
+        if self.proc is None or self._reaped.is_set():
+            return
+        self.cancelled = True
+        for sig in [signal.SIGTERM, signal.SIGKILL]:
+            try:
+                if self._new_session:
+                    os.killpg(self.proc.pid, sig)
+                else:
+                    self.proc.send_signal(sig)
+            except (ProcessLookupError, PermissionError):
+                pass
+            if self._reaped.wait(grace):
+                break
+        self._reaped.wait()
+        self._await_finish()
+
+
+    def _finish(self, returncode):
+        r"""Record *returncode* and clean up, once."""
+
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            self.returncode = returncode
+
+        if self._timer is not None:
+            self._timer.cancel()
+        for reader in self._readers:
+            reader.join()
+        for f in self._opened:
+            f.close()
+
+        self.metrics = self._collect_metrics()
+        self._write_metrics()
+
+        for func in self.on_finish:
+            func(self)
+
+        if returncode == 0 and not self.cancelled:
+            print('==> runclaw: Done executing %s via clawutil.runclaw.py' %\
+                        self.xclawcmd)
+            print('==> runclaw: Output is in ', self.outdir)
+            for func in self.on_success:
+                func(self)
+
+
+    def _write_metrics(self):
+        r"""Write *metrics* to run_metrics.json in outdir."""
+
+        try:
+            with open(os.path.join(self.outdir, 'run_metrics.json'), 'w') as f:
+                json.dump(self.metrics, f, indent=1)
+        except OSError:
+            pass
+
+
+    def _collect_metrics(self):
+        r"""Return dictionary of resources used by the finished run."""
+
+        import socket
+
+        wall_time = self._end_time - self._start_time
+        metrics = {'returncode': self.returncode,
+                   'cancelled': self.cancelled,
+                   'cmd': " ".join(self.cmd),
+                   'hostname': socket.gethostname(),
+                   'start_time': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                               time.localtime(self._start_time)),
+                   'wall_time': wall_time,
+                   'omp_num_threads': self._omp_num_threads}
+        if self._rusage is not None:
+            ru = self._rusage
+            # ru_maxrss is in kilobytes except on macOS
+            max_rss = ru.ru_maxrss if sys.platform == 'darwin' \
+                                   else 1024 * ru.ru_maxrss
+            metrics.update({'user_time': ru.ru_utime,
+                            'system_time': ru.ru_stime,
+                            'cpu_utilization': (ru.ru_utime + ru.ru_stime)
+                                               / max(wall_time, 1e-9),
+                            'max_rss': max_rss,
+                            'voluntary_context_switches': ru.ru_nvcsw,
+                            'involuntary_context_switches': ru.ru_nivcsw})
+        return metrics
+
+
+def available_cpus():
+    r"""Return sorted list of the cores this process may run on."""
+
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def run_batch(jobs, cpus=None, poll_interval=0.1, verbose=True):
+    r"""
+    Run many Clawpack jobs, packing them onto the cores of this node.
+
+    Each job gets *threads* cores of its own: OMP_NUM_THREADS is set to
+    *threads*, the job is pinned to those cores (OMP_PLACES and, where
+    supported, the process affinity) and new jobs are started, in order,
+    whenever enough cores are free, later jobs that fit being started ahead
+    of a larger job that does not, so the node stays full until the queue
+    drains.
+
+    :Input:
+     - *jobs* (list) - Each job is a tuple (rundir, outdir, xclawcmd) or
+       (rundir, outdir, xclawcmd, threads), or a dictionary with these keys
+       and any other keyword arguments of *start_runclaw*.  Unless given,
+       stdout and stderr of each job go to runclaw_output.txt in its outdir.
+     - *cpus* (list) - Cores to use, default all cores available to this
+       process.
+     - *poll_interval* (float) - Seconds between checks for finished jobs.
+
+    :Output:
+     - *results* (list) - For each job a dictionary with its outdir, threads,
+       cpus, returncode (None if it could not be started), wall_time and
+       metrics (see *RunclawJob.metrics*).
+     - *summary* (dict) - Number of jobs and failures, total wall_time,
+       jobs_per_hour and core_utilization (fraction of the core time
+       available that was used by jobs).
+    """
+
+    if cpus is None:
+        cpus = available_cpus()
+    cpus = list(cpus)
+
+    pending = []
+    for (n, job) in enumerate(jobs):
+        if not isinstance(job, dict):
+            job = dict(zip(['rundir', 'outdir', 'xclawcmd', 'threads'], job))
+        job = dict(job)
+        threads = min(max(1, int(job.pop('threads', 1) or 1)), len(cpus))
+        pending.append((n, threads, job))
+
+    results = [None] * len(pending)
+    free = list(cpus)
+    running = []
+    t_start = time.time()
+
+    while pending or running:
+        # start every queued job, in order, that fits in the free cores:
+        for item in list(pending):
+            (n, threads, kwargs) = item
+            if threads > len(free):
+                continue
+            pending.remove(item)
+            job_cpus, free = free[:threads], free[threads:]
+            env = dict(os.environ)
+            env['OMP_NUM_THREADS'] = str(threads)
+            env['OMP_PLACES'] = ",".join("{%s}" % c for c in job_cpus)
+            env['OMP_PROC_BIND'] = 'close'
+            kwargs.setdefault('xclawout', os.path.join(
+                            os.path.abspath(kwargs.get('outdir') or '.'),
+                            'runclaw_output.txt'))
+            kwargs.setdefault('xclawerr', subprocess.STDOUT)
+            kwargs.setdefault('verbose', verbose)
+            results[n] = {'outdir': kwargs.get('outdir'), 'threads': threads,
+                          'cpus': job_cpus, 'returncode': None,
+                          'wall_time': 0.}
+            t_job = time.time()
+            try:
+                job = start_runclaw(env=env, cpus=job_cpus, **kwargs)
+            except Exception as e:
+                print("==> run_batch: Could not start job %s: %s" % (n, e))
+                job = None
+            if job is None:
+                free = sorted(free + job_cpus)
+                continue
+            running.append((n, job, job_cpus, t_job))
+
+        time.sleep(poll_interval)
+        for item in list(running):
+            (n, job, job_cpus, t_job) = item
+            if job.poll() is not None:
+                running.remove(item)
+                free = sorted(free + job_cpus)
+                results[n]['returncode'] = job.returncode
+                results[n]['wall_time'] = time.time() - t_job
+                results[n]['metrics'] = job.metrics
+                if verbose:
+                    print("==> run_batch: Job %s finished (status %s) in "
+                          "%.1f s: %s" % (n, job.returncode,
+                          results[n]['wall_time'], results[n]['outdir']))
+
+    wall_time = time.time() - t_start
+    core_time = sum(r['threads'] * r['wall_time'] for r in results)
+    summary = {'num_jobs': len(results),
+               'failed': len([r for r in results if r['returncode'] != 0]),
+               'wall_time': wall_time,
+               'jobs_per_hour': 3600. * len(results) / max(wall_time, 1e-9),
+               'core_utilization': core_time / max(wall_time*len(cpus), 1e-9)}
+
+    if verbose:
+        print("\n==> run_batch: %s jobs on %s cores in %.1f s"
+              % (summary['num_jobs'], len(cpus), wall_time))
+        print("    %s failed, %.1f jobs/hour, core utilization %.0f%%"
+              % (summary['failed'], summary['jobs_per_hour'],
+                 100*summary['core_utilization']))
+        for (n, r) in enumerate(results):
+            print("    %4d  %3d threads  %8.1f s  status %s  %s"
+                  % (n, r['threads'], r['wall_time'], r['returncode'],
+                     r['outdir']))
+
+    return results, summary
+
+
+def matches_any(path, patterns):
+    r"""Return True if the file name of *path* matches one of *patterns*."""
+    name = os.path.basename(path)
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def break_hardlinks(paths):
+    r"""Replace each file in *paths* that has other hardlinks by a copy."""
+
+    for path in paths:
+        try:
+            if os.stat(path).st_nlink > 1:
+                snapshot.copy_file(path, path + '.tmp')
+                os.replace(path + '.tmp', path)
+        except OSError:
+            pass
     
 
 #----------------------------------------------------------
@@ -337,5 +1357,15 @@ if __name__=='__main__':
     any argument used as setplot:
     """
     import sys
-    args = sys.argv[1:]   # any command line arguments
-    runclaw(*args)
+    args = []
+    kwargs = {}
+    for arg in sys.argv[1:]:   # any command line arguments
+        if '=' in arg and arg.split('=')[0].isidentifier():
+            # keyword arguments such as use_cache=True
+            name, value = arg.split('=', 1)
+            kwargs[name] = value
+        elif arg != '--no-cache':
+            args.append(arg)
+    if '--no-cache' in sys.argv[1:]:
+        kwargs['use_cache'] = False
+    runclaw(*args, **kwargs)
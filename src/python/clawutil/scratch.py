@@ -0,0 +1,157 @@
+r"""
+Run the Fortran code in a node-local scratch directory (e.g. on local disk
+or tmpfs) rather than directly in an output directory on a slow shared
+filesystem.
+
+The input files in outdir are staged into a new directory under the
+scratch location.  While the code runs, each completed frame is moved to
+outdir (see *clawutil.frames.FrameWatcher*), copied under a temporary name
+and renamed once its size has been verified, so outdir never holds partial
+frames.  When the run ends, successfully or not, all remaining output
+(gauges, checkpoints, ...) is flushed to outdir in the same way and the
+scratch directory removed, unless some file could not be verified, in which
+case it is kept and reported.
+
+Used by runclaw with scratch=True (the directory in CLAW_SCRATCH, default
+the system temporary directory) or scratch=path (SCRATCH in the Makefile).
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from clawpack.clawutil import snapshot
+
+# frames are not read by the code and so not staged into scratch:
+_frame_re = re.compile(r"^fort\.([tqba])(\d{4,})(\.\w+)?$")
+
+
+def scratch_root(scratch=True):
+    r"""
+    Return the directory in which scratch run directories are created for
+    *scratch*, True for the directory in CLAW_SCRATCH, or the system
+    temporary directory if that is not set.
+    """
+
+    if scratch is True:
+        return os.environ.get('CLAW_SCRATCH', tempfile.gettempdir())
+    return os.path.expanduser(str(scratch))
+
+
+class ScratchRun(object):
+    r"""
+    Scratch directory for a run writing its output to *outdir*.
+
+    :Input:
+     - *outdir* (path) - Final output directory, holding the input files.
+     - *scratch* (path or True) - Where to create the scratch directory, see
+       *scratch_root*.
+
+    :Attributes:
+     - *path* (path) - The scratch directory the code runs in.
+     - *synced* (dict) - Sizes of the files moved to outdir, by name.
+     - *failed* (list) - Names of files that could not be moved.
+    """
+
+    def __init__(self, outdir, scratch=True):
+
+        self.outdir = os.path.abspath(outdir)
+        root = scratch_root(scratch)
+        os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix='claw_run_', dir=root)
+        self.synced = {}
+        self.failed = []
+        self._lock = threading.Lock()
+
+        # stage the input files (and on restart e.g. checkpoint and gauge
+        # files), recording them to recognize output later:
+        self._inputs = {}
+        for entry in os.scandir(self.outdir):
+            if entry.is_file() and not _frame_re.match(entry.name):
+                dest = os.path.join(self.path, entry.name)
+                snapshot.copy_file(entry.path, dest)
+                stat = os.stat(dest)
+                self._inputs[entry.name] = (stat.st_size, stat.st_mtime)
+
+
+    def _move(self, name):
+        r"""Move file *name* from scratch to outdir, verifying its size."""
+
+        src = os.path.join(self.path, name)
+        dest = os.path.join(self.outdir, name)
+        try:
+            size = os.path.getsize(src)
+            shutil.copyfile(src, dest + '.part')
+            if os.path.getsize(dest + '.part') != size:
+                raise IOError("size of copy differs")
+            shutil.copystat(src, dest + '.part')
+            os.replace(dest + '.part', dest)
+            os.remove(src)
+        except (OSError, IOError) as error:
+            print("==> scratch: Could not move %s to %s: %s"
+                  % (name, self.outdir, error))
+            with self._lock:
+                self.failed.append(name)
+            return None
+        with self._lock:
+            self.synced[name] = size
+        return dest
+
+
+    def sync_frame(self, frameno, path, files):
+        r"""
+        Move the files of a completed frame to outdir, for use as a
+        *FrameWatcher* callback.  Returns the dictionary of files in outdir.
+        """
+
+        moved = {}
+        # fort.t last, so that the frame is complete in outdir once it is
+        # listed:
+        for kind in sorted(files, key=lambda kind: kind == 't'):
+            dest = self._move(os.path.basename(files[kind]))
+            if dest is not None:
+                moved[kind] = dest
+        return moved
+
+
+    def flush(self):
+        r"""
+        Move all output still in scratch (files not staged, or changed since
+        staged) to outdir.  Returns the names of files moved.
+        """
+
+        moved = []
+        for entry in sorted(os.scandir(self.path), key=lambda e: e.name):
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat()
+            if self._inputs.get(entry.name) == (stat.st_size, stat.st_mtime):
+                continue
+            if self._move(entry.name) is not None:
+                moved.append(entry.name)
+        return moved
+
+
+    def finish(self):
+        r"""
+        Flush output to outdir and remove the scratch directory, or keep it
+        if any file could not be moved.  Returns True if all output was
+        moved.
+        """
+
+        self.flush()
+        if self.failed:
+            print("==> scratch: %s files could not be moved to outdir, "
+                  "keeping scratch directory %s" % (len(self.failed),
+                                                    self.path))
+            return False
+        self.cleanup()
+        return True
+
+
+    def cleanup(self):
+        r"""Remove the scratch directory."""
+
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,219 @@
+r"""
+Cheap snapshots of output directories, used by runclaw when an existing
+outdir is moved aside and a restart continues from a copy of it.
+
+Files are cloned with reflinks where the filesystem supports them (btrfs,
+XFS, ...), which share the data until either copy is modified.  Otherwise
+output that the restarted code will not write again, such as the frames and
+checkpoints written before the checkpoint being restarted from, is
+hardlinked, and only the remaining files are really copied.
+
+*stage_file* places input files such as the *.data files into outdir
+according to a staging policy, see *staging_policies*.
+"""
+
+import os
+import re
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl cloning a whole file on Linux (FICLONE)
+_FICLONE = 0x40049409
+
+# fort.q0003, fort.t0003.gz, ...:
+_frame_re = re.compile(r"^fort\.([tqba])(\d{4,})(\.\w+)?$")
+
+# files the Fortran code rewrites or appends to on restart
+rewritten_files = ['fort.amr', 'fort.debug', 'fort.gauge', 'fort.chkaaaa',
+                   'fort.chkbbbb']
+
+
+def reflink(src, dest):
+    r"""
+    Create *dest* as a copy-on-write clone of *src*.  Returns False (and
+    creates nothing) if the filesystem or platform does not support it.
+    """
+
+    if fcntl is None or not hasattr(fcntl, 'ioctl'):
+        return False
+    try:
+        with open(src, 'rb') as f_src:
+            with open(dest, 'wb') as f_dest:
+                try:
+                    fcntl.ioctl(f_dest.fileno(), _FICLONE, f_src.fileno())
+                except OSError:
+                    cloned = False
+                else:
+                    cloned = True
+    except OSError:
+        return False
+    if not cloned:
+        os.remove(dest)
+        return False
+    shutil.copystat(src, dest)
+    return True
+
+
+def copy_file(src, dest):
+    r"""Copy *src* to *dest*, as a reflink if possible."""
+
+    if not reflink(src, dest):
+        shutil.copy2(src, dest)
+
+
+# staging policies and the ways of placing a file tried in turn, falling
+# back e.g. when rundir and outdir are on different filesystems:
+staging_policies = {'copy': ['copy'],
+                    'reflink': ['reflink', 'copy'],
+                    'hardlink': ['hardlink', 'reflink', 'copy'],
+                    'symlink': ['symlink', 'copy']}
+
+
+def stage_file(src, dest, policy='copy'):
+    r"""
+    Place file *src* at *dest* according to staging *policy*:
+
+     - 'copy' - an independent copy (the default),
+     - 'reflink' - a copy-on-write clone, or a copy if not supported,
+     - 'hardlink' - a hardlink, else a reflink or a copy,
+     - 'symlink' - a symbolic link to the absolute path of *src*, else a
+       copy.
+
+    Any existing *dest* is removed first, so a link left by an earlier run
+    is never written through.  With 'hardlink' and 'symlink', *dest* shows
+    later changes to *src* made in place, so these suit inputs that are
+    regenerated as new files or not at all.  Returns the method used, None
+    if *dest* is *src* itself (e.g. reached through a symlinked directory),
+    which is left alone.
+    """
+
+    if policy not in staging_policies:
+        raise ValueError("Unknown staging policy %s, use one of %s"
+                         % (policy, ', '.join(staging_policies)))
+    if os.path.exists(dest) and not os.path.islink(dest) \
+       and os.path.samefile(src, dest):
+        src_entry = os.path.join(os.path.realpath(os.path.dirname(src)),
+                                 os.path.basename(src))
+        dest_entry = os.path.join(os.path.realpath(os.path.dirname(dest)),
+                                  os.path.basename(dest))
+        # the same directory entry, rather than a hardlink to it, would be
+        # removed together with src:
+        if src_entry == dest_entry or os.stat(dest).st_nlink == 1:
+            return None
+    if os.path.lexists(dest):
+        if os.path.isfile(src) and not os.path.islink(dest) \
+           and os.path.samefile(src, dest):
+            # already staged as a hardlink
+            if policy == 'hardlink':
+                return 'hardlink'
+        os.remove(dest)
+    for method in staging_policies[policy]:
+        if method == 'hardlink':
+            try:
+                os.link(src, dest)
+                return method
+            except OSError:
+                pass
+        elif method == 'symlink':
+            try:
+                os.symlink(os.path.abspath(src), dest)
+                return method
+            except (OSError, NotImplementedError):
+                pass
+        elif method == 'reflink':
+            if reflink(src, dest):
+                return method
+        else:
+            shutil.copy(src, dest)
+            return method
+
+
+def restart_safe_files(outdir, restart_file):
+    r"""
+    Return the set of names of files in *outdir* that a restart from
+    checkpoint *restart_file* will not write to, and so can be shared
+    between *outdir* and a snapshot of it.
+
+    These are the fort.* files written before the checkpoint, except frames
+    from the one output at the time of the checkpoint on, and the files in
+    *rewritten_files*.  Empty if the checkpoint is not found.
+    """
+
+    try:
+        checkpoint_time = os.path.getmtime(os.path.join(outdir,
+                                                        restart_file))
+    except (OSError, TypeError):
+        return set()
+
+    entries = {}
+    for entry in os.scandir(outdir):
+        if entry.is_file(follow_symlinks=False) \
+           and entry.name.startswith('fort.') \
+           and entry.name not in rewritten_files:
+            entries[entry.name] = entry.stat().st_mtime
+
+    # frames are written in order, the last one written before the
+    # checkpoint and all later ones may be written again:
+    frames_before = [int(_frame_re.match(name).group(2))
+                     for (name, mtime) in entries.items()
+                     if _frame_re.match(name)
+                     and _frame_re.match(name).group(1) == 't'
+                     and mtime <= checkpoint_time]
+    last_frame = max(frames_before) if frames_before else -1
+
+    safe = set()
+    for (name, mtime) in entries.items():
+        match = _frame_re.match(name)
+        if match:
+            if int(match.group(2)) < last_frame:
+                safe.add(name)
+        elif mtime < checkpoint_time or name == restart_file:
+            safe.add(name)
+    return safe
+
+
+def snapshot_tree(src, dest, shared=()):
+    r"""
+    Recreate directory *src* as *dest*, cloning files with reflinks where
+    possible.  Otherwise files whose path relative to *src* is in *shared*
+    are hardlinked and all others copied.  Returns a dictionary counting the
+    files reflinked, hardlinked and copied.
+    """
+
+    counts = {'reflinked': 0, 'hardlinked': 0, 'copied': 0}
+    use_reflinks = True
+    for (dirpath, dirnames, filenames) in os.walk(src):
+        relpath = os.path.relpath(dirpath, src)
+        dest_dir = os.path.normpath(os.path.join(dest, relpath))
+        os.makedirs(dest_dir, exist_ok=True)
+        for name in dirnames + filenames:
+            src_path = os.path.join(dirpath, name)
+            dest_path = os.path.join(dest_dir, name)
+            if os.path.islink(src_path):
+                os.symlink(os.readlink(src_path), dest_path)
+                if name in dirnames:
+                    dirnames.remove(name)
+                continue
+            if name in dirnames:
+                continue
+            # stop trying reflinks after the first failure
+            if use_reflinks:
+                if reflink(src_path, dest_path):
+                    counts['reflinked'] += 1
+                    continue
+                use_reflinks = False
+            if os.path.normpath(os.path.join(relpath, name)) in shared:
+                try:
+                    os.link(src_path, dest_path)
+                    counts['hardlinked'] += 1
+                    continue
+                except OSError:
+                    pass
+            shutil.copy2(src_path, dest_path)
+            counts['copied'] += 1
+        shutil.copystat(dirpath, dest_dir)
+    return counts
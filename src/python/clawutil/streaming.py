@@ -0,0 +1,363 @@
+r"""
+Pass output frames to a reducer in memory as the code writes them, without
+writing them to disk and reading them back.
+
+Before the code starts, the fort.qNNNN files of the next few frames it will
+write are created as named pipes (FIFOs) in the directory the code runs in.
+The code opens and writes them as usual, while a reader thread collects what
+is written.  Once the code has closed the pipe and written the frame's
+fort.tNNNN (a regular file, written after fort.qNNNN), the frame is passed
+with the time and dimensions read from fort.t to a user-supplied reducer
+running in another thread.  Further pipes are created as frames are
+completed, so only a window of them exists at a time.
+
+Backpressure: at most *backlog* completed frames are held in memory waiting
+for the reducer.  When the reducer falls behind, the reader stops reading,
+the pipe fills up and the code blocks in its write until the reducer
+catches up.
+
+Anything unexpected falls back to real files: a frame written outside the
+window of pipes (e.g. on a restart) or replaced by a regular file by the
+code, and frames of binary output formats, are written to disk as usual and
+passed to the reducer from there once complete (see *StreamReducer.frame_done*).
+Pipes not used by the run are removed when it ends, so no pipes are left in
+the output directory.
+
+Used by runclaw with reducer=... (REDUCER in the Makefile), which takes a
+Python file defining::
+
+    def reduce_frame(frameno, data, info, outdir):
+        # data maps 'q' (and 'b' for binary output) to the bytes the code
+        # wrote to fort.qNNNN (and fort.bNNNN), info holds the time, meqn,
+        # ngrids, naux, ndim, nghost and dtype of the frame from fort.tNNNN
+        # (time None, and the rest from claw.data, if fort.t was not written)
+        ...
+
+    def finish(outdir):
+        # optional, called once all frames have been reduced
+        ...
+
+The patches of a frame can be obtained with::
+
+    clawutil.pyramid.parse_patches(data['q'], info['ndim'], info['meqn'],
+                                   data.get('b'), info['dtype'],
+                                   info['nghost'])
+"""
+
+import os
+import stat
+import queue
+import runpy
+import threading
+import selectors
+
+import numpy
+
+
+def expected_frames(outdir):
+    r"""
+    Return (framenos, kinds, info) from claw.data in *outdir*: the numbers
+    of the frames the run will write (None if unknown), the kinds of frame
+    files that can be streamed, ['q'] for ascii output and [] otherwise, and
+    the frame info (see *StreamReducer*) known before any frame is written.
+    """
+
+    from clawpack.clawutil.data import ClawData
+    from clawpack.clawutil.monitor import read_run_times
+
+    clawdata = ClawData()
+    clawdata.read(os.path.join(outdir, 'claw.data'), force=True)
+    t0, tfinal, num_frames = read_run_times(outdir)
+    framenos = None
+    if num_frames is not None:
+        first = 0 if getattr(clawdata, 'output_t0', True) else 1
+        framenos = list(range(first, num_frames + 1))
+    # unformatted output may be positioned within the file, which is not
+    # possible on a pipe
+    output_format = getattr(clawdata, 'output_format', 1)
+    if output_format in [1, 'ascii']:
+        kinds = ['q']
+    else:
+        kinds = []
+    info = {'time': None,
+            'meqn': getattr(clawdata, 'num_eqn', None),
+            'ngrids': None,
+            'naux': getattr(clawdata, 'num_aux', None),
+            'ndim': getattr(clawdata, 'num_dim', None),
+            'nghost': getattr(clawdata, 'num_ghost', 2),
+            'dtype': numpy.float32 if output_format in [2, 'binary32']
+                     else numpy.float64}
+    return framenos, kinds, info
+
+
+class StreamReducer(object):
+    r"""
+    Stream the frames written by the code in *path* through named pipes to a
+    reducer.
+
+    :Input:
+     - *path* (path) - Directory the code writes its frames to.
+     - *outdir* (path) - Output directory passed on to the reducer.
+     - *reducer* - Path of a Python file defining ``reduce_frame(frameno,
+       data, info, outdir)`` and optionally ``finish(outdir)``, or a
+       function called as ``reduce_frame(frameno, data, info, outdir)``.
+     - *framenos* (list) - Frame numbers expected, None if not known.
+     - *kinds* (list) - Kinds of frame files streamed, e.g. ['q'].
+     - *info* (dict) - Frame info used where fort.t is not written, see
+       *expected_frames*.
+     - *window* (int) - Number of frames with pipes waiting at a time.
+     - *backlog* (int) - Number of completed frames held in memory for the
+       reducer before the code is made to wait.
+
+    :Attributes:
+     - *streamed* (list) - Frames passed to the reducer from pipes.
+     - *from_files* (list) - Frames passed to the reducer from files.
+     - *failed* (list) - Frames for which the reducer raised an exception.
+    """
+
+    def __init__(self, path, outdir, reducer, framenos=None, kinds=['q'],
+                 info=None, window=4, backlog=2):
+
+        self.path = os.path.abspath(path)
+        self.outdir = os.path.abspath(outdir)
+        self.finish_func = None
+        if isinstance(reducer, str):
+            reducer_file = os.path.abspath(reducer)
+            if not os.path.isfile(reducer_file):
+                raise IOError("Reducer file not found: %s" % reducer)
+            reducer_globals = runpy.run_path(reducer_file)
+            if 'reduce_frame' not in reducer_globals:
+                raise ValueError("No function reduce_frame in %s" % reducer)
+            self.reduce_func = reducer_globals['reduce_frame']
+            self.finish_func = reducer_globals.get('finish', None)
+        else:
+            self.reduce_func = reducer
+        self.framenos = framenos
+        self.kinds = list(kinds)
+        self.info = dict(info or {})
+        self.window = max(1, int(window))
+
+        self.streamed = []
+        self.from_files = []
+        self.failed = []
+        self._pending = {}    # frameno: {kind: [fd, chunks, done]}
+        self._held = {}       # frameno: {'data': ..., 't': path of fort.t}
+        self._held_lock = threading.Lock()
+        self._highest = -1
+        self._selector = selectors.DefaultSelector()
+        self._queue = queue.Queue(maxsize=max(1, int(backlog)))
+        self._stop = threading.Event()
+        self._reader = None
+        self._worker = None
+
+
+    def _next_frames(self):
+        if self.framenos is None:
+            frameno = self._highest + 1
+            while True:
+                yield frameno
+                frameno += 1
+        else:
+            for frameno in self.framenos:
+                if frameno > self._highest:
+                    yield frameno
+
+
+    def _fill_window(self):
+        # create and open the pipes of the next frames not yet completed
+        if not self.kinds:
+            return
+        for frameno in self._next_frames():
+            if len(self._pending) >= self.window:
+                break
+            if frameno in self._pending or frameno in self.streamed:
+                continue
+            entries = {}
+            for kind in self.kinds:
+                fifo = os.path.join(self.path, 'fort.%s%s'
+                                    % (kind, str(frameno).zfill(4)))
+                try:
+                    os.mkfifo(fifo)
+                except FileExistsError:
+                    if not stat.S_ISFIFO(os.lstat(fifo).st_mode):
+                        # already written as a file, picked up from there
+                        continue
+                # non-blocking, so that the code can open the pipes in any
+                # order and none of them blocks the reader
+                fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+                entries[kind] = [fd, [], False]
+                self._selector.register(fd, selectors.EVENT_READ,
+                                        (frameno, kind))
+            if len(entries) < len(self.kinds):
+                self._drop(frameno, entries)
+                self._highest = max(self._highest, frameno)
+                continue
+            self._pending[frameno] = entries
+
+
+    def _drop(self, frameno, entries):
+        # close the pipes of a frame and remove those still pipes
+        for (kind, (fd, chunks, done)) in entries.items():
+            if not done:
+                self._selector.unregister(fd)
+                os.close(fd)
+            fifo = os.path.join(self.path, 'fort.%s%s'
+                                % (kind, str(frameno).zfill(4)))
+            try:
+                if stat.S_ISFIFO(os.lstat(fifo).st_mode):
+                    os.remove(fifo)
+            except OSError:
+                pass
+
+
+    def _read(self):
+        # reader thread: collect what the code writes to the pipes
+        while True:
+            self._fill_window()
+            if not self._pending:
+                break
+            events = self._selector.select(timeout=0.2)
+            if not events:
+                if self._stop.is_set():
+                    # the code has ended, nothing more will be written
+                    break
+                continue
+            for (key, mask) in events:
+                frameno, kind = key.data
+                entry = self._pending[frameno][kind]
+                chunk = os.read(entry[0], 1024**2)
+                if chunk:
+                    entry[1].append(chunk)
+                    continue
+                # end of file: the code has closed the file
+                self._selector.unregister(entry[0])
+                os.close(entry[0])
+                entry[2] = True
+                if all(e[2] for e in self._pending[frameno].values()):
+                    self._complete(frameno)
+
+        for frameno in list(self._pending):
+            self._drop(frameno, self._pending.pop(frameno))
+        self._selector.close()
+
+
+    def _complete(self, frameno):
+        entries = self._pending.pop(frameno)
+        data = dict((kind, b''.join(chunks))
+                    for (kind, (fd, chunks, done)) in entries.items())
+        self._drop(frameno, entries)
+        # frames are written in order, those before this one that were
+        # never opened have been skipped (e.g. on a restart):
+        for skipped in [n for n in self._pending if n < frameno
+                        and not any(e[1] for e in self._pending[n].values())]:
+            self._drop(skipped, self._pending.pop(skipped))
+        self._highest = max(self._highest, frameno)
+        self.streamed.append(frameno)
+        # passed on once fort.t is written too (see frame_done):
+        self._hold(frameno, 'data', data)
+
+
+    def _hold(self, frameno, name, value):
+        # keep the data or fort.t of a streamed frame until both are there
+        with self._held_lock:
+            held = self._held.setdefault(frameno, {})
+            held[name] = value
+            if 'data' not in held or 't' not in held:
+                return
+            del self._held[frameno]
+        self._put(frameno, held['data'], held['t'])
+
+
+    def _put(self, frameno, data, t_file):
+        info = dict(self.info)
+        if t_file is not None:
+            from clawpack.clawutil.pyramid import read_frame_info
+            try:
+                info.update(read_frame_info(t_file))
+            except (OSError, ValueError, IndexError) as error:
+                print("==> streaming: Could not read %s: %s"
+                      % (t_file, error))
+        # blocks while the reducer is behind, so that the code waits:
+        self._queue.put((frameno, data, info))
+
+
+    def _reduce(self):
+        # worker thread: pass frames to the reducer in the order completed
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            frameno, data, info = item
+            try:
+                self.reduce_func(frameno, data, info, self.outdir)
+            except Exception as error:
+                self.failed.append(frameno)
+                print("==> streaming: Reducer failed on frame %s: %s"
+                      % (frameno, error))
+
+
+    def start(self):
+        r"""Create the first pipes and start the reader and reducer."""
+
+        self._fill_window()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._worker = threading.Thread(target=self._reduce, daemon=True)
+        self._reader.start()
+        self._worker.start()
+
+
+    def frame_done(self, frameno, path, files):
+        r"""
+        *clawutil.frames.FrameWatcher* callback for completed frames: passes
+        streamed frames on to the reducer now that their fort.t is written,
+        and frames written to files rather than to pipes with their data.
+        """
+
+        if 'q' not in files:
+            if 't' in files:
+                self._hold(frameno, 't', files['t'])
+            return
+        data = {}
+        for (kind, file_path) in files.items():
+            if kind in ['q', 'b']:
+                with open(file_path, 'rb') as f:
+                    data[kind] = f.read()
+        self.from_files.append(frameno)
+        # reduced by the same thread as the streamed frames
+        self._put(frameno, data, files.get('t'))
+
+
+    def finish(self):
+        r"""
+        Once the code has ended, reduce the frames still in the pipes,
+        remove all remaining pipes and call the reducer's finish function.
+        Call after the last *frame_done*.  Returns the number of frames
+        streamed.
+        """
+
+        self._stop.set()
+        if self._reader is not None:
+            self._reader.join()
+            # streamed frames whose fort.t was not reported, e.g. when the
+            # code failed while writing it:
+            with self._held_lock:
+                held, self._held = self._held, {}
+            for frameno in sorted(held):
+                if 'data' not in held[frameno]:
+                    continue
+                t_file = None
+                for path in [self.outdir, self.path]:
+                    name = os.path.join(path, 'fort.t%s'
+                                        % str(frameno).zfill(4))
+                    if os.path.isfile(name):
+                        t_file = name
+                        break
+                self._put(frameno, held[frameno]['data'], t_file)
+            self._queue.put(None)
+            self._worker.join()
+        if self.finish_func is not None:
+            try:
+                self.finish_func(self.outdir)
+            except Exception as error:
+                print("==> streaming: Reducer finish failed: %s" % error)
+        return len(self.streamed)
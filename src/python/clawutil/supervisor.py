@@ -0,0 +1,197 @@
+r"""
+Restart a run automatically from its latest checkpoint when the code fails,
+e.g. because a node failed or the job was preempted.
+
+*supervise* runs the code with runclaw and, if it exits with a non-zero
+status, finds the latest valid checkpoint in outdir, rewrites claw.data in
+outdir to restart from it and runs the code again, up to *max_restarts*
+times.  A checkpoint fort.chkNNNNN (or fort.chkaaaa/fort.chkbbbb when
+alternating) is valid once the code has written the accompanying
+fort.tckNNNNN after it, so a checkpoint being written when the code died is
+never used.  The supervisor gives up when a restart fails without getting
+past the checkpoint it restarted from, which points to an error in the code
+rather than in the machine.
+
+Used by runclaw with max_restarts=N (MAX_RESTARTS in the Makefile), or from
+the command line, where --resume first restarts from a checkpoint left by an
+earlier run, e.g. when a batch job is requeued::
+
+    python supervisor.py xamr _output 3 [--resume]
+"""
+
+import os
+import re
+import sys
+import time
+
+from clawpack.clawutil.runclaw import start_runclaw, ClawExeError
+
+_checkpoint_re = re.compile(r"^fort\.chk(\d+|aaaa|bbbb)$")
+_time_re = re.compile(r"time\s+t\s*=\s*([-+0-9.EeDd]+)")
+
+
+def find_checkpoints(outdir):
+    r"""
+    Return list of (time, name) of the valid checkpoints in *outdir*, newest
+    first.  time is read from the fort.tck file, None if not recorded.
+    """
+
+    try:
+        entries = [entry for entry in os.scandir(outdir) if entry.is_file()]
+    except OSError:
+        return []
+    names = dict((entry.name, entry) for entry in entries)
+    # codes that write fort.tck files write them after the checkpoint:
+    marked = any(name.startswith('fort.tck') for name in names)
+
+    checkpoints = []
+    for entry in entries:
+        match = _checkpoint_re.match(entry.name)
+        if not match:
+            continue
+        st = entry.stat()
+        if st.st_size == 0:
+            continue
+        chk_time = None
+        tck = names.get('fort.tck' + match.group(1))
+        if tck is not None:
+            if tck.stat().st_mtime < st.st_mtime:
+                # checkpoint rewritten after its marker, maybe incomplete
+                continue
+            try:
+                with open(tck.path) as f:
+                    found = _time_re.search(f.read())
+                if found:
+                    chk_time = float(found.group(1).replace('D', 'E')
+                                                   .replace('d', 'e'))
+            except (OSError, ValueError):
+                pass
+        elif marked:
+            continue
+        checkpoints.append((chk_time, st.st_mtime, entry.name))
+
+    checkpoints.sort(key=lambda c: (c[0] is not None,
+                                    c[0] if c[0] is not None else 0., c[1]),
+                     reverse=True)
+    return [(chk_time, name) for (chk_time, mtime, name) in checkpoints]
+
+
+def latest_checkpoint(outdir):
+    r"""Return (time, name) of the latest valid checkpoint, or None."""
+
+    checkpoints = find_checkpoints(outdir)
+    return checkpoints[0] if checkpoints else None
+
+
+def set_restart_data(path, restart_file):
+    r"""
+    Rewrite claw.data *path* (or the claw.data in directory *path*) to
+    restart from *restart_file*.  The file is replaced rather than modified,
+    so that a claw.data linked from the run directory is not changed.
+    """
+
+    if os.path.isdir(path):
+        path = os.path.join(path, 'claw.data')
+    values = {'restart': 'T', 'restart_file': "'%s'" % restart_file}
+    found = set()
+    lines = []
+    with open(path) as f:
+        for line in f:
+            if '=:' in line:
+                value, _, name = line.partition('=:')
+                name = name.split()[0] if name.split() else ''
+                if name in values:
+                    line = '%s =:%s' % (values[name].ljust(20),
+                                        line.partition('=:')[2])
+                    found.add(name)
+            lines.append(line)
+    if found != set(values):
+        raise ValueError("No restart parameters in %s" % path)
+    with open(path + '.tmp', 'w') as f:
+        f.writelines(lines)
+    os.replace(path + '.tmp', path)
+
+
+def supervise(xclawcmd=None, outdir=None, max_restarts=3, delay=0.,
+              resume=False, **kwargs):
+    r"""
+    Run the code with runclaw, restarting it from the latest checkpoint in
+    outdir each time it fails.
+
+    :Input:
+     - *xclawcmd*, *outdir* - As for runclaw.
+     - *max_restarts* (int) - Number of restarts before giving up.
+     - *delay* (float) - Seconds to wait before each restart.
+     - *resume* (bool) - Restart from a checkpoint already in outdir, if
+       any, rather than starting a new run.
+     - *kwargs* - Further arguments of runclaw, used for the first run.
+
+    :Output:
+     - (dict) The metrics of the successful run (see *RunclawJob.metrics*),
+       None if the run could not be set up.
+
+    Raises *ClawExeError* if the code still fails after *max_restarts*
+    restarts, fails without a checkpoint to restart from, or is cancelled.
+    """
+
+    max_restarts = int(max_restarts)
+    delay = float(delay)
+    if outdir is None:
+        outdir = '.'
+    restart_from = None
+    if resume:
+        restart_from = latest_checkpoint(outdir)
+        if restart_from is not None:
+            kwargs.update(restart=True, restart_file=restart_from[1],
+                          overwrite=True)
+            print("==> supervisor: Resuming from ", restart_from[1])
+
+    restarts = 0
+    while True:
+        kwargs['new_session'] = False
+        job = start_runclaw(xclawcmd=xclawcmd, outdir=outdir, **kwargs)
+        if job is None:
+            return None
+        returncode = job.wait(check=False)
+        if returncode == 0:
+            return job.metrics
+
+        error = ClawExeError("\n\n*** FORTRAN EXE FAILED ***\n", returncode,
+                             job.cmd)
+        if job.cancelled:
+            raise error
+        checkpoint = latest_checkpoint(job.outdir)
+        if checkpoint is None:
+            print("==> supervisor: Run failed with exit code %s and no"
+                  " checkpoint to restart from" % returncode)
+            raise error
+        if restart_from is not None and checkpoint[1] == restart_from[1] \
+           and checkpoint[0] == restart_from[0]:
+            print("==> supervisor: Restart from %s failed again before the"
+                  " next checkpoint, giving up" % checkpoint[1])
+            raise error
+        if restarts >= max_restarts:
+            print("==> supervisor: Run failed with exit code %s after %s"
+                  " restarts, giving up" % (returncode, restarts))
+            raise error
+
+        restarts += 1
+        restart_from = checkpoint
+        print("==> supervisor: Run failed with exit code %s, restart %s of %s"
+              " from %s%s" % (returncode, restarts, max_restarts,
+                              checkpoint[1], '' if checkpoint[0] is None
+                              else ' (t = %s)' % checkpoint[0]))
+        if delay > 0:
+            time.sleep(delay)
+        # the restart continues writing into outdir:
+        kwargs.update(restart=True, restart_file=checkpoint[1],
+                      overwrite=True)
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    xclawcmd = args[0] if len(args) > 0 else None
+    outdir = args[1] if len(args) > 1 else '_output'
+    max_restarts = int(args[2]) if len(args) > 2 else 3
+    supervise(xclawcmd, outdir, max_restarts=max_restarts,
+              resume='--resume' in sys.argv)
@@ -28,6 +28,8 @@ import clawpack.pyclaw.gauges as gauges
 import clawpack.pyclaw.solution as solution
 import clawpack.clawutil.claw_git_status as claw_git_status
 from clawpack.clawutil import runclaw
+from clawpack.clawutil import build_cache
+from clawpack.clawutil import gauge_store
 
 # Support for WIP decorator removed
 # It did not seem to be used in any examples, so simplify for converting
@@ -51,7 +53,8 @@ class ClawpackRegressionTest(unittest.TestCase):
      - *setUp*: Creates the temprorary directory that will house test output and
        data.   Also instantiates catching of output to both *stdout* and 
        *stderr*.  Finally, this method also calls *build_executable* which will
-       call the local Makefile's build process via *make .exe*.
+       call the local Makefile's build process via *make .exe*, or reuses
+       an identical executable from the shared executable cache.
      - *runTest*: Actually runs the test calling the following functions by
        default:
         - *load_rundata(): Creates the *rundata* objects via the local 
@@ -88,6 +91,9 @@ class ClawpackRegressionTest(unittest.TestCase):
              self.test_path = "./"
         self.rundata = None
         self.executable_name = None
+        self.use_executable_cache = os.environ.get('CLAW_EXE_CACHE',
+                                        'False').lower() in ['true', 't', '1']
+        self.use_gauge_store = False
 
 
     def get_remote_file(self, url, **kwargs):
@@ -157,15 +163,40 @@ class ClawpackRegressionTest(unittest.TestCase):
 
         Moves the resulting executable to the temporary directory.
 
+        If *use_executable_cache* is True (off by default, enabled by setting
+        the environment variable *CLAW_EXE_CACHE* to True), an identical
+        executable built previously (same sources, flags and compiler) is
+        taken from the shared cache in *build_cache.ExecutableCache* instead
+        of recompiling.  On a cache miss the code is rebuilt and the new
+        executable is added to the cache.
 
         """
 
+        self.executable_name = executable_name
+
         try:
             self.stdout.write("Test path and class info:\n")
             self.stdout.write("  class: %s\n" % str(self.__class__))
             self.stdout.write("  class file: %s\n" % str(inspect.getfile(self.__class__)))
             self.stdout.write("  test path: %s\n" % str(self.test_path))
             self.stdout.write("  temp path: %s\n" % str(self.temp_path))
+
+            exe_cache = None
+            exe_key = None
+            if self.use_executable_cache:
+                try:
+                    exe_cache = build_cache.ExecutableCache()
+                    exe_key = exe_cache.key(self.test_path, executable_name)
+                except (OSError, subprocess.CalledProcessError) as e:
+                    self.stdout.write("  executable cache disabled: %s\n" % e)
+                    exe_cache = None
+
+            if exe_cache is not None and \
+                    exe_cache.fetch(exe_key, executable_name, self.temp_path):
+                self.stdout.write("  using cached executable %s\n" % exe_key)
+                self.stdout.flush()
+                return
+
             subprocess.check_call("cd %s ; make .exe" % self.test_path, 
                                                         stdout=self.stdout,
                                                         stderr=self.stderr,
@@ -174,7 +205,10 @@ class ClawpackRegressionTest(unittest.TestCase):
             self.tearDown()
             raise e
 
-        self.executable_name = executable_name
+        if exe_cache is not None:
+            exe_cache.store(exe_key, {executable_name: 
+                        os.path.join(self.test_path, self.executable_name)})
+
         shutil.move(os.path.join(self.test_path, self.executable_name),  
                     self.temp_path)
 
@@ -206,7 +240,12 @@ class ClawpackRegressionTest(unittest.TestCase):
 
 
     def run_code(self):
-        r"""Run test code given an already compiled executable"""
+        r"""Run test code given an already compiled executable
+
+        If *use_gauge_store* is True (off by default), the gauge files written
+        are also consolidated into a gauge store, from which *check_gauges*
+        loads them.
+        """
 
         runclaw.runclaw(xclawcmd=os.path.join(self.temp_path,self.executable_name),
                         rundir=self.temp_path,
@@ -214,7 +253,8 @@ class ClawpackRegressionTest(unittest.TestCase):
                         overwrite=True,
                         restart=False,
                         xclawout=self.stdout,
-                        xclawerr=self.stderr)
+                        xclawerr=self.stderr,
+                        gauge_store=self.use_gauge_store)
         
         self.stdout.flush()
         self.stderr.flush()
@@ -315,8 +355,12 @@ class ClawpackRegressionTest(unittest.TestCase):
         if not(isinstance(indices, tuple) or isinstance(indices, list)):
             indices = tuple(indices)
 
-        # Get gauge data
-        gauge = gauges.GaugeSolution(gauge_id, path=self.temp_path)
+        # Get gauge data, from the gauge store if the run wrote one
+        if self.use_gauge_store and os.path.isfile(
+                os.path.join(self.temp_path, gauge_store.store_file)):
+            gauge = gauge_store.GaugeStore(self.temp_path)[gauge_id]
+        else:
+            gauge = gauges.GaugeSolution(gauge_id, path=self.temp_path)
 
         # Get regression comparison data
         regression_data_path = os.path.join(self.test_path, "regression_data")
@@ -0,0 +1,65 @@
+r"""
+Tests of packing output directories with clawpack.clawutil.archive.
+"""
+
+import os
+import zipfile
+
+import pytest
+
+from clawpack.clawutil import archive, compress
+
+
+def make_outdir(outdir):
+    (outdir / 'plots').mkdir(parents=True)
+    (outdir / 'fort.t0000').write_text('time 0\n')
+    (outdir / 'fort.q0000').write_text('q 0\n')
+    (outdir / 'fort.t0001').write_text('time 1\n')
+    (outdir / 'fort.q0001').write_text('q 1\n' * 100)
+    (outdir / 'plots' / 'frame0000.png').write_bytes(b'png')
+    compress.compress_file(str(outdir / 'fort.q0001'))
+
+
+@pytest.mark.parametrize("deflate", [False, True])
+def test_pack_and_read(tmp_path, deflate):
+    outdir = tmp_path / '_output'
+    make_outdir(outdir)
+
+    path = archive.pack_outdir(str(outdir), deflate=deflate)
+    assert path == str(tmp_path / '_output.zip')
+    assert not os.path.exists(path + '.tmp')
+
+    with archive.OutputArchive(path) as packed:
+        assert packed.names() == ['fort.q0000', 'fort.q0001.gz',
+                                  'fort.t0000', 'fort.t0001',
+                                  'plots/frame0000.png']
+        assert packed.frames() == {0: {'t': 'fort.t0000', 'q': 'fort.q0000'},
+                                   1: {'t': 'fort.t0001', 'q': 'fort.q0001'}}
+        # compressed frames are read decompressed
+        assert packed.read('fort.q0001') == b'q 1\n' * 100
+        with packed.open('fort.t0001', 'r') as f:
+            assert f.read() == 'time 1\n'
+        with pytest.raises(KeyError):
+            packed.read('fort.q0002')
+        compress_type = packed.zipfile.getinfo('fort.q0001.gz').compress_type
+        assert compress_type == zipfile.ZIP_STORED
+
+        packed.extract(str(tmp_path / 'extracted'))
+    assert archive.list_outdir(str(tmp_path / 'extracted')) == \
+           archive.list_outdir(str(outdir))
+
+
+def test_pack_and_remove(tmp_path, monkeypatch):
+    outdir = tmp_path / '_output'
+    make_outdir(outdir)
+
+    monkeypatch.chdir(outdir)
+    with pytest.raises(ValueError):
+        archive.pack_outdir(str(outdir), remove=True)
+
+    monkeypatch.chdir(tmp_path)
+    path = archive.pack_outdir(str(outdir), str(tmp_path / 'run.zip'),
+                               remove=True)
+    assert not os.path.exists(outdir)
+    with archive.OutputArchive(path) as packed:
+        assert packed.read('fort.q0000') == b'q 0\n'
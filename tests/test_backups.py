@@ -0,0 +1,75 @@
+r"""
+Tests of the store of output backups in clawpack.clawutil.backups.
+"""
+
+import os
+import time
+
+import pytest
+
+from clawpack.clawutil import backups
+
+
+def test_parse_retention():
+    assert backups.parse_retention(None) == \
+        {'keep_last': None, 'max_size': None, 'max_age': None}
+    assert backups.parse_retention('last=5, size=20G, age=30d') == \
+        {'keep_last': 5, 'max_size': 20 * 1024**3, 'max_age': 30 * 86400.}
+    assert backups.parse_retention('age=12h')['max_age'] == 12 * 3600.
+    # days by default
+    assert backups.parse_retention('age=2')['max_age'] == 2 * 86400.
+    assert backups.parse_retention({'keep_last': 3})['keep_last'] == 3
+    with pytest.raises(ValueError):
+        backups.parse_retention('count=5')
+
+
+def make_backup(store, name, files, mtime):
+    path = os.path.join(store.path, name)
+    os.makedirs(path)
+    for (file_name, text) in files.items():
+        with open(os.path.join(path, file_name), 'w') as f:
+            f.write(text)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_ingest_shares_identical_files(tmp_path):
+    store = backups.BackupStore(str(tmp_path / '_output_backups'))
+    now = time.time()
+    first = make_backup(store, '_output_1', {'claw.data': 'data',
+                                             'fort.q0000': 'x' * 100}, now - 20)
+    second = make_backup(store, '_output_2', {'claw.data': 'data',
+                                              'fort.q0000': 'y' * 100},
+                         now - 10)
+
+    assert store.ingest(first, workers=1) == \
+        {'linked': 0, 'stored': 2, 'saved': 0}
+    assert store.ingest(second) == {'linked': 1, 'stored': 1, 'saved': 4}
+    assert os.path.samefile(os.path.join(first, 'claw.data'),
+                            os.path.join(second, 'claw.data'))
+    # the backups keep their times
+    assert [path for (mtime, path) in store.backups()] == [second, first]
+    assert store.size() == 4 + 100 + 100
+    assert store.size([first]) == 104
+
+
+def test_prune(tmp_path):
+    store = backups.BackupStore(str(tmp_path / '_output_backups'))
+    now = time.time()
+    paths = []
+    for n in range(4):
+        paths.append(make_backup(store, '_output_%s' % n,
+                                 {'fort.q0000': str(n) * 100},
+                                 now - 1000 * (4 - n)))
+        store.ingest(paths[-1])
+
+    assert store.prune(keep_last=3) == [paths[0]]
+    # the objects only used by removed backups are removed too
+    assert sum(len(files) for (_, _, files) in
+               os.walk(store.objects)) == 3
+
+    assert store.prune(max_age=2500, protect=[paths[1]]) == []
+    assert store.prune(max_age=2500) == [paths[1]]
+    assert store.prune(max_size=150) == [paths[2]]
+    assert store.prune(keep_last=0, protect=[paths[3]]) == []
+    assert [path for (mtime, path) in store.backups()] == [paths[3]]
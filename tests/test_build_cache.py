@@ -0,0 +1,228 @@
+r"""
+Tests of the content-addressed caches in clawpack.clawutil.build_cache.
+"""
+
+import os
+import sys
+import shutil
+
+import pytest
+
+from clawpack.clawutil import build_cache
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+    return str(path)
+
+
+@pytest.mark.parametrize("size, expected", [
+    (None, None),
+    (1000, 1000),
+    ('1000', 1000),
+    ('500K', 500 * 1024),
+    ('500M', 500 * 1024**2),
+    ('2G', 2 * 1024**3),
+    ('2gb', 2 * 1024**3),
+    ('1.5T', int(1.5 * 1024**4)),
+    (' 10 ', 10),
+])
+def test_parse_size(size, expected):
+    assert build_cache.parse_size(size) == expected
+
+
+def test_parse_size_rejects_garbage():
+    with pytest.raises(ValueError):
+        build_cache.parse_size('lots')
+
+
+def test_hash_files_depends_on_names_and_content(tmp_path):
+    a = write(tmp_path / 'a.f90', 'x')
+    b = write(tmp_path / 'b.f90', 'x')
+    c = write(tmp_path / 'c.f90', 'y')
+    (tmp_path / 'd').mkdir()
+    a2 = write(tmp_path / 'd' / 'a.f90', 'x')
+
+    key = build_cache.hash_files([a]).hexdigest()
+    assert build_cache.hash_files([a2]).hexdigest() == key
+    assert build_cache.hash_files([b]).hexdigest() != key
+    assert build_cache.hash_files([c]).hexdigest() != key
+
+
+def test_store_fetch_and_lookup(tmp_path):
+    store = build_cache.CacheStore('test', path=tmp_path / 'cache')
+    key = 'ab' * 32
+    assert store.lookup(key) is None
+    assert store.fetch_all(key, str(tmp_path)) is None
+
+    src = write(tmp_path / 'src.txt', 'content')
+    path = store.store(key, {'file.txt': src})
+    assert path == store.entry_path(key)
+    assert store.lookup(key) == path
+
+    # a second store of the same key keeps the first entry
+    other = write(tmp_path / 'other.txt', 'other')
+    assert store.store(key, {'file.txt': other}) == path
+
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    assert store.fetch(key, 'file.txt', str(dest))
+    assert (dest / 'file.txt').read_text() == 'content'
+    assert not store.fetch(key, 'missing.txt', str(dest))
+
+    write(dest / 'file.txt', 'stale')
+    assert store.fetch_all(key, str(dest), link=True) == ['file.txt']
+    assert (dest / 'file.txt').read_text() == 'content'
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    store = build_cache.CacheStore('test', path=tmp_path / 'cache',
+                                   max_size=250)
+    src = write(tmp_path / 'src.txt', 'x' * 100)
+    keys = ['%02x' % n * 32 for n in range(3)]
+    for (n, key) in enumerate(keys):
+        path = store.store(key, {'file': src}, evict=False)
+        os.utime(path, (1000 + n, 1000 + n))
+    # using the oldest entry makes the second one the least recently used
+    store.lookup(keys[0])
+
+    store.evict()
+    assert store.lookup(keys[0]) is not None
+    assert store.lookup(keys[1]) is None
+    assert store.lookup(keys[2]) is not None
+    assert sum(size for (_, size, _) in store.entries()) <= 250
+
+
+def test_max_size_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv('CLAW_CACHE_MAX_SIZE', '3M')
+    store = build_cache.CacheStore('test', path=tmp_path)
+    assert store.max_size == 3 * 1024**2
+
+
+def test_cache_root_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv('CLAW_CACHE_DIR', str(tmp_path))
+    assert build_cache.cache_root() == str(tmp_path)
+    assert build_cache.ResultCache().path == str(tmp_path / 'results')
+
+
+def test_executable_key(tmp_path):
+    write(tmp_path / 'Makefile',
+          "build_info:\n"
+          "\t@echo CLAW_FC = gfortran\n"
+          "\t@echo ALL_FFLAGS = -O2\n"
+          "\t@echo SOURCES = main.f90\n")
+    write(tmp_path / 'main.f90', "program main\nend program main\n")
+    exe_cache = build_cache.ExecutableCache(path=tmp_path / 'cache')
+
+    key = exe_cache.key(str(tmp_path), 'xclaw')
+    assert exe_cache.key(str(tmp_path), 'xclaw') == key
+    assert exe_cache.key(str(tmp_path), 'xgeoclaw') != key
+    write(tmp_path / 'main.f90', "program main\n  print *, 1\nend program\n")
+    assert exe_cache.key(str(tmp_path), 'xclaw') != key
+
+
+def test_scan_fortran_src(tmp_path):
+    src = write(tmp_path / 'solver.f90',
+                "module Solver  ! the solver\n"
+                "  use iso_c_binding\n"
+                "  use, intrinsic :: ieee_arithmetic\n"
+                "  use grid_module, only: mx\n"
+                "  include 'params.i'\n"
+                "#include \"macros.h\"\n"
+                "  include 'missing.i'\n"
+                "contains\n"
+                "  module procedure step\n"
+                "end module solver\n")
+    write(tmp_path / 'params.i', "integer, parameter :: n = 2\n")
+    write(tmp_path / 'macros.h', "#define N 2\n")
+
+    defined, used, included = build_cache.scan_fortran_src(src)
+    assert defined == ['solver']
+    assert used == ['iso_c_binding', 'ieee_arithmetic', 'grid_module']
+    assert included == [str(tmp_path / 'params.i'),
+                        str(tmp_path / 'macros.h')]
+
+
+def test_fortran_includes_nested_and_include_dirs(tmp_path):
+    (tmp_path / 'inc').mkdir()
+    src = write(tmp_path / 'main.f',
+                "      include 'a.i'\n"
+                "#include <b.h>\n")
+    write(tmp_path / 'a.i', "      include 'c.i'\n")
+    write(tmp_path / 'inc' / 'b.h', "\n")
+    write(tmp_path / 'inc' / 'c.i', "      include 'a.i'\n")
+
+    assert build_cache.fortran_includes(src) == [str(tmp_path / 'a.i')]
+    includes = build_cache.fortran_includes(
+                                src, include_dirs=[str(tmp_path / 'inc')])
+    assert includes == [str(tmp_path / 'a.i'), str(tmp_path / 'inc' / 'c.i'),
+                        str(tmp_path / 'inc' / 'b.h')]
+
+
+def test_parse_compile_command():
+    parsed = build_cache.parse_compile_command(
+        ['gfortran', '-c', '-cpp', 'src/step.f90', '-J', 'mods', '-I./',
+         '-I', 'inc', '-L/lib', '-O2', '-o', 'step.o'])
+    assert parsed == {'compiler': 'gfortran', 'source': 'src/step.f90',
+                      'output': 'step.o', 'module_dir': 'mods',
+                      'include_dirs': ['./', 'inc'],
+                      'include_flags': ['-I./', '-I', 'inc'],
+                      'flags': ['-cpp', '-O2']}
+
+    # linking or compiling several sources is not cached
+    assert build_cache.parse_compile_command(
+                ['gfortran', 'a.o', 'b.o', '-o', 'xclaw']) is None
+    assert build_cache.parse_compile_command(
+                ['gfortran', '-c', 'a.f90', 'b.f90', '-o', 'a.o']) is None
+
+
+@pytest.mark.skipif(shutil.which('gfortran') is None,
+                    reason="gfortran not available")
+def test_object_cache_compile(tmp_path):
+    object_cache = build_cache.ObjectCache(path=tmp_path / 'cache')
+    app = tmp_path / 'app'
+    app.mkdir()
+    src = write(app / 'mod1.f90', "module mod1\n  integer :: n = 3\n"
+                                  "end module mod1\n")
+    command = ['gfortran', '-c', '-cpp', src, '-J', str(app),
+               '-o', str(app / 'mod1.o')]
+
+    assert object_cache.compile(command) == 0
+    os.remove(app / 'mod1.o')
+    os.remove(app / 'mod1.mod')
+    assert object_cache.compile(command) == 0
+    assert (app / 'mod1.o').exists() and (app / 'mod1.mod').exists()
+    stats = object_cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+    write(src, "module mod1\n  integer :: n = 4\nend module mod1\n")
+    assert object_cache.compile(command) == 0
+    assert object_cache.stats()['misses'] == 2
+
+
+@pytest.mark.skipif(shutil.which('ar') is None, reason="ar not available")
+def test_library_cache_builds_once(tmp_path):
+    library_cache = build_cache.LibraryCache(path=tmp_path / 'lib')
+    obj = tmp_path / 'objs' / 'flux.o'
+    # stands in for the sub-make compiling the objects
+    command = [sys.executable, '-c',
+               "import os; os.makedirs(%r, exist_ok=True); "
+               "open(%r, 'a').write('object')" % (str(obj.parent), str(obj))]
+    key = '0123456789abcdef'
+
+    (tmp_path / 'app1').mkdir()
+    lib_file = str(tmp_path / 'app1' / 'libclaw.a')
+    assert library_cache.build(key, lib_file, [str(obj)], command) == 0
+    assert os.path.isfile(lib_file)
+    assert library_cache.lookup(key) is not None
+
+    # a cached library is placed without running the command
+    (tmp_path / 'app2').mkdir()
+    lib_file2 = str(tmp_path / 'app2' / 'libclaw.a')
+    assert library_cache.build(key, lib_file2, [], ['false']) == 0
+    assert open(lib_file2, 'rb').read() == open(lib_file, 'rb').read()
+
+    # a failing build stores nothing
+    assert library_cache.build('f' * 16, lib_file2, [], ['false']) != 0
+    assert library_cache.lookup('f' * 16) is None
@@ -0,0 +1,86 @@
+r"""
+Tests of the source dependency scanning in src/check_src.py, used by
+Makefile.common.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'src'))
+import check_src
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+    return str(path)
+
+
+def test_fortran_dependencies(tmp_path):
+    amr = write(tmp_path / 'amr_module.f90',
+                "module amr_module\n  include 'sizes.i'\n"
+                "end module amr_module\n")
+    gauges = write(tmp_path / 'gauges_module.f90',
+                   "module gauges_module\n  use amr_module\n"
+                   "end module gauges_module\n")
+    step = write(tmp_path / 'step2.f90',
+                 "subroutine step2()\n  use gauges_module\n"
+                 "  use omp_lib\nend subroutine\n")
+    helper = write(tmp_path / 'helper.f90',
+                   "module helper\nend module helper\n")
+    main = write(tmp_path / 'main.f90',
+                 "program main\n  use helper\n  use amr_module\nend\n")
+    sizes = write(tmp_path / 'sizes.i', "integer, parameter :: n = 2\n")
+    missing = str(tmp_path / 'missing.f90')
+
+    fragment = check_src.fortran_dependencies([step, helper, main, missing],
+                                              [amr, gauges])
+    lines = fragment.splitlines()
+    base = str(tmp_path) + os.sep
+
+    assert lines[0].startswith('#')
+    assert "%samr_module.mod: %s" % (base, sizes) in lines
+    assert "%sgauges_module.mod: %samr_module.mod" % (base, base) in lines
+    assert "%sstep2.o: %sgauges_module.mod" % (base, base) in lines
+    # modules defined in ordinary sources are depended on via their object
+    assert "%smain.o: %shelper.o %samr_module.mod" % (base, base, base) \
+                                                                    in lines
+    # the objects made by the module rules
+    assert any(line.startswith("%samr_module.o: %samr_module.mod ;"
+                               % (base, base)) for line in lines)
+    # empty rules for the included files, so removing one is not an error
+    assert "%s:" % sizes in lines
+    assert not any('omp_lib' in line or 'missing' in line for line in lines)
+
+
+def test_consolidate_src_lists():
+    src_list = check_src.consolidate_src_lists(
+                    ['./b4step2.f90', './qinit.f'],
+                    ['lib/b4step2.f90', 'lib/step2.f90', 'lib/setaux.f90'],
+                    ['setaux.f90'])
+    assert src_list == ['lib/step2.f90', './b4step2.f90', './qinit.f']
+
+
+def test_library_key_and_dependencies(tmp_path):
+    (tmp_path / 'inc').mkdir()
+    src = write(tmp_path / 'flux.f', "      include 'params.i'\n"
+                                     "      end\n")
+    params = write(tmp_path / 'inc' / 'params.i',
+                   "      parameter (n = 2)\n")
+    include_dirs = [str(tmp_path / 'inc')]
+
+    key = check_src.library_key('gfortran', ['-O2'], [src], include_dirs)
+    assert len(key) == 16
+    assert check_src.library_key('gfortran', ['-O2'], [src],
+                                 include_dirs) == key
+    assert check_src.library_key('gfortran', ['-O3'], [src],
+                                 include_dirs) != key
+    write(params, "      parameter (n = 3)\n")
+    assert check_src.library_key('gfortran', ['-O2'], [src],
+                                 include_dirs) != key
+
+    fragment = check_src.library_dependencies([src], include_dirs)
+    assert "$(COMMON_LIB_OBJDIR)/flux.o: %s" % params \
+                                                in fragment.splitlines()
+    assert "%s:" % params in fragment.splitlines()
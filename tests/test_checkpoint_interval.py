@@ -0,0 +1,127 @@
+r"""
+Tests of recommending checkpoint intervals with
+clawpack.clawutil.checkpoint_interval.
+"""
+
+import os
+import json
+import math
+
+import pytest
+
+from clawpack.clawutil import checkpoint_interval
+
+
+claw_data = """\
+0.000000             =: t0
+1                    =: output_style
+4                    =: num_output_times
+1000.000000          =: tfinal
+2                    =: checkpt_style
+2                    =: num_checkpt_times
+0.1 0.2              =: checkpt_times
+1                    =: num_dim
+"""
+
+
+@pytest.mark.parametrize("spec, seconds", [
+    (90, 90.), ('90', 90.), ('30m', 1800.), ('24h', 86400.), (' 2D ', 172800.),
+    ('1w', 604800.),
+])
+def test_parse_duration(spec, seconds):
+    assert checkpoint_interval.parse_duration(spec) == seconds
+
+
+def test_optimal_interval():
+    # close to the first order estimate sqrt(2 delta M) for cheap checkpoints
+    interval = checkpoint_interval.optimal_interval(1., 86400.)
+    assert abs(interval - math.sqrt(2 * 86400.)) < 2.
+
+    # minimizes the expected run time for exponentially distributed failures
+    (delta, mtbf) = (60., 3600.)
+
+    def expected_time(tau):
+        # per unit of work, restarts costing nothing
+        return mtbf * (math.exp((tau + delta) / mtbf) - 1) / tau
+
+    interval = checkpoint_interval.optimal_interval(delta, mtbf)
+    best = min(range(10, 3600), key=expected_time)
+    assert abs(interval - best) < 0.02 * best
+
+    # checkpoints too expensive to be worth it more often than failures
+    assert checkpoint_interval.optimal_interval(10000., 3600.) == 3600.
+
+
+def make_calibration_run(outdir):
+    with open(os.path.join(outdir, 'claw.data'), 'w') as f:
+        f.write(claw_data)
+    # frames 1 unit of simulated time apart, written 100 s apart
+    for frameno in range(5):
+        path = os.path.join(outdir, 'fort.t%s' % str(frameno).zfill(4))
+        with open(path, 'w') as f:
+            f.write("  %sD+00    time\n" % frameno)
+        os.utime(path, (1000 + 100 * frameno, 1000 + 100 * frameno))
+    with open(os.path.join(outdir, 'fort.chk00005'), 'wb') as f:
+        f.write(b'x' * 1024**2)
+
+
+def test_recommend_checkpoint_times(tmp_path):
+    make_calibration_run(str(tmp_path))
+
+    settings = checkpoint_interval.recommend(str(tmp_path), '1h',
+                                             write_rate=1024**2)
+    calibration = settings['calibration']
+    assert calibration['wall_per_time'] == pytest.approx(100.)
+    assert calibration['wall_per_step'] is None
+    assert calibration['checkpoint_size'] == 1024**2
+    assert not calibration['checkpoint_size_estimated']
+    assert settings['checkpoint_cost'] == pytest.approx(1.)
+    assert settings['interval'] == pytest.approx(
+                        checkpoint_interval.optimal_interval(1., 3600.))
+    assert settings['checkpt_style'] == 2
+    times = settings['checkpt_times']
+    assert times[0] == pytest.approx(settings['interval'] / 100.)
+    assert times[-1] <= 1000.
+    assert checkpoint_interval.setrun_lines(settings)[0] == \
+        "clawdata.checkpt_style = 2"
+
+    checkpoint_interval.write_checkpoint_data(str(tmp_path), settings)
+    lines = open(tmp_path / 'claw.data').read().splitlines()
+    assert lines[4].split() == ['2', '=:', 'checkpt_style']
+    assert lines[5].split() == [str(len(times)), '=:', 'num_checkpt_times']
+    assert lines[6].split()[-2:] == ['=:', 'checkpt_times']
+    assert lines[-1].split() == ['1', '=:', 'num_dim']
+
+
+def test_recommend_checkpoint_interval(tmp_path):
+    make_calibration_run(str(tmp_path))
+    with open(tmp_path / 'run_metrics.json', 'w') as f:
+        json.dump({'wall_time': 400.}, f)
+    log_file = str(tmp_path / 'run.log')
+    with open(log_file, 'w') as f:
+        for n in range(40):
+            f.write("AMRCLAW: level  1  CFL = .9  dt = 0.1  final t = 1.\n")
+            f.write("AMRCLAW: level  2  CFL = .9  dt = 0.05  final t = 1.\n")
+
+    settings = checkpoint_interval.recommend(str(tmp_path), '1h',
+                                             log_file=log_file,
+                                             checkpoint_cost=1.)
+    assert settings['calibration']['wall_per_step'] == 10.
+    assert settings['checkpt_style'] == 3
+    assert settings['checkpt_interval'] == round(settings['interval'] / 10.)
+    assert checkpoint_interval.setrun_lines(settings) == \
+        ["clawdata.checkpt_style = 3",
+         "clawdata.checkpt_interval = %s" % settings['checkpt_interval']]
+
+    checkpoint_interval.write_checkpoint_data(str(tmp_path), settings)
+    lines = open(tmp_path / 'claw.data').read().splitlines()
+    assert [line.split()[-1] for line in lines[4:]] == \
+        ['checkpt_style', 'checkpt_interval', 'num_dim']
+
+
+def test_short_run_needs_no_checkpoints(tmp_path):
+    make_calibration_run(str(tmp_path))
+    # an interval of about 4 days, the run takes 100000 s
+    settings = checkpoint_interval.recommend(str(tmp_path), '100w',
+                                             checkpoint_cost=1000.)
+    assert settings['checkpt_style'] == 1
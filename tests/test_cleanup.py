@@ -0,0 +1,35 @@
+r"""
+Tests of clearing output directories with clawpack.clawutil.cleanup.
+"""
+
+import os
+
+from clawpack.clawutil import cleanup
+
+
+def test_clear_output_keeps_other_files(tmp_path):
+    outdir = tmp_path / '_output'
+    (outdir / 'fort.plots').mkdir(parents=True)
+    for name in ['fort.q0000', 'fort.t0000', 'fort.gauge', 'notes.txt',
+                 'setprob.data']:
+        (outdir / name).write_text(name)
+    # trash left by a killed run
+    (tmp_path / '._output.trash-old').mkdir()
+    (tmp_path / '._output.trash-old' / 'fort.q0001').write_text('old')
+
+    thread = cleanup.clear_output(str(outdir), ['fort.*', '*.data'],
+                                  batch_size=2)
+    thread.join()
+
+    assert sorted(os.listdir(outdir)) == ['fort.plots', 'notes.txt']
+    assert cleanup.list_trash(str(outdir)) == []
+    assert os.listdir(tmp_path) == ['_output']
+
+
+def test_clear_output_in_linked_outdir(tmp_path):
+    (tmp_path / 'real').mkdir()
+    (tmp_path / 'real' / 'fort.q0000').write_text('frame')
+    os.symlink('real', tmp_path / '_output')
+
+    cleanup.clear_output(str(tmp_path / '_output'), ['fort.*']).join()
+    assert os.listdir(tmp_path / 'real') == []
@@ -0,0 +1,68 @@
+r"""
+Tests of compressing output frames with clawpack.clawutil.compress.
+"""
+
+import os
+
+import pytest
+
+from clawpack.clawutil import compress
+
+data = b"   1.000000000000E+00\n" * 1000
+
+
+def test_parse_codec():
+    assert compress.parse_codec(True) == ('gzip', 1)
+    assert compress.parse_codec('xz') == ('xz', 1)
+    assert compress.parse_codec('BZ2:5') == ('bz2', 5)
+    with pytest.raises(ValueError):
+        compress.parse_codec('rar')
+
+
+@pytest.mark.parametrize("codec", ['gzip', 'bz2', 'xz'])
+def test_compress_file_round_trip(tmp_path, codec):
+    path = str(tmp_path / 'fort.q0001')
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    (compressed_path, size, compressed_size) = compress.compress_file(
+                                                            path, codec, 1)
+    assert not os.path.exists(path)
+    assert compressed_path == path + compress.codecs[codec][0]
+    assert size == len(data) and compressed_size < size
+    assert compress.find_output(path) == (compressed_path, codec)
+    with compress.open_output(path) as f:
+        assert f.read() == data
+    with compress.open_output(path, 'r') as f:
+        assert f.readline() == "   1.000000000000E+00\n"
+
+
+def test_open_output_missing(tmp_path):
+    with pytest.raises(IOError):
+        compress.open_output(str(tmp_path / 'fort.q0001'))
+
+
+def test_compress_and_decompress_outdir(tmp_path):
+    outdir = str(tmp_path)
+    for frameno in ['0000', '0001']:
+        for kind in 'tqa':
+            with open(os.path.join(outdir, 'fort.%s%s' % (kind, frameno)),
+                      'wb') as f:
+                f.write(data)
+
+    (size, compressed_size) = compress.compress_outdir(outdir, 'gzip:6')
+    assert size == 4 * len(data) and compressed_size < size
+    index = compress.read_index(outdir)
+    assert sorted(index) == ['fort.a0000', 'fort.a0001', 'fort.q0000',
+                             'fort.q0001']
+    assert index['fort.q0000']['level'] == 6
+    # the fort.t files are left so the frames can still be listed
+    assert os.path.isfile(os.path.join(outdir, 'fort.t0001'))
+    assert not os.path.exists(os.path.join(outdir, 'fort.q0001'))
+
+    compress.decompress_outdir(outdir)
+    assert sorted(os.listdir(outdir)) == sorted(
+        'fort.%s%s' % (kind, frameno) for kind in 'tqa'
+                                      for frameno in ['0000', '0001'])
+    with open(os.path.join(outdir, 'fort.q0001'), 'rb') as f:
+        assert f.read() == data
@@ -0,0 +1,62 @@
+r"""
+Tests of detecting completed output frames with clawpack.clawutil.frames.
+"""
+
+import os
+
+from clawpack.clawutil import frames
+
+
+def write_frame(outdir, frameno, kinds='tq'):
+    for kind in kinds:
+        with open(os.path.join(outdir, 'fort.%s%s' % (kind,
+                                                     str(frameno).zfill(4))),
+                  'w') as f:
+            f.write("frame %s\n" % frameno)
+
+
+def test_list_frames(tmp_path):
+    write_frame(str(tmp_path), 0)
+    write_frame(str(tmp_path), 12, 'tqb')
+    (tmp_path / 'fort.q00x1').write_text('')
+    (tmp_path / 'fort.gauge').write_text('')
+    os.mkdir(tmp_path / 'fort.t0003')
+
+    listed = frames.list_frames(str(tmp_path))
+    assert sorted(listed) == [0, 12]
+    assert sorted(listed[12]) == ['b', 'q', 't']
+    assert listed[0]['q'] == str(tmp_path / 'fort.q0000')
+    assert frames.list_frames(str(tmp_path / 'missing')) == {}
+
+
+def test_frame_watcher(tmp_path):
+    outdir = str(tmp_path)
+    write_frame(outdir, 0)
+    calls = []
+    watcher = frames.FrameWatcher(outdir, [lambda frameno, outdir, files:
+                                           calls.append(frameno)])
+
+    # frames present at the start are not reported
+    assert watcher.scan() == []
+    write_frame(outdir, 1)
+    # the last frame may still be being written
+    assert watcher.scan() == []
+    watcher.feed_line("AMRCLAW: Frame    1 output files done at time t = 1.")
+    assert watcher.scan() == [1]
+    # or is done once a later frame appears
+    write_frame(outdir, 2)
+    write_frame(outdir, 3)
+    assert watcher.scan() == [2]
+    assert watcher.finish() == [3]
+    assert calls == watcher.completed == [1, 2, 3]
+
+
+def test_frame_hooks_functions(tmp_path):
+    def hook(frameno, outdir, files):
+        if frameno == 2:
+            raise ValueError("bad frame")
+
+    hooks = frames.FrameHooks([hook], workers=2)
+    for frameno in [1, 2, 3]:
+        hooks(frameno, str(tmp_path), {})
+    assert hooks.close(str(tmp_path)) == [1, 3]
@@ -0,0 +1,89 @@
+r"""
+Tests of consolidating gauge output with clawpack.clawutil.gauge_store.
+"""
+
+import os
+
+import numpy
+import pytest
+
+from clawpack.clawutil import gauge_store
+
+
+def write_gauge(path, gauge_id, data, file_format='ascii'):
+    num_var = data.shape[1] - 2 if data.size else 2
+    with open(path, 'w') as f:
+        f.write("# gauge_id=   %s location=(   0.5   1.5   ) num_var=  %s\n"
+                % (gauge_id, num_var))
+        f.write("# level, time, q[  1  2], aux[]\n")
+        f.write("# file format %s, time series follow in this file\n"
+                % file_format)
+        if file_format == 'ascii':
+            for row in data:
+                f.write("   %02d  " % row[0] + "  ".join("%.10E" % x
+                        for x in row[1:]).replace('E', 'D') + "\n")
+        else:
+            data.tofile(os.path.splitext(path)[0] + '.bin')
+
+
+def gauge_data(num_rows, num_var=2):
+    t = numpy.linspace(0., 10., num_rows)
+    data = numpy.empty((num_rows, num_var + 2))
+    data[:, 0] = 1
+    data[:, 1] = t
+    for m in range(num_var):
+        data[:, m + 2] = (m + 1) * t
+    return data
+
+
+def test_read_gauge_file(tmp_path):
+    data = gauge_data(5)
+    write_gauge(tmp_path / 'gauge00007.txt', 7, data)
+    (gauge_id, location, read) = gauge_store.read_gauge_file(
+                                            str(tmp_path / 'gauge00007.txt'))
+    assert gauge_id == 7
+    assert location == [0.5, 1.5]
+    assert numpy.allclose(read, data)
+
+
+def test_store_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(gauge_store, 'chunk_rows', 4)
+    data1 = gauge_data(21)
+    data2 = gauge_data(10, num_var=1)
+    write_gauge(tmp_path / 'gauge00001.txt', 1, data1)
+    write_gauge(tmp_path / 'gauge00002.txt', 2, data2, 'binary64')
+    write_gauge(tmp_path / 'gauge00003.txt', 3, numpy.empty((0, 0)))
+
+    path = gauge_store.write_gauge_store(str(tmp_path), workers=1,
+                                         remove=True)
+    assert path == str(tmp_path / gauge_store.store_file)
+    assert os.listdir(tmp_path) == [gauge_store.store_file]
+
+    store = gauge_store.GaugeStore(str(tmp_path))
+    assert store.ids() == [1, 2, 3] and 2 in store
+    assert store.chunk_rows == 4
+    gauge = store[1]
+    assert gauge.location == [0.5, 1.5]
+    assert numpy.allclose(gauge.data, data1)
+    assert numpy.allclose(gauge.q, data1[:, 2:].T)
+    assert numpy.allclose(store[2].data, data2)
+    assert store[3].t.shape == (0,)
+
+    # the time index gives the same rows as searching all times
+    for t in [-1., 0., 0.5, 2., 2.4, 5., 9.99, 10., 11.]:
+        n = max(numpy.searchsorted(data1[:, 1], t, side='right') - 1, 0)
+        assert numpy.allclose(gauge.at_time(t), data1[n])
+    window = gauge.between(2., 5.)
+    expected = data1[(data1[:, 1] >= 2.) & (data1[:, 1] <= 5.)]
+    assert numpy.allclose(window.data, expected)
+    assert gauge.between(11., 12.).data.shape[0] == 0
+
+
+def test_store_without_gauges(tmp_path):
+    assert gauge_store.write_gauge_store(str(tmp_path)) is None
+
+
+def test_not_a_store(tmp_path):
+    (tmp_path / gauge_store.store_file).write_bytes(b'not a store')
+    with pytest.raises(IOError):
+        gauge_store.GaugeStore(str(tmp_path))
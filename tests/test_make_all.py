@@ -0,0 +1,128 @@
+r"""
+Tests of running all examples with clawpack.clawutil.make_all.
+"""
+
+import os
+
+import pytest
+
+os.environ.setdefault('CLAW', os.path.abspath(os.path.join(
+                              os.path.dirname(__file__), os.pardir, os.pardir)))
+from clawpack.clawutil import make_all
+
+
+# Example whose build records when it starts and ends in builds.txt, and
+# whose run leaves a file "ran" once any examples nested in it have run.
+makefile = """\
+.exe:
+\t@echo start >> {log}
+\t@sleep 0.2
+\t@echo end >> {log}
+all:
+\t@for d in */; do test ! -f $$d/setrun.py || test -f $$d/ran || exit 1; done
+\t@touch ran
+"""
+
+
+def make_example(path, log, failing=False):
+    os.makedirs(path)
+    with open(os.path.join(path, 'setrun.py'), 'w') as f:
+        f.write("# example\n")
+    with open(os.path.join(path, 'Makefile'), 'w') as f:
+        f.write(makefile.format(log=log))
+        if failing:
+            f.write("\t@exit 2\n")
+
+
+def test_list_examples_prunes_output(tmp_path):
+    make_example(str(tmp_path / 'ex1'), 'log')
+    make_example(str(tmp_path / 'ex1' / 'inner'), 'log')
+    make_example(str(tmp_path / 'ex1' / '_output'), 'log')
+    make_example(str(tmp_path / '.hidden'), 'log')
+
+    examples = make_all.list_examples(str(tmp_path))
+    assert examples == [str(tmp_path / 'ex1' / 'inner'), str(tmp_path / 'ex1')]
+
+    deps = make_all.example_dependencies(examples)
+    assert deps[str(tmp_path / 'ex1')] == set([str(tmp_path / 'ex1' /
+                                                   'inner')])
+    assert deps[str(tmp_path / 'ex1' / 'inner')] == set()
+
+
+def test_make_all_concurrent(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    log = str(tmp_path / 'builds.txt')
+    examples = tmp_path / 'examples'
+    make_example(str(examples / 'a'), log)
+    make_example(str(examples / 'a' / 'nested'), log)
+    make_example(str(examples / 'b'), log)
+    make_example(str(examples / 'c'), log, failing=True)
+
+    good, bad = make_all.make_all(str(examples), num_jobs=3, ask_user=False)
+
+    assert sorted(good) == [str(examples / 'a'), str(examples / 'a' /
+                                                     'nested'),
+                            str(examples / 'b')]
+    assert bad == [str(examples / 'c')]
+    # the builds ran one at a time
+    with open(log) as f:
+        assert f.read().split() == ['start', 'end'] * 4
+    for name in ['make_all_output.txt', 'make_all_errors.txt',
+                 'make_all_summary.txt']:
+        assert os.path.isfile(tmp_path / name)
+    assert len(os.listdir(tmp_path / 'make_all_logs')) == 8
+
+
+def test_example_metadata(tmp_path):
+    with open(tmp_path / 'Makefile', 'w') as f:
+        f.write("CLAW_PKG = geoclaw   # package\n"
+                "EXE = xgeoclaw\n"
+                "SOURCES = qinit.f90 \\\n"
+                "  setprob.f\n"
+                "#  b4step2.f90\n")
+    with open(tmp_path / 'setrun.py', 'w') as f:
+        f.write("    num_dim = 2\n")
+
+    assert make_all.example_metadata(str(tmp_path)) == \
+        {'package': 'geoclaw', 'num_dim': 2, 'exe': 'xgeoclaw',
+         'num_sources': 2}
+
+
+def test_catalog_predicted_cost(tmp_path):
+    catalog = make_all.ExampleCatalog(str(tmp_path))
+    catalog.examples = {
+        'big': {'package': 'geoclaw', 'num_dim': 2, 'num_sources': 10,
+                'timings': [100., 120.]},
+        'b': {'package': 'geoclaw', 'num_dim': 2, 'num_sources': 2,
+              'timings': [10.]},
+        'c': {'package': 'geoclaw', 'num_dim': 2, 'num_sources': 3,
+              'timings': [12.]},
+        'd': {'package': 'geoclaw', 'num_dim': 2, 'num_sources': 4,
+              'timings': [14.]},
+        'new_big': {'package': 'geoclaw', 'num_dim': 2, 'num_sources': 9},
+        'new_small': {'package': 'geoclaw', 'num_dim': 2, 'num_sources': 2},
+        'other': {'package': 'amrclaw', 'num_dim': 3},
+    }
+
+    assert catalog.predicted_cost('big') == 110.
+    # from the examples listing the closest number of sources
+    assert catalog.predicted_cost('new_big') == 14.
+    assert catalog.predicted_cost('new_small') == 12.
+    # from all examples
+    assert catalog.predicted_cost('other') == 14.
+    assert catalog.by_predicted_cost(['b', 'big', 'c']) == ['big', 'c', 'b']
+
+
+def test_catalog_records_successful_runs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    examples = tmp_path / 'examples'
+    make_example(str(examples / 'ok'), 'log')
+    make_example(str(examples / 'failing'), 'log', failing=True)
+
+    make_all.make_all(str(examples), ask_user=False, use_catalog=True)
+    make_all.make_all(str(examples), ask_user=False, use_catalog=True)
+
+    catalog = make_all.ExampleCatalog(str(examples))
+    assert len(catalog.examples[str(examples / 'ok')]['timings']) == 2
+    assert catalog.examples[str(examples / 'failing')]['timings'] == []
+    assert catalog.examples[str(examples / 'ok')]['num_sources'] == 0
@@ -0,0 +1,59 @@
+r"""
+Tests of output manifests with clawpack.clawutil.manifest.
+"""
+
+import os
+import hashlib
+
+from clawpack.clawutil import manifest
+
+
+def test_write_manifest_hashes_changed_files_only(tmp_path, monkeypatch):
+    (tmp_path / 'plots').mkdir()
+    (tmp_path / 'fort.q0000').write_text('q0')
+    (tmp_path / 'fort.t0000').write_text('t0')
+    (tmp_path / 'plots' / 'frame.png').write_text('png')
+
+    hashed = []
+    file_hash = manifest.file_hash
+    monkeypatch.setattr(manifest, 'file_hash',
+                        lambda path: hashed.append(path) or file_hash(path))
+
+    path = manifest.write_manifest(str(tmp_path), workers=2)
+    assert path == str(tmp_path / manifest.manifest_file)
+    entries = manifest.read_manifest(str(tmp_path))
+    assert sorted(entries) == ['fort.q0000', 'fort.t0000', 'plots/frame.png']
+    assert entries['fort.q0000']['sha256'] == \
+        hashlib.sha256(b'q0').hexdigest()
+    assert entries['fort.q0000']['size'] == 2
+    assert len(hashed) == 3
+
+    # only the new and changed files are read again
+    hashed[:] = []
+    (tmp_path / 'fort.q0000').write_text('new q0')
+    os.remove(tmp_path / 'fort.t0000')
+    (tmp_path / 'fort.q0001').write_text('q1')
+    manifest.write_manifest(str(tmp_path))
+    assert sorted(hashed) == [str(tmp_path / 'fort.q0000'),
+                              str(tmp_path / 'fort.q0001')]
+    assert sorted(manifest.read_manifest(str(tmp_path))) == \
+        ['fort.q0000', 'fort.q0001', 'plots/frame.png']
+
+    assert manifest.diff_manifests(entries, str(tmp_path)) == \
+        (['fort.q0001'], ['fort.t0000'], ['fort.q0000'])
+
+
+def test_frames_hashed_as_completed(tmp_path):
+    (tmp_path / 'fort.q0000').write_text('q0')
+    output_manifest = manifest.OutputManifest(str(tmp_path))
+    output_manifest(0, str(tmp_path), {'q': str(tmp_path / 'fort.q0000')})
+    # compressed meanwhile
+    os.rename(tmp_path / 'fort.q0000', tmp_path / 'fort.q0000.gz')
+    output_manifest.write()
+    output_manifest.close()
+    assert sorted(manifest.read_manifest(str(tmp_path))) == ['fort.q0000.gz']
+
+
+def test_read_missing_manifest(tmp_path):
+    assert manifest.read_manifest(str(tmp_path)) == {}
+    assert manifest.diff_manifests({}, {}) == ([], [], [])
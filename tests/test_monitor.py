@@ -0,0 +1,61 @@
+r"""
+Tests of following the progress of a run with clawpack.clawutil.monitor.
+"""
+
+import json
+
+import pytest
+
+from clawpack.clawutil import monitor
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("AMRCLAW: level  1  CFL = .899  dt =  0.1093E-01  final t =  0.6E-01",
+     True),
+    ("AMRCLAW: level  2  CFL = .899  dt =  0.1093E-01  final t =  0.6E-01",
+     False),
+    ("CLAW1EZ: Courant number =  0.9  dt = 0.1  t = 0.2  CFL = 0.9", True),
+    ("CLAW1EZ: Frame    1 output files done at time t =  0.5000D+00", False),
+])
+def test_is_level1_step(line, expected):
+    assert monitor.is_level1_step(line) == expected
+
+
+def test_format_seconds():
+    assert monitor.format_seconds(None) == '--:--:--'
+    assert monitor.format_seconds(59.6) == '0:01:00'
+    assert monitor.format_seconds(3600 + 62) == '1:01:02'
+
+
+def test_monitor_follows_log(tmp_path):
+    log_file = str(tmp_path / 'nohup.out')
+    with open(log_file, 'w') as f:
+        f.write("AMRCLAW: level  1  CFL = .9  dt = 0.1  final t = 0.1\n"
+                "AMRCLAW: level  2  CFL = .9  dt = 0.05  final t = 0.15\n"
+                "AMRCLAW: level  1  CFL = .9  dt = 0.1  final t = 0.2\n"
+                "CLAW1EZ: Frame    1 output files done at time t =  0.25")
+    for name in ['fort.t0000', 'fort.q0000', 'fort.t0001', 'fort.q0001']:
+        with open(tmp_path / name, 'w') as f:
+            f.write('x' * 10)
+
+    # no claw.data, so the progress is unknown
+    run_monitor = monitor.RunMonitor(str(tmp_path), log_file=log_file,
+                                     terminal=False)
+    status = run_monitor.update()
+    assert status['steps'] == 2
+    assert status['time'] == 0.2
+    assert status['frames'] == 2
+    assert status['output_bytes'] == 40
+    assert status['progress'] is None and status['eta'] is None
+
+    # the incomplete last line is read once finished
+    with open(log_file, 'a') as f:
+        f.write("D+00\n")
+    status = run_monitor.update()
+    assert status['steps'] == 2
+    assert status['time'] == 0.25
+    with open(tmp_path / 'run_status.json') as f:
+        assert json.load(f)['time'] == 0.25
+
+    run_monitor.tfinal = 1.
+    assert run_monitor.status()['progress'] == 0.25
@@ -0,0 +1,104 @@
+r"""
+Tests of coarsened copies of output frames with clawpack.clawutil.pyramid.
+"""
+
+import numpy
+import pytest
+
+from clawpack.clawutil import compress, pyramid
+
+
+def write_frame(outdir, frameno, q, lower=(0., 0.), delta=(0.25, 0.5),
+                output_format=None, nghost=2):
+    r"""Write 2d frame *frameno* with the single patch *q* of shape
+    (meqn, mx, my) as the Fortran code would."""
+
+    (meqn, mx, my) = q.shape
+    name = str(frameno).zfill(4)
+    with open(outdir / ('fort.t' + name), 'w') as f:
+        f.write("  1.50000000000000D+00    time\n"
+                "%5d                 meqn\n"
+                "    1                 ngrids\n"
+                "    0                 naux\n"
+                "    2                 ndim\n"
+                "%5d                 nghost\n" % (meqn, nghost))
+        if output_format is not None:
+            f.write("    %s                 format\n" % output_format)
+    with open(outdir / ('fort.q' + name), 'w') as f:
+        f.write("    1                 grid_number\n"
+                "    2                 AMR_level\n"
+                "%5d                 mx\n"
+                "%5d                 my\n"
+                "  %.8E    xlow\n  %.8E    ylow\n"
+                "  %.8E    dx\n  %.8E    dy\n\n"
+                % ((mx, my) + tuple(lower) + tuple(delta)))
+        if output_format is None:
+            for j in range(my):
+                for i in range(mx):
+                    f.write("  ".join("%.8E" % q[m, i, j]
+                                      for m in range(meqn)) + "\n")
+                f.write("\n")
+    if output_format is not None:
+        # with ghost cells, the equations of a cell together, i fastest
+        ghost = numpy.zeros((meqn, mx + 2 * nghost, my + 2 * nghost))
+        ghost[:, nghost:nghost + mx, nghost:nghost + my] = q
+        ghost.transpose(2, 1, 0).astype(numpy.float64).tofile(
+                                                str(outdir / ('fort.b' + name)))
+
+
+def frame_q(meqn=2, mx=4, my=6):
+    return numpy.arange(meqn * mx * my, dtype=float).reshape(meqn, mx, my)
+
+
+def test_parse_factors():
+    assert pyramid.parse_factors(True) == [2, 4, 8]
+    assert pyramid.parse_factors('8,2,2') == [2, 8]
+    assert pyramid.parse_factors([4]) == [4]
+
+
+def test_coarsen():
+    q = frame_q(meqn=1, mx=5, my=4)
+    coarse = pyramid.coarsen(q, 2)
+    assert coarse.shape == (1, 3, 2)
+    assert coarse[0, 0, 0] == q[0, 0:2, 0:2].mean()
+    # smaller blocks at the upper edges
+    assert coarse[0, 2, 1] == q[0, 4, 2:4].mean()
+    assert numpy.allclose(pyramid.coarsen(q, 8), q.mean())
+
+
+def test_read_frame_info(tmp_path):
+    write_frame(tmp_path, 3, frame_q(), output_format=3)
+    info = pyramid.read_frame_info(str(tmp_path / 'fort.t0003'))
+    assert info == {'time': 1.5, 'meqn': 2, 'ngrids': 1, 'naux': 0,
+                    'ndim': 2, 'nghost': 2, 'dtype': numpy.float64}
+
+
+@pytest.mark.parametrize("output_format", [None, 3])
+def test_read_frame(tmp_path, output_format):
+    q = frame_q()
+    write_frame(tmp_path, 0, q, output_format=output_format)
+    (time, ndim, patches) = pyramid.read_frame(str(tmp_path), 0)
+    assert (time, ndim, len(patches)) == (1.5, 2, 1)
+    assert patches[0]['level'] == 2
+    assert patches[0]['delta'] == [0.25, 0.5]
+    assert numpy.allclose(patches[0]['q'], q)
+
+
+def test_pyramid_round_trip(tmp_path):
+    q = frame_q()
+    write_frame(tmp_path, 1, q, lower=(1., 2.))
+    compress.compress_file(str(tmp_path / 'fort.q0001'))
+
+    path = pyramid.write_pyramid(str(tmp_path), 1, [2, 4])
+    assert path == pyramid.pyramid_file(str(tmp_path), 1)
+
+    (time, patches) = pyramid.read_pyramid(str(tmp_path), 1, 2)
+    assert time == 1.5
+    assert patches[0]['lower'] == [1., 2.]
+    assert patches[0]['delta'] == [0.5, 1.]
+    assert numpy.allclose(patches[0]['q'], pyramid.coarsen(q, 2))
+    # the largest factor by default
+    (time, patches) = pyramid.read_pyramid(str(tmp_path), 1)
+    assert patches[0]['q'].shape == (2, 1, 2)
+    with pytest.raises(ValueError):
+        pyramid.read_pyramid(str(tmp_path), 1, 8)
@@ -0,0 +1,235 @@
+r"""
+Tests of running executables with clawpack.clawutil.runclaw, using a shell
+script that writes two output frames in place of a Clawpack executable.
+"""
+
+import os
+import json
+import time
+import threading
+import subprocess
+
+import pytest
+
+from clawpack.clawutil import runclaw
+
+
+fake_exe = """\
+#!/bin/sh
+echo run >> runs.txt
+for n in 0000 0001; do
+  printf '0.0 time\\n1 meqn\\n1 ngrids\\n0 naux\\n1 ndim\\n2 nghost\\n' > fort.t$n
+  echo "q $n" > fort.q$n
+  echo "CLAW1EZ: Frame    $n output files done at time t =   0.0000E+00"
+done
+"""
+
+
+@pytest.fixture
+def rundir(tmp_path, monkeypatch):
+    r"""Directory with a fake executable xfake and a data file."""
+
+    monkeypatch.setenv('CLAW_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.chdir(tmp_path)
+    with open(tmp_path / 'xfake', 'w') as f:
+        f.write(fake_exe)
+    os.chmod(tmp_path / 'xfake', 0o755)
+    with open(tmp_path / 'setprob.data', 'w') as f:
+        f.write("1    =: value\n")
+    return tmp_path
+
+
+def num_runs(outdir):
+    with open(os.path.join(outdir, 'runs.txt')) as f:
+        return len(f.readlines())
+
+
+def test_result_cache(rundir):
+    outdir = str(rundir / '_output')
+    metrics = runclaw.runclaw('xfake', outdir, restart=False, use_cache=True)
+    assert metrics['returncode'] == 0 and 'cached' not in metrics
+
+    # restored, without running the code
+    os.remove(os.path.join(outdir, 'fort.q0001'))
+    metrics = runclaw.runclaw('xfake', outdir, restart=False, use_cache=True)
+    assert metrics == {'returncode': 0, 'cached': True}
+    assert num_runs(outdir) == 1
+    with open(os.path.join(outdir, 'fort.q0001')) as f:
+        assert f.read() == "q 0001\n"
+    with open(os.path.join(outdir, 'run_metrics.json')) as f:
+        assert json.load(f) == metrics
+
+    # changed input data
+    with open(rundir / 'setprob.data', 'w') as f:
+        f.write("2    =: value\n")
+    metrics = runclaw.runclaw('xfake', outdir, restart=False, use_cache=True)
+    assert 'cached' not in metrics
+    assert num_runs(outdir) == 2
+
+    # frame hooks are not part of the key, so such runs are not cached
+    with open(rundir / 'hooks.py', 'w') as f:
+        f.write("def frame_done(frameno, outdir, files):\n    pass\n")
+    runclaw.runclaw('xfake', outdir, restart=False, use_cache=True,
+                    frame_hooks=str(rundir / 'hooks.py'))
+    assert num_runs(outdir) == 3
+
+
+def test_result_cache_is_not_modified_by_reruns(rundir):
+    outdir = str(rundir / '_output')
+    runclaw.runclaw('xfake', outdir, restart=False, use_cache=True)
+    runclaw.runclaw('xfake', outdir, restart=False, use_cache=True)
+
+    # a new run rewrites the outputs that are hardlinks to the cache
+    with open(rundir / 'xfake', 'a') as f:
+        f.write("echo changed > fort.q0000\n")
+    runclaw.runclaw('xfake', outdir, restart=False, use_cache=False)
+    with open(rundir / 'xfake', 'w') as f:
+        f.write(fake_exe)
+
+    runclaw.runclaw('xfake', outdir, restart=False, use_cache=True)
+    with open(os.path.join(outdir, 'fort.q0000')) as f:
+        assert f.read() == "q 0000\n"
+
+
+def start_job(tmp_path, script, **kwargs):
+    return runclaw.RunclawJob(['sh', '-c', script], str(tmp_path), 'sh',
+                              **kwargs)
+
+
+def test_job_wait_and_failure(tmp_path):
+    job = start_job(tmp_path, "exit 0")
+    assert job.wait() == 0
+
+    job = start_job(tmp_path, "exit 3")
+    with pytest.raises(runclaw.ClawExeError):
+        job.wait()
+    assert job.returncode == 3
+    assert job.wait(check=False) == 3
+
+
+def test_job_poll_and_callbacks(tmp_path):
+    calls = []
+    job = start_job(tmp_path, "sleep 0.2")
+    job.on_finish.append(lambda job: calls.append(('finish',
+                                            threading.current_thread())))
+    job.on_success.append(lambda job: calls.append(('success',
+                                            threading.current_thread())))
+    assert job.poll() is None
+    while job.poll() is None:
+        time.sleep(0.01)
+
+    assert job.returncode == 0
+    assert [name for (name, _) in calls] == ['finish', 'success']
+    # called on the thread that waited for the executable
+    assert all(thread is not threading.current_thread()
+               for (_, thread) in calls)
+
+
+def test_job_callback_error_raised_by_wait(tmp_path):
+    def fail(job):
+        raise RuntimeError("callback failed")
+
+    job = start_job(tmp_path, "exit 0")
+    job.on_success.append(fail)
+    with pytest.raises(RuntimeError):
+        job.wait()
+    # reported once
+    assert job.wait() == 0
+
+
+def test_job_timeout(tmp_path):
+    finished = []
+    job = start_job(tmp_path, "sleep 10", timeout=0.2)
+    job.on_finish.append(lambda job: finished.append(
+                                        threading.current_thread()))
+    with pytest.raises(runclaw.ClawExeError):
+        job.wait(timeout=5)
+    assert job.timed_out and job.cancelled
+    assert job.returncode != 0
+    assert len(finished) == 1
+    assert finished[0] is not threading.current_thread()
+
+
+def test_job_wait_timeout_leaves_run_going(tmp_path):
+    job = start_job(tmp_path, "sleep 0.5")
+    with pytest.raises(subprocess.TimeoutExpired):
+        job.wait(timeout=0.05)
+    assert not job.cancelled
+    assert job.wait() == 0
+
+
+def test_job_cancel(tmp_path):
+    job = start_job(tmp_path, "sleep 10")
+    job.cancel(grace=1)
+    assert job.cancelled and not job.timed_out
+    assert job.wait(check=False) != 0
+
+
+def test_job_iter_output(tmp_path):
+    job = start_job(tmp_path, "echo one; echo two >&2; echo three",
+                    stream=True)
+    output = list(job.iter_output(timeout=5))
+    assert [line for (name, line) in output if name == 'stdout'] == \
+        ['one\n', 'three\n']
+    assert output.count(('stderr', 'two\n')) == 1
+    assert job.wait() == 0
+
+
+def test_job_on_line_errors_are_isolated(tmp_path, capsys):
+    lines = []
+
+    def fail(line, name):
+        raise ValueError("bad line")
+
+    # the handlers are added before the first line is written
+    job = start_job(tmp_path, "sleep 0.2; echo one; echo two", capture=True)
+    job.on_line.append(fail)
+    job.on_line.append(lambda line, name: lines.append(line))
+    assert job.wait() == 0
+
+    assert lines == ['one\n', 'two\n']
+    assert "Output line handler fail failed: bad line" in capsys.readouterr().out
+
+
+def test_run_batch(rundir):
+    with open(rundir / 'xfake', 'a') as f:
+        f.write("echo $OMP_NUM_THREADS $OMP_PLACES > omp.txt\n")
+    cpus = runclaw.available_cpus()
+    assert cpus and cpus == sorted(cpus)
+    jobs = [{'rundir': str(rundir), 'outdir': str(rundir / '_out1'),
+             'xclawcmd': 'xfake', 'restart': False},
+            {'rundir': str(rundir), 'outdir': str(rundir / '_out2'),
+             'xclawcmd': 'xfake', 'restart': False,
+             'threads': len(cpus) + 1},
+            {'rundir': str(rundir), 'outdir': str(rundir / '_out3'),
+             'xclawcmd': 'xmissing', 'restart': False}]
+
+    (results, summary) = runclaw.run_batch(jobs, cpus=cpus,
+                                           poll_interval=0.01, verbose=False)
+
+    assert [r['returncode'] for r in results[:2]] == [0, 0]
+    assert results[2]['returncode'] is None
+    assert (summary['num_jobs'], summary['failed']) == (3, 1)
+    # each job gets its own cores, at most all of them
+    assert results[0]['cpus'] == cpus[:1]
+    assert results[1]['threads'] == len(cpus)
+    with open(rundir / '_out2' / 'omp.txt') as f:
+        assert f.read().split()[0] == str(len(cpus))
+    assert os.path.isfile(rundir / '_out1' / 'runclaw_output.txt')
+    assert results[0]['metrics']['returncode'] == 0
+
+
+def test_run_metrics(rundir):
+    outdir = str(rundir / '_output')
+    metrics = runclaw.runclaw('xfake', outdir, restart=False)
+
+    for key in ['returncode', 'cancelled', 'cmd', 'hostname', 'start_time',
+                'wall_time', 'omp_num_threads']:
+        assert key in metrics
+    assert metrics['returncode'] == 0 and not metrics['cancelled']
+    assert metrics['wall_time'] >= 0
+    if hasattr(os, 'wait4'):
+        assert metrics['max_rss'] > 0
+        assert metrics['user_time'] >= 0 and metrics['system_time'] >= 0
+    with open(os.path.join(outdir, 'run_metrics.json')) as f:
+        assert json.load(f) == metrics
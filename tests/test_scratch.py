@@ -0,0 +1,51 @@
+r"""
+Tests of running in a scratch directory with clawpack.clawutil.scratch.
+"""
+
+import os
+
+from clawpack.clawutil import scratch
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+    return str(path)
+
+
+def test_scratch_root(tmp_path, monkeypatch):
+    monkeypatch.setenv('CLAW_SCRATCH', str(tmp_path))
+    assert scratch.scratch_root() == str(tmp_path)
+    assert scratch.scratch_root('/local/scratch') == '/local/scratch'
+
+
+def test_scratch_run(tmp_path):
+    outdir = tmp_path / '_output'
+    outdir.mkdir()
+    write(outdir / 'claw.data', 'data')
+    write(outdir / 'fort.q0000', 'old frame')
+    write(outdir / 'fort.gauge', 'gauges')
+
+    run = scratch.ScratchRun(str(outdir), str(tmp_path / 'scratch'))
+    path = run.path
+    assert os.path.dirname(path) == str(tmp_path / 'scratch')
+    # inputs are staged, frames are not
+    assert sorted(os.listdir(path)) == ['claw.data', 'fort.gauge']
+
+    # the code writes a frame and appends to the gauges
+    files = {'t': write(os.path.join(path, 'fort.t0001'), 't'),
+             'q': write(os.path.join(path, 'fort.q0001'), 'q')}
+    with open(os.path.join(path, 'fort.gauge'), 'a') as f:
+        f.write(' more')
+    moved = run.sync_frame(1, path, files)
+    assert moved == {'t': str(outdir / 'fort.t0001'),
+                     'q': str(outdir / 'fort.q0001')}
+    assert (outdir / 'fort.q0001').read_text() == 'q'
+    assert not os.path.exists(files['q'])
+
+    assert run.finish()
+    assert run.synced == {'fort.t0001': 1, 'fort.q0001': 1,
+                          'fort.gauge': 11}
+    assert (outdir / 'fort.gauge').read_text() == 'gauges more'
+    assert not os.path.exists(path)
+    assert not any(name.endswith('.part') for name in os.listdir(outdir))
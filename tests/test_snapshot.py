@@ -0,0 +1,107 @@
+r"""
+Tests of snapshots of output directories with clawpack.clawutil.snapshot.
+"""
+
+import os
+
+import pytest
+
+from clawpack.clawutil import snapshot
+
+
+def write(path, text, mtime=None):
+    with open(path, 'w') as f:
+        f.write(text)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_restart_safe_files(tmp_path):
+    for (frameno, mtime) in [(0, 100), (1, 200), (2, 300)]:
+        for kind in 'tq':
+            write(tmp_path / ('fort.%s%s' % (kind, str(frameno).zfill(4))),
+                  'frame', mtime)
+    write(tmp_path / 'fort.chk00005', 'chk', 150)
+    write(tmp_path / 'fort.chk00010', 'chk', 250)
+    write(tmp_path / 'fort.chk00020', 'chk', 350)
+    write(tmp_path / 'fort.gauge', 'gauges', 100)
+    write(tmp_path / 'fort.amr', 'log', 100)
+    write(tmp_path / 'claw.data', 'data', 100)
+
+    safe = snapshot.restart_safe_files(str(tmp_path), 'fort.chk00010')
+    # frame 1 is the one output last before the checkpoint
+    assert safe == set(['fort.t0000', 'fort.q0000', 'fort.chk00005',
+                        'fort.chk00010'])
+    assert snapshot.restart_safe_files(str(tmp_path), 'fort.chk00030') \
+                                                                    == set()
+    assert snapshot.restart_safe_files(str(tmp_path), None) == set()
+
+
+def test_snapshot_tree(tmp_path):
+    src = tmp_path / 'src'
+    (src / 'plots').mkdir(parents=True)
+    write(src / 'fort.q0000', 'frame')
+    write(src / 'fort.gauge', 'gauges')
+    write(src / 'plots' / 'frame0000.png', 'png')
+    os.symlink('fort.q0000', src / 'latest')
+    dest = tmp_path / 'dest'
+
+    counts = snapshot.snapshot_tree(str(src), str(dest),
+                                    shared=['fort.q0000'])
+
+    assert sum(counts.values()) == 3
+    if counts['reflinked'] == 0:
+        assert counts == {'reflinked': 0, 'hardlinked': 1, 'copied': 2}
+        assert os.path.samefile(src / 'fort.q0000', dest / 'fort.q0000')
+        assert not os.path.samefile(src / 'fort.gauge', dest / 'fort.gauge')
+    assert (dest / 'plots' / 'frame0000.png').read_text() == 'png'
+    assert os.readlink(dest / 'latest') == 'fort.q0000'
+
+
+@pytest.mark.parametrize("policy", sorted(snapshot.staging_policies))
+def test_stage_file(tmp_path, policy):
+    src = write(tmp_path / 'setprob.data', 'new')
+    dest = str(tmp_path / 'out' / 'setprob.data')
+    os.mkdir(tmp_path / 'out')
+    # a link left by an earlier run is replaced, not written through
+    os.link(write(tmp_path / 'old.data', 'old'), dest)
+
+    method = snapshot.stage_file(src, dest, policy)
+    assert method in snapshot.staging_policies[policy]
+    assert open(dest).read() == 'new'
+    assert open(tmp_path / 'old.data').read() == 'old'
+    if method == 'copy':
+        assert not os.path.samefile(src, dest)
+    elif method == 'symlink':
+        assert os.readlink(dest) == src
+
+    # staging again keeps src
+    assert snapshot.stage_file(src, dest, policy) == method
+    assert open(src).read() == 'new'
+
+
+def test_stage_file_onto_itself(tmp_path):
+    src = write(tmp_path / 'setprob.data', 'data')
+    os.symlink(str(tmp_path), tmp_path / 'outdir')
+
+    # the same file reached through a symlinked directory is left alone
+    for policy in snapshot.staging_policies:
+        assert snapshot.stage_file(src, str(tmp_path / 'outdir' /
+                                            'setprob.data'), policy) is None
+        assert open(src).read() == 'data'
+
+    # a hardlink to src is replaced
+    os.mkdir(tmp_path / 'out')
+    dest = str(tmp_path / 'out' / 'setprob.data')
+    os.link(src, dest)
+    assert snapshot.stage_file(src, dest, 'hardlink') == 'hardlink'
+    assert snapshot.stage_file(src, dest, 'copy') == 'copy'
+    assert not os.path.samefile(src, dest)
+    assert open(src).read() == open(dest).read() == 'data'
+
+
+def test_stage_file_unknown_policy(tmp_path):
+    src = write(tmp_path / 'setprob.data', 'data')
+    with pytest.raises(ValueError):
+        snapshot.stage_file(src, str(tmp_path / 'copy.data'), 'move')
@@ -0,0 +1,92 @@
+r"""
+Tests of streaming output frames to a reducer with clawpack.clawutil.streaming.
+"""
+
+import os
+import threading
+
+import numpy
+import pytest
+
+from clawpack.clawutil import streaming
+
+
+def write_claw_data(outdir, output_t0='T', output_format=1):
+    with open(os.path.join(outdir, 'claw.data'), 'w') as f:
+        f.write("2                    =: num_dim\n"
+                "0.000000             =: t0\n"
+                "1                    =: output_style\n"
+                "4                    =: num_output_times\n"
+                "1.000000             =: tfinal\n"
+                "%s                    =: output_t0\n"
+                "%s                    =: output_format\n"
+                "3                    =: num_eqn\n"
+                "1                    =: num_aux\n"
+                "2                    =: num_ghost\n"
+                % (output_t0, output_format))
+
+
+def test_expected_frames(tmp_path):
+    write_claw_data(str(tmp_path))
+    (framenos, kinds, info) = streaming.expected_frames(str(tmp_path))
+    assert framenos == [0, 1, 2, 3, 4]
+    assert kinds == ['q']
+    assert (info['ndim'], info['meqn'], info['naux'], info['nghost']) == \
+        (2, 3, 1, 2)
+    assert info['dtype'] == numpy.float64
+
+    write_claw_data(str(tmp_path), output_t0='F', output_format=2)
+    (framenos, kinds, info) = streaming.expected_frames(str(tmp_path))
+    assert framenos == [1, 2, 3, 4]
+    assert kinds == []
+    assert info['dtype'] == numpy.float32
+
+
+@pytest.mark.skipif(not hasattr(os, 'mkfifo'), reason="no named pipes")
+def test_stream_reducer(tmp_path):
+    path = str(tmp_path)
+    reduced = {}
+    finished = []
+
+    def reduce_frame(frameno, data, info, outdir):
+        reduced[frameno] = (data['q'], info['time'])
+
+    reducer = streaming.StreamReducer(path, path, reduce_frame,
+                                      framenos=[0, 1, 2], window=3,
+                                      backlog=1, info={'ndim': 1})
+    reducer.finish_func = finished.append
+    reducer.start()
+
+    def code():
+        # frames 0 to 2 go to the pipes, frame 3 is outside the window and
+        # written to a file
+        for frameno in range(4):
+            name = str(frameno).zfill(4)
+            with open(os.path.join(path, 'fort.q' + name), 'w') as f:
+                f.write("frame %s\n" % frameno * 1000)
+            t_file = os.path.join(path, 'fort.t' + name)
+            with open(t_file, 'w') as f:
+                f.write("%s.5 time\n1 meqn\n1 ngrids\n0 naux\n1 ndim\n"
+                        % frameno)
+            files = {'t': t_file}
+            if frameno == 3:
+                files['q'] = os.path.join(path, 'fort.q' + name)
+            reducer.frame_done(frameno, path, files)
+
+    thread = threading.Thread(target=code)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+
+    assert reducer.finish() == 3
+    assert reducer.streamed == [0, 1, 2]
+    assert reducer.from_files == [3]
+    assert sorted(reduced) == [0, 1, 2, 3]
+    for frameno in range(4):
+        assert reduced[frameno] == \
+            (("frame %s\n" % frameno * 1000).encode(), frameno + 0.5)
+    assert finished == [path]
+    # no pipes are left, only the file written by the code
+    assert sorted(os.listdir(path)) == ['fort.q0003', 'fort.t0000',
+                                        'fort.t0001', 'fort.t0002',
+                                        'fort.t0003']
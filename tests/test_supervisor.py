@@ -0,0 +1,105 @@
+r"""
+Tests of restarting failed runs with clawpack.clawutil.supervisor.
+"""
+
+import os
+
+import pytest
+
+from clawpack.clawutil import runclaw, supervisor
+
+
+claw_data = """\
+2                    =: num_dim
+F                    =: restart
+'fort.chkaaaa'       =: restart_file
+1                    =: checkpt_style
+"""
+
+# fails after writing a checkpoint, unless restarted
+fake_exe = """\
+#!/bin/sh
+echo run >> runs.txt
+if grep -q "^T  *=: restart$" claw.data; then
+  grep "restart_file" claw.data > restarted_from.txt
+  exit 0
+fi
+echo checkpoint > fort.chk00005
+echo " Checkpoint written at time t =  0.5000D+00" > fort.tck00005
+exit 1
+"""
+
+
+def write(path, text, mtime=None):
+    with open(path, 'w') as f:
+        f.write(text)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_find_checkpoints(tmp_path):
+    write(tmp_path / 'fort.chk00010', 'chk', 100)
+    write(tmp_path / 'fort.tck00010', 'time t =  1.0000E+00', 110)
+    write(tmp_path / 'fort.chk00020', 'chk', 200)
+    write(tmp_path / 'fort.tck00020', 'time t =  2.0000D+00', 210)
+    # rewritten after its marker, maybe incomplete
+    write(tmp_path / 'fort.chk00030', 'chk', 320)
+    write(tmp_path / 'fort.tck00030', 'time t =  3.0000E+00', 310)
+    # no marker, while the code writes them
+    write(tmp_path / 'fort.chk00040', 'chk', 400)
+    write(tmp_path / 'fort.chk00050', '', 500)
+
+    assert supervisor.find_checkpoints(str(tmp_path)) == \
+        [(2.0, 'fort.chk00020'), (1.0, 'fort.chk00010')]
+    assert supervisor.latest_checkpoint(str(tmp_path)) == \
+        (2.0, 'fort.chk00020')
+    assert supervisor.find_checkpoints(str(tmp_path / 'missing')) == []
+
+
+def test_checkpoints_without_markers(tmp_path):
+    write(tmp_path / 'fort.chkaaaa', 'chk', 200)
+    write(tmp_path / 'fort.chkbbbb', 'chk', 100)
+    assert supervisor.find_checkpoints(str(tmp_path)) == \
+        [(None, 'fort.chkaaaa'), (None, 'fort.chkbbbb')]
+
+
+def test_set_restart_data(tmp_path):
+    data = write(tmp_path / 'claw.data', claw_data)
+    os.link(data, tmp_path / 'linked.data')
+
+    supervisor.set_restart_data(str(tmp_path), 'fort.chk00020')
+    lines = open(data).read().splitlines()
+    assert lines[0] == claw_data.splitlines()[0]
+    assert lines[1].split() == ['T', '=:', 'restart']
+    assert lines[2].split() == ["'fort.chk00020'", '=:', 'restart_file']
+    # replaced rather than modified
+    assert open(tmp_path / 'linked.data').read() == claw_data
+
+    write(data, "2    =: num_dim\n")
+    with pytest.raises(ValueError):
+        supervisor.set_restart_data(data, 'fort.chk00020')
+
+
+@pytest.fixture
+def rundir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write(tmp_path / 'claw.data', claw_data)
+    write(tmp_path / 'xfake', fake_exe)
+    os.chmod(tmp_path / 'xfake', 0o755)
+    return tmp_path
+
+
+def test_supervise_restarts(rundir):
+    outdir = rundir / '_output'
+    metrics = supervisor.supervise('xfake', str(outdir), max_restarts=2,
+                                   restart=False)
+    assert metrics['returncode'] == 0
+    assert open(outdir / 'runs.txt').read().split() == ['run', 'run']
+    assert "fort.chk00005" in open(outdir / 'restarted_from.txt').read()
+
+
+def test_supervise_gives_up(rundir):
+    with pytest.raises(runclaw.ClawExeError):
+        supervisor.supervise('xfake', str(rundir / '_output'),
+                             max_restarts=0, restart=False)